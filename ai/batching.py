@@ -0,0 +1,209 @@
+"""
+动态微批推理调度器
+
+在一个很短的时间窗口内收集并发请求的图片，合并为一次批量前向推理，
+再把每张图片的结果分发回各自等待的请求。
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ai.inference import classify_batch
+
+# 调度器配置
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "10"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_QUEUE_DEPTH = int(os.getenv("BATCH_QUEUE_DEPTH", "64"))
+
+
+class SchedulerOverloadedError(RuntimeError):
+    """等待队列已满，调度器拒绝新的推理请求"""
+
+
+class BatchScheduler:
+    """
+    进程内的动态微批调度器
+
+    第一张图片到达后最多等待 window_ms 毫秒，或凑满 max_batch_size 张，
+    然后通过 runner 在后台执行器中执行一次批量推理。
+    concurrency 个调度循环并行工作，以便喂满多个推理工作者。
+    """
+
+    def __init__(
+        self,
+        infer_fn: Callable[[List[Any]], List[Any]] = classify_batch,
+        window_ms: float = BATCH_WINDOW_MS,
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_queue_size: int = BATCH_QUEUE_DEPTH,
+        runner: Optional[Callable[..., Awaitable[Any]]] = None,
+        concurrency: int = 1
+    ):
+        self.infer_fn = infer_fn
+        self.window = max(window_ms, 0.0) / 1000.0
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_queue_size = max(max_queue_size, 1)
+        self.runner = runner
+        self.concurrency = max(concurrency, 1)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+        # 指标
+        self._batches_total = 0
+        self._images_total = 0
+        self._rejected_total = 0
+        self._batch_size_counts: Dict[int, int] = {}
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        """调度循环是否在运行"""
+        return any(not task.done() for task in self._tasks)
+
+    def start(self):
+        """在当前事件循环中启动调度循环"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._run()) for _ in range(self.concurrency)]
+        print(
+            f"微批调度器已启动: 窗口 {self.window * 1000:.0f}ms, "
+            f"最大批量 {self.max_batch_size}, 队列深度 {self.max_queue_size}, "
+            f"并发 {self.concurrency}"
+        )
+
+    async def stop(self):
+        """停止调度循环，未处理的请求以异常结束"""
+        if not self._tasks:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("推理调度器已停止"))
+
+    async def submit(self, image: Any) -> Any:
+        """
+        提交一张图片并等待其推理结果
+
+        Args:
+            image: 传给推理函数的单张图片
+
+        Returns:
+            该图片的推理结果
+
+        Raises:
+            SchedulerOverloadedError: 等待队列已满
+        """
+        if not self.running:
+            self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((image, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self._rejected_total += 1
+            raise SchedulerOverloadedError("推理队列已满，请稍后重试")
+
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[Any, asyncio.Future, float]]:
+        """等待第一张图片，然后在时间窗口内尽量凑满一批"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        """调度循环：收集一批 -> 批量推理 -> 分发结果"""
+        while True:
+            batch = await self._collect_batch()
+
+            # 丢弃已被调用方取消的请求
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            dispatched_at = time.perf_counter()
+            self._record_batch(batch, dispatched_at)
+
+            images = [image for image, _, _ in batch]
+            try:
+                results = await self._infer(images)
+            except asyncio.CancelledError:
+                self._fail_batch(batch, RuntimeError("推理调度器已停止"))
+                raise
+            except Exception as e:
+                self._fail_batch(batch, e)
+                continue
+
+            if len(results) != len(batch):
+                self._fail_batch(batch, RuntimeError("批量推理结果数量与输入不一致"))
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _infer(self, images: List[Any]) -> List[Any]:
+        """在后台执行器中执行推理函数，避免阻塞事件循环"""
+        if self.runner is not None:
+            return await self.runner(self.infer_fn, images)
+        return await asyncio.get_running_loop().run_in_executor(None, self.infer_fn, images)
+
+    @staticmethod
+    def _fail_batch(batch: List[Tuple[Any, asyncio.Future, float]], error: Exception):
+        """把异常分发给整批等待中的请求"""
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _record_batch(self, batch: List[Tuple[Any, asyncio.Future, float]], dispatched_at: float):
+        """记录批量大小和排队等待时间"""
+        size = len(batch)
+        self._batches_total += 1
+        self._images_total += size
+        self._batch_size_counts[size] = self._batch_size_counts.get(size, 0) + 1
+        for _, _, enqueued_at in batch:
+            wait = dispatched_at - enqueued_at
+            self._queue_wait_total += wait
+            self._queue_wait_max = max(self._queue_wait_max, wait)
+
+    def metrics(self) -> Dict[str, Any]:
+        """获取调度器指标"""
+        images = self._images_total
+        return {
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches_total": self._batches_total,
+            "images_total": images,
+            "rejected_total": self._rejected_total,
+            "avg_batch_size": round(images / self._batches_total, 3) if self._batches_total else 0.0,
+            "batch_size_histogram": dict(sorted(self._batch_size_counts.items())),
+            "avg_queue_wait_ms": round(self._queue_wait_total / images * 1000, 3) if images else 0.0,
+            "max_queue_wait_ms": round(self._queue_wait_max * 1000, 3),
+        }
@@ -0,0 +1,270 @@
+"""
+检测结果缓存
+
+以上传图片字节的SHA-256、模型版本和推理参数作为键缓存检测结果，
+重复上传的图片直接返回缓存结果，无需再次推理。
+内存层为带容量和过期时间限制的LRU，可选的SQLite磁盘层在重启后仍然有效。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from ai.inference import MODEL_PATH, DetectionResult, inference_params, model_registry
+
+# 缓存配置
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "2048"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", "")  # 为空时不启用磁盘层
+RESULT_CACHE_DISK_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_DISK_MAX_ENTRIES", "100000"))
+
+Results = List[DetectionResult]
+
+
+class ResultCache:
+    """
+    两级检测结果缓存
+
+    键中包含模型版本，模型切换后旧结果不会再命中，
+    invalidate 会顺带清理旧版本的条目。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+        disk_path: str = RESULT_CACHE_DB,
+        disk_max_entries: int = RESULT_CACHE_DISK_MAX_ENTRIES,
+        model_path: str = MODEL_PATH
+    ):
+        self.max_entries = max(max_entries, 0)
+        self.ttl = ttl_seconds
+        self.disk_path = disk_path
+        self.disk_max_entries = max(disk_max_entries, 1)
+        self.model_path = model_path
+
+        self._memory: "OrderedDict[str, Tuple[float, Results]]" = OrderedDict()
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        # 磁盘层条目数只在打开时统计一次，之后随写入和删除维护，写入时不必全表计数
+        self._disk_entries = 0
+        if disk_path:
+            self._disk = self._open_disk(disk_path)
+            self._disk_entries = self._disk.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+
+        # 指标
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def _open_disk(path: str) -> sqlite3.Connection:
+        """打开磁盘层数据库，缓存访问都在锁内进行，因此允许跨线程使用连接"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS result_cache ("
+            "key TEXT PRIMARY KEY, version TEXT NOT NULL, "
+            "results TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_result_cache_created_at ON result_cache (created_at)")
+        conn.commit()
+        return conn
+
+    def make_key(self, data: bytes, version: Optional[str] = None, options: Optional[Dict[str, object]] = None) -> str:
+        """
+        由图片字节、模型版本和推理参数计算缓存键
+
+        Args:
+            data: 图片原始字节
+            version: 模型版本，默认取注册表中的当前版本
+            options: 单次请求的推理选项（例如切片参数）
+        """
+        if version is None:
+            version = model_registry.version(self.model_path)
+        params = json.dumps({**inference_params(), **(options or {})}, sort_keys=True)
+        digest = hashlib.sha256(data).hexdigest()
+        return hashlib.sha256(f"{digest}|{version}|{params}".encode()).hexdigest()
+
+    def lookup(self, data: bytes, options: Optional[Dict[str, object]] = None) -> Tuple[str, Optional[Results]]:
+        """
+        计算缓存键并查找结果
+
+        发现模型版本变化（例如权重文件被替换）时先让旧版本的结果失效。
+
+        Returns:
+            Tuple: (缓存键, 缓存结果或None)
+        """
+        version = model_registry.version(self.model_path)
+        if version != self._version:
+            if self._version is not None:
+                self.on_model_swap(self._version, version)
+            self._version = version
+        key = self.make_key(data, version, options)
+        return key, self.get(key)
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[Results]:
+        """查找缓存结果，未命中返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    self._hits += 1
+                    return list(entry[1])
+                del self._memory[key]
+                self._expirations += 1
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT results, created_at FROM result_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        results = _normalize(json.loads(row[0]))
+                        self._store_memory(key, row[1], results)
+                        self._hits += 1
+                        self._disk_hits += 1
+                        return list(results)
+                    cursor = self._disk.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+                    self._disk.commit()
+                    self._disk_entries -= max(cursor.rowcount, 0)
+                    self._expirations += 1
+
+            self._misses += 1
+            return None
+
+    def put(self, key: str, results: Results, version: Optional[str] = None):
+        """
+        写入缓存结果
+
+        查找之后模型发生了切换时不写入：这期间的结果可能来自新旧任一模型，
+        不能保存在查找时的版本下。
+        """
+        current = model_registry.version(self.model_path)
+        if version is None:
+            version = self._version or current
+        if version != current:
+            return
+        results = _normalize(results)
+        now = time.time()
+        with self._lock:
+            self._store_memory(key, now, results)
+            if self._disk is not None:
+                row = (key, version, json.dumps(results), now)
+                cursor = self._disk.execute(
+                    "INSERT OR IGNORE INTO result_cache (key, version, results, created_at) VALUES (?, ?, ?, ?)", row
+                )
+                if cursor.rowcount == 1:
+                    self._disk_entries += 1
+                else:
+                    self._disk.execute(
+                        "UPDATE result_cache SET version = ?, results = ?, created_at = ? WHERE key = ?",
+                        (*row[1:], key)
+                    )
+                self._trim_disk()
+                self._disk.commit()
+
+    def _store_memory(self, key: str, created_at: float, results: Results):
+        """写入内存层，超出容量时淘汰最久未使用的条目（需持有锁）"""
+        if self.max_entries == 0:
+            return
+        self._memory[key] = (created_at, results)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._evictions += 1
+
+    def _trim_disk(self):
+        """磁盘层超出容量时删除最早写入的条目（需持有锁）"""
+        overflow = self._disk_entries - self.disk_max_entries
+        if overflow > 0:
+            cursor = self._disk.execute(
+                "DELETE FROM result_cache WHERE key IN "
+                "(SELECT key FROM result_cache ORDER BY created_at LIMIT ?)",
+                (overflow,)
+            )
+            deleted = max(cursor.rowcount, 0)
+            self._disk_entries -= deleted
+            self._evictions += deleted
+
+    def invalidate(self, keep_version: Optional[str] = None):
+        """
+        清空内存层，并删除磁盘层中不属于 keep_version 的条目
+
+        Args:
+            keep_version: 需要保留的模型版本，为None时清空全部条目
+        """
+        with self._lock:
+            removed = len(self._memory)
+            self._memory.clear()
+            if self._disk is not None:
+                if keep_version is None:
+                    cursor = self._disk.execute("DELETE FROM result_cache")
+                else:
+                    cursor = self._disk.execute(
+                        "DELETE FROM result_cache WHERE version != ?", (keep_version,)
+                    )
+                removed += max(cursor.rowcount, 0)
+                self._disk_entries -= max(cursor.rowcount, 0)
+                self._disk.commit()
+            self._invalidations += 1
+        print(f"结果缓存已失效，清理 {removed} 条记录")
+
+    def on_model_swap(self, old_version: str, new_version: str):
+        """模型切换回调，旧版本的结果全部失效"""
+        self._version = new_version
+        if old_version != new_version:
+            self.invalidate(keep_version=new_version)
+
+    def close(self):
+        """关闭磁盘层连接"""
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+    def metrics(self) -> Dict[str, object]:
+        """缓存运行指标"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            disk_entries = self._disk_entries if self._disk is not None else None
+            return {
+                "enabled": True,
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "disk_enabled": self._disk is not None,
+                "disk_entries": disk_entries,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
+
+
+def _normalize(results: List) -> Results:
+    """统一为 (类别, 置信度, 检测框) 元组，检测框在JSON中保存为列表"""
+    return [
+        (name, float(confidence), tuple(box) if box is not None else None)
+        for name, confidence, box in results
+    ]
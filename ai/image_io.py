@@ -0,0 +1,140 @@
+"""
+图片头部探测和像素数限制
+
+高压缩率的小文件（例如纯色PNG）解码后可能占用数GB内存。
+解码前先只读取文件头获得格式和尺寸，超过像素上限的图片直接拒绝，
+JPEG则可以在DCT域按 1/2、1/4、1/8 缩小解码，峰值内存和解码耗时都随之下降。
+模型只需要 640 像素左右的输入，手机和无人机拍摄的JPEG也按模型输入尺寸缩小解码。
+"""
+import io
+import os
+from typing import NamedTuple, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 像素数限制
+MAX_IMAGE_MEGAPIXELS = float(os.getenv("MAX_IMAGE_MEGAPIXELS", "64"))
+MAX_IMAGE_PIXELS = int(MAX_IMAGE_MEGAPIXELS * 1_000_000)
+# 超限图片的处理方式：downscale（JPEG缩小解码，其他格式拒绝）或 reject（一律拒绝）
+IMAGE_OVERSIZE_POLICY = os.getenv("IMAGE_OVERSIZE_POLICY", "downscale")
+# 探测时先只读取文件开头的字节，读不到尺寸时再使用完整数据
+PROBE_HEAD_BYTES = 64 * 1024
+
+# JPEG在DCT域缩小解码的倍数和对应的OpenCV标志
+JPEG_REDUCED_FLAGS = (
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+)
+
+# 像素数由本模块按配置限制，关闭PIL自带的解压炸弹检查以便读取超大图片的尺寸
+Image.MAX_IMAGE_PIXELS = None
+
+ImageBuffer = Union[bytes, bytearray, memoryview]
+
+
+class ImageInfo(NamedTuple):
+    """文件头中读取到的图片信息"""
+    format: str
+    width: int
+    height: int
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+
+class ImageTooLargeError(ValueError):
+    """图片像素数超过限制且无法缩小解码"""
+
+    def __init__(self, info: ImageInfo, max_pixels: int):
+        super().__init__(
+            f"图片尺寸过大（{info.width}x{info.height}，最多{max_pixels / 1_000_000:g}百万像素）"
+        )
+        self.info = info
+        self.max_pixels = max_pixels
+
+
+def _probe(source) -> Optional[ImageInfo]:
+    try:
+        # Image.open 只解析文件头，不解码像素
+        with Image.open(source) as image:
+            width, height = image.size
+            return ImageInfo(image.format or "", width, height)
+    except Exception:
+        return None
+
+
+def probe_image(data: ImageBuffer) -> Optional[ImageInfo]:
+    """
+    只读取文件头获取图片格式和尺寸
+
+    Args:
+        data: 图片原始字节或memoryview
+
+    Returns:
+        Optional[ImageInfo]: 无法识别的数据返回None
+    """
+    view = memoryview(data)
+    if len(view) == 0:
+        return None
+    if len(view) > PROBE_HEAD_BYTES:
+        info = _probe(io.BytesIO(view[:PROBE_HEAD_BYTES]))
+        if info is not None:
+            return info
+    return _probe(io.BytesIO(view))
+
+
+def probe_image_file(path: str) -> Optional[ImageInfo]:
+    """只读取文件头获取图片文件的格式和尺寸"""
+    return _probe(path)
+
+
+def _reduced_size(info: ImageInfo, factor: int) -> Tuple[int, int]:
+    """按倍数缩小解码后的 (宽, 高)，与libjpeg一样向上取整"""
+    return -(-info.width // factor), -(-info.height // factor)
+
+
+def reduced_decode_factor(
+    info: ImageInfo,
+    max_pixels: int = MAX_IMAGE_PIXELS,
+    target_size: Optional[int] = None
+) -> int:
+    """
+    选择JPEG缩小解码的倍数，其他格式始终为1
+
+    Args:
+        info: 文件头信息
+        max_pixels: 解码后的最大像素数，超限的JPEG取能满足上限的最小倍数
+        target_size: 模型输入尺寸，取缩小后长边仍不小于它的最大倍数；为None时不按输入尺寸缩小
+
+    Raises:
+        ImageTooLargeError: 按策略应拒绝，或缩小8倍后仍然超限
+    """
+    factor = 1
+    if target_size and info.format == "JPEG":
+        for candidate, _ in JPEG_REDUCED_FLAGS:
+            if max(_reduced_size(info, candidate)) >= target_size:
+                factor = candidate
+
+    width, height = _reduced_size(info, factor)
+    if width * height <= max_pixels:
+        return factor
+    if IMAGE_OVERSIZE_POLICY == "downscale" and info.format == "JPEG":
+        for candidate, _ in JPEG_REDUCED_FLAGS:
+            width, height = _reduced_size(info, candidate)
+            if candidate > factor and width * height <= max_pixels:
+                return candidate
+    raise ImageTooLargeError(info, max_pixels)
+
+
+def imdecode_reduced(buffer: np.ndarray, factor: int) -> Optional[np.ndarray]:
+    """
+    按倍数解码图片，factor为1时完整解码
+
+    OpenCV在解码后按EXIF方向旋转，缩小解码时旋转的是缩小后的数组，几乎没有额外开销。
+    """
+    flags = dict(JPEG_REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR)
+    return cv2.imdecode(buffer, flags)
@@ -1,10 +1,51 @@
 """
 海洋垃圾检测推理模块
 """
+import hashlib
 import os
-from typing import List, Tuple
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from ultralytics import YOLO
+import torch
 import cv2
+import numpy as np
+
+from ai.image_io import (
+    MAX_IMAGE_PIXELS, imdecode_reduced, probe_image, probe_image_file, reduced_decode_factor
+)
+from ai.preprocess import preprocess_into, scale_boxes, tensor_pool
+
+# 模型配置
+MODEL_PATH = os.getenv("MODEL_PATH", "weights.pt")
+MODEL_WARMUP_RUNS = int(os.getenv("MODEL_WARMUP_RUNS", "2"))
+MODEL_WARMUP_SIZE = int(os.getenv("MODEL_WARMUP_SIZE", "640"))
+MODEL_INPUT_SIZE = int(os.getenv("MODEL_INPUT_SIZE", "640"))
+# 大尺寸JPEG按模型输入尺寸在DCT域缩小解码
+JPEG_REDUCED_DECODE = os.getenv("JPEG_REDUCED_DECODE", "1") == "1"
+DECODE_TARGET_SIZE = MODEL_INPUT_SIZE if JPEG_REDUCED_DECODE else None
+# 推理后端：ultralytics（PyTorch）、onnx（ONNX Runtime CPU）或 onnx-int8（INT8量化模型）
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "ultralytics")
+# 检查模型文件是否被替换的最短间隔（秒），0 表示不检查
+MODEL_RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", "5"))
+
+# 检测结果的最低置信度
+CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.3"))
+
+# 后端NMS阈值，与ultralytics默认值保持一致
+NMS_CONFIDENCE = 0.25
+# 低于返回阈值的框最终都会被丢弃，NMS阶段直接跳过
+NMS_MIN_CONFIDENCE = max(NMS_CONFIDENCE, CONFIDENCE_THRESHOLD)
+NMS_IOU = 0.7
+MAX_DETECTIONS = 300
+
+# 推理函数接受的图片输入：文件路径、原始字节或已解码的BGR数组
+ImageBuffer = Union[bytes, bytearray, memoryview]
+ImageSource = Union[str, ImageBuffer, np.ndarray]
+# 检测框 (x1, y1, x2, y2)，坐标为相对图片宽高的比例（0-1），与解码时是否缩小无关
+Box = Tuple[float, float, float, float]
+# 一个检测结果：(类别, 置信度, 检测框)，模拟模式下检测框为空
+DetectionResult = Tuple[str, float, Optional[Box]]
 
 # 默认的YOLO类别到海洋垃圾映射
 DEFAULT_YOLO_MAPPING = {
@@ -25,77 +66,244 @@ except ImportError:
         return DEFAULT_YOLO_MAPPING.get(yolo_class_name, 'other_trash')
 
 
-def classify_image(image_path: str) -> List[Tuple[str, float]]:
+def classify_image(image: ImageSource) -> List[DetectionResult]:
     """
     对图片进行垃圾分类
     
     Args:
-        image_path: 图片文件路径
+        image: 图片文件路径、上传的原始字节（bytes/memoryview）或已解码的BGR数组
         
     Returns:
-        List[Tuple[str, float]]: 检测结果列表，格式为 [("label", confidence), ...]
+        List[DetectionResult]: 检测结果列表，格式为 [("label", confidence, (x1, y1, x2, y2)), ...]
     """
     try:
-        # 检查图片文件是否存在
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"图片文件未找到: {image_path}")
-        
-        # 检查模型文件
-        model_path = "weights.pt"
-        if not os.path.exists(model_path):
-            print(f"⚠️ 模型文件未找到: {model_path}，使用模拟模式")
-            # 模拟模式：返回随机检测结果用于测试
-            import random
-            mock_categories = ["plastic_bottle", "plastic_bag", "can", "paper"]
-            detections = []
-            
-            # 随机生成1-3个检测结果
-            num_detections = random.randint(1, 3)
-            for _ in range(num_detections):
-                category = random.choice(mock_categories)
-                confidence = random.uniform(0.4, 0.95)  # 随机置信度
-                detections.append((category, confidence))
-            
-            # 按置信度排序
-            detections.sort(key=lambda x: x[1], reverse=True)
-            return detections
-            
-        # 真实模式：使用YOLOv8模型
-        model = YOLO(model_path)
-        
-        # 进行推理
-        results = model(image_path)
-        
-        # 处理结果
-        detections = []
-        for result in results:
-            if result.boxes is not None:
-                for box in result.boxes:
-                    # 获取类别和置信度
-                    class_id = int(box.cls[0])
-                    confidence = float(box.conf[0])
-                    
-                    # 获取YOLO类别名称
-                    yolo_class_name = model.names[class_id] if class_id < len(model.names) else "unknown"
-                    
-                    # 映射到海洋垃圾类别
-                    trash_category = map_yolo_to_trash(yolo_class_name)
-                    
-                    # 只返回置信度大于0.3且映射到垃圾类别的检测结果
-                    if confidence > 0.3 and trash_category is not None:
-                        detections.append((trash_category, confidence))
-        
-        # 按置信度排序
-        detections.sort(key=lambda x: x[1], reverse=True)
-        
-        return detections
+        return _classify_arrays([load_image(image)])[0]
         
     except Exception as e:
         print(f"推理过程中发生错误: {str(e)}")
         raise RuntimeError(f"图片分类失败: {str(e)}")
 
 
-def load_model(model_path: str = "weights.pt"):
+def classify_batch(images: List[ImageSource]) -> List[List[DetectionResult]]:
+    """
+    对一批图片执行一次批量前向推理
+    
+    Args:
+        images: 图片列表，每项可以是文件路径、原始字节或已解码的BGR数组
+        
+    Returns:
+        List[List[DetectionResult]]: 与输入顺序一致的每张图片检测结果
+    """
+    try:
+        return _classify_arrays([load_image(image) for image in images])
+        
+    except Exception as e:
+        print(f"批量推理过程中发生错误: {str(e)}")
+        raise RuntimeError(f"批量图片分类失败: {str(e)}")
+
+
+def _classify_arrays(arrays: List[np.ndarray]) -> List[List[DetectionResult]]:
+    """对已解码的图片数组执行一次批量前向推理"""
+    # 检查模型文件
+    model_path = MODEL_PATH
+    if not os.path.exists(model_path):
+        print(f"⚠️ 模型文件未找到: {model_path}，使用模拟模式")
+        return [_mock_detections() for _ in arrays]
+        
+    # 真实模式：复用注册表中已加载的推理后端
+    backend = model_registry.get(model_path)
+    
+    # 整批图片一次前向推理，直接使用内存中的数组
+    outputs = backend.predict(arrays)
+    
+    return [
+        _postprocess_boxes(boxes, backend.class_lookup, array.shape)
+        for boxes, array in zip(outputs, arrays)
+    ]
+
+
+def decode_image(
+    data: Union[ImageBuffer, np.ndarray],
+    max_pixels: int = MAX_IMAGE_PIXELS,
+    target_size: Optional[int] = None
+) -> Optional[np.ndarray]:
+    """
+    直接从内存缓冲区解码图片，不经过临时文件
+    
+    解码前先读取文件头中的尺寸，超过像素上限的JPEG缩小解码，其他超限图片直接拒绝。
+    
+    Args:
+        data: 图片原始字节、memoryview或已解码的数组
+        max_pixels: 解码后的最大像素数
+        target_size: 解码结果只用于整图推理时传入模型输入尺寸（通常为 DECODE_TARGET_SIZE），
+                     JPEG按不小于该尺寸的最大倍数缩小解码
+        
+    Returns:
+        Optional[np.ndarray]: BGR格式的图片数组，无法解码时返回None
+        
+    Raises:
+        ImageTooLargeError: 图片像素数超过限制且无法缩小解码
+    """
+    if isinstance(data, np.ndarray):
+        return _ensure_bgr(data)
+    
+    info = probe_image(data)
+    if info is None:
+        return None
+    factor = reduced_decode_factor(info, max_pixels, target_size)
+    return imdecode_reduced(np.frombuffer(data, dtype=np.uint8), factor)
+
+
+def load_image(image: ImageSource) -> np.ndarray:
+    """
+    将任意支持的图片输入转换为BGR数组
+    
+    Args:
+        image: 图片文件路径、原始字节或已解码的数组
+        
+    Returns:
+        np.ndarray: BGR格式的图片数组
+    """
+    if isinstance(image, str):
+        # 文件路径接口只是内存接口的薄封装，同样经过像素上限检查和缩小解码
+        if not os.path.exists(image):
+            raise FileNotFoundError(f"图片文件未找到: {image}")
+        with open(image, "rb") as f:
+            image = f.read()
+    array = decode_image(image, target_size=DECODE_TARGET_SIZE)
+    
+    if array is None:
+        raise ValueError("无法解码图片数据")
+    return array
+
+
+def _ensure_bgr(image: np.ndarray) -> Optional[np.ndarray]:
+    """将灰度或带透明通道的数组统一为3通道BGR"""
+    if image.size == 0:
+        return None
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.ndim == 3 and image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    if image.ndim == 3 and image.shape[2] == 3:
+        return image
+    return None
+
+
+def _mock_detections() -> List[DetectionResult]:
+    """模拟模式：返回随机检测结果用于测试"""
+    import random
+    mock_categories = ["plastic_bottle", "plastic_bag", "can", "paper"]
+    detections = []
+    
+    # 随机生成1-3个检测结果
+    num_detections = random.randint(1, 3)
+    for _ in range(num_detections):
+        category = random.choice(mock_categories)
+        confidence = random.uniform(0.4, 0.95)  # 随机置信度
+        detections.append((category, confidence, None))
+    
+    # 按置信度排序
+    detections.sort(key=lambda x: x[1], reverse=True)
+    return detections
+
+
+def build_class_lookup(names: Dict[int, str]) -> np.ndarray:
+    """
+    预先计算YOLO类别ID到海洋垃圾类别的查找表
+    
+    Args:
+        names: YOLO类别ID到名称的映射
+        
+    Returns:
+        np.ndarray: 长度为 类别数+1 的object数组，不属于垃圾的类别为None，
+                    最后一项对应超出范围的未知类别
+    """
+    size = max(names) + 1 if names else 0
+    lookup = np.empty(size + 1, dtype=object)
+    for class_id in range(size):
+        lookup[class_id] = map_yolo_to_trash(names.get(class_id, "unknown"))
+    lookup[size] = map_yolo_to_trash("unknown")
+    return lookup
+
+
+def _postprocess_boxes(
+    boxes: np.ndarray, class_lookup: np.ndarray, image_shape: Tuple[int, ...]
+) -> List[DetectionResult]:
+    """
+    将单张图片的检测框转换为海洋垃圾检测结果
+    
+    Args:
+        boxes: 形状为 (N, 6) 的数组，每行为 [x1, y1, x2, y2, confidence, class_id]
+        class_lookup: build_class_lookup 生成的类别查找表
+        image_shape: 推理所用图片数组的形状，检测框按其宽高换算为比例坐标
+    """
+    if len(boxes) == 0:
+        return []
+    
+    # 整批检测框一次完成类别映射，超出范围的ID指向查找表最后一项
+    confidences = boxes[:, 4]
+    class_ids = np.clip(boxes[:, 5].astype(np.int64), 0, len(class_lookup) - 1)
+    categories = class_lookup[class_ids]
+    
+    # 只返回置信度大于阈值且映射到垃圾类别的检测结果，按置信度排序
+    keep = np.flatnonzero((confidences > CONFIDENCE_THRESHOLD) & (categories != None))  # noqa: E711
+    keep = keep[np.argsort(-confidences[keep], kind="stable")]
+    
+    height, width = image_shape[:2]
+    xyxyn = (boxes[keep, :4] / np.array([width, height, width, height], dtype=np.float32)).clip(0.0, 1.0)
+    return list(zip(
+        categories[keep].tolist(),
+        confidences[keep].tolist(),
+        [tuple(box) for box in np.round(xyxyn, 5).tolist()]
+    ))
+
+
+def inference_params() -> Dict[str, object]:
+    """影响检测结果的推理参数，用于结果缓存的键"""
+    return {
+        "input_size": MODEL_INPUT_SIZE,
+        "decode_target_size": DECODE_TARGET_SIZE,
+        "confidence": CONFIDENCE_THRESHOLD,
+        "nms_confidence": NMS_CONFIDENCE,
+        "nms_iou": NMS_IOU,
+        "max_detections": MAX_DETECTIONS,
+        "boxes": "xyxyn",
+    }
+
+
+def weights_hash(model_path: str) -> str:
+    """计算权重文件的SHA-256哈希"""
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(path: str) -> Optional[Tuple[float, int]]:
+    """文件的 (修改时间, 大小)，文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+def served_artifact(model_path: str = MODEL_PATH, backend: str = INFERENCE_BACKEND) -> str:
+    """
+    决定检测结果的模型文件
+
+    PyTorch和FP32 ONNX后端的结果由权重文件唯一确定（ONNX缓存按权重哈希命名）；
+    INT8模型可以在原路径重新量化，按量化产物本身计算版本。
+    """
+    if backend == "onnx-int8":
+        from ai.onnx_backend import onnx_cache_path
+        return onnx_cache_path(model_path, MODEL_INPUT_SIZE, variant="int8")
+    return model_path
+
+
+def load_model(model_path: str = MODEL_PATH):
     """
     预加载模型（用于优化性能）
     
@@ -118,33 +326,384 @@ def load_model(model_path: str = "weights.pt"):
         raise RuntimeError(f"无法加载模型: {str(e)}")
 
 
-def validate_image(image_path: str) -> bool:
+class InferenceBackend:
+    """
+    推理后端接口
+
+    后端负责预处理、前向推理和NMS，输出原图坐标系下的检测框，
+    类别映射和置信度过滤由 classify_batch 统一完成。
     """
-    验证图片文件是否有效
+
+    name = "base"
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        # 同一后端实例的推理调用需要串行
+        self._lock = threading.Lock()
+        self._class_lookup: Optional[np.ndarray] = None
+        self._allowed_classes: Optional[Tuple[Optional[List[int]]]] = None
+        # 加载时由注册表根据实际加载的模型文件填写
+        self.version = "unloaded"
+        self.signature: Tuple[Optional[Tuple[float, int]], ...] = ()
+
+    @property
+    def artifact_path(self) -> str:
+        """决定检测结果的模型文件，用于计算模型版本"""
+        return self.model_path
+
+    @property
+    def names(self) -> Dict[int, str]:
+        """类别ID到YOLO类别名称的映射"""
+        raise NotImplementedError
+
+    @property
+    def class_lookup(self) -> np.ndarray:
+        """类别ID到海洋垃圾类别的查找表，首次使用时生成"""
+        if self._class_lookup is None:
+            self._class_lookup = build_class_lookup(self.names)
+        return self._class_lookup
+
+    @property
+    def allowed_classes(self) -> Optional[List[int]]:
+        """
+        映射到垃圾类别的YOLO类别ID，传给NMS以跳过人、车辆等无关类别
+
+        所有类别都有效时返回None，表示不做类别过滤。
+        """
+        if self._allowed_classes is None:
+            known = self.class_lookup[:-1]
+            allowed = [int(class_id) for class_id in np.flatnonzero(known != None)]  # noqa: E711
+            self._allowed_classes = (None if len(allowed) == len(known) else allowed,)
+        return self._allowed_classes[0]
+
+    def predict(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        对一批BGR图片执行推理
+        
+        Args:
+            images: BGR格式的图片数组列表
+            
+        Returns:
+            List[np.ndarray]: 每张图片一个 (N, 6) 数组，每行为 [x1, y1, x2, y2, confidence, class_id]
+        """
+        raise NotImplementedError
+
+    def warmup(self, runs: int, image_size: int):
+        """用合成图片执行若干次推理"""
+        # 灰色背景的合成图片，与YOLO letterbox填充色一致
+        dummy = np.full((image_size, image_size, 3), 114, dtype=np.uint8)
+        for _ in range(max(runs, 0)):
+            self.predict([dummy])
+
+
+class UltralyticsBackend(InferenceBackend):
+    """基于ultralytics YOLO（PyTorch）的推理后端"""
+
+    name = "ultralytics"
+
+    def __init__(self, model_path: str, input_size: int = MODEL_INPUT_SIZE):
+        super().__init__(model_path)
+        self.input_size = input_size
+        self.model = load_model(model_path)
+
+    @property
+    def names(self) -> Dict[int, str]:
+        return self.model.names
+
+    def predict(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        # 与ONNX后端共用张量池：预处理结果原地写入借用的张量，以零拷贝的torch张量交给模型，
+        # ultralytics对已归一化的NCHW张量不再做letterbox，检测框需按letterbox参数映射回原图
+        with tensor_pool.lease(len(images), self.input_size) as batch:
+            metas = preprocess_into(images, batch)
+            # YOLO预测器不是线程安全的
+            with self._lock:
+                results = self.model(
+                    torch.from_numpy(batch),
+                    imgsz=self.input_size,
+                    conf=NMS_MIN_CONFIDENCE,
+                    iou=NMS_IOU,
+                    max_det=MAX_DETECTIONS,
+                    classes=self.allowed_classes,
+                    batch=len(images)
+                )
+            outputs = [
+                result.boxes.data.cpu().numpy() if result.boxes is not None
+                else np.zeros((0, 6), dtype=np.float32)
+                for result in results
+            ]
+        for boxes, image, (ratio, pad) in zip(outputs, images, metas):
+            boxes[:, :4] = scale_boxes(boxes[:, :4], image.shape, ratio, pad)
+        return outputs
+
+
+def create_backend(model_path: str = MODEL_PATH, backend: str = INFERENCE_BACKEND) -> InferenceBackend:
+    """
+    按名称创建推理后端
     
     Args:
-        image_path: 图片文件路径
+        model_path: 模型权重文件路径
+        backend: 后端名称，ultralytics、onnx 或 onnx-int8
+        
+    Returns:
+        InferenceBackend: 推理后端实例
+    """
+    if backend == "ultralytics":
+        return UltralyticsBackend(model_path)
+    if backend == "onnx":
+        from ai.onnx_backend import OnnxBackend
+        return OnnxBackend(model_path)
+    if backend == "onnx-int8":
+        from ai.onnx_backend import OnnxBackend
+        return OnnxBackend(model_path, variant="int8")
+    raise ValueError(f"未知的推理后端: {backend}")
+
+
+class ModelRegistry:
+    """
+    进程级模型注册表
+
+    每个进程只加载一次模型权重，并在服务启动时用合成图片预热，
+    推理时直接复用已加载的推理后端。
+    模型版本取自实际加载的模型文件；权重文件或INT8模型被替换后，
+    下一次推理前重新加载（最多每 MODEL_RELOAD_INTERVAL 秒检查一次）。
+    """
+
+    def __init__(self, backend: str = INFERENCE_BACKEND, reload_interval: float = MODEL_RELOAD_INTERVAL):
+        self.backend = backend
+        self.reload_interval = reload_interval
+        self._models: Dict[str, InferenceBackend] = {}
+        self._states: Dict[str, str] = {}
+        # 模型文件 -> (文件签名, 模型文件, 版本)，只在主进程不加载模型时使用
+        self._versions: Dict[str, Tuple[Tuple[Optional[Tuple[float, int]], ...], str, str]] = {}
+        self._next_check: Dict[str, float] = {}
+        self._swap_listeners: List[Callable[[str, str], None]] = []
+        self._lock = threading.Lock()
+        self._swap_lock = threading.Lock()
+
+    def _signature(self, model_path: str, artifact_path: str) -> Tuple[Optional[Tuple[float, int]], ...]:
+        return file_signature(model_path), file_signature(artifact_path)
+
+    def _load(self, model_path: str) -> InferenceBackend:
+        """创建推理后端，并按实际加载的模型文件记录版本"""
+        model = create_backend(model_path, self.backend)
+        model.signature = self._signature(model_path, model.artifact_path)
+        model.version = f"{model.name}:{weights_hash(model.artifact_path)[:16]}"
+        self._next_check[model_path] = time.monotonic() + self.reload_interval
+        return model
+
+    def get(self, model_path: str = MODEL_PATH) -> InferenceBackend:
+        """
+        获取推理后端实例，尚未加载时按需加载
+
+        模型文件被替换时先切换到新模型，切换期间调用方等待加载完成。
+
+        Args:
+            model_path: 模型文件路径
+
+        Returns:
+            InferenceBackend: 已加载的推理后端
+        """
+        model = self._models.get(model_path)
+        if model is not None:
+            if self._changed(model):
+                self.swap(model_path, only_if_changed=True)
+                return self._models[model_path]
+            return model
+
+        with self._lock:
+            model = self._models.get(model_path)
+            if model is None:
+                self._states[model_path] = "loading"
+                try:
+                    model = self._load(model_path)
+                except Exception:
+                    self._states[model_path] = "failed"
+                    raise
+                self._models[model_path] = model
+                self._states[model_path] = "loaded"
+        return model
+
+    def _changed(self, model: InferenceBackend) -> bool:
+        """按间隔检查已加载的模型文件是否被替换"""
+        if self.reload_interval <= 0:
+            return False
+        now = time.monotonic()
+        if now < self._next_check.get(model.model_path, 0.0):
+            return False
+        self._next_check[model.model_path] = now + self.reload_interval
+        # 权重变化时INT8模型的路径随之变化，已加载的模型文件足以发现替换
+        signature = self._signature(model.model_path, model.artifact_path)
+        # 文件被删除时继续使用已加载的模型
+        return None not in signature and signature != model.signature
+
+    def version(self, model_path: str = MODEL_PATH, refresh: bool = True) -> str:
+        """
+        当前模型版本，由后端名称和实际提供检测结果的模型文件哈希组成
+
+        已加载模型时直接返回加载时记录的版本。推理在子进程中执行时主进程不加载模型，
+        按推理进程将要加载的文件计算，文件的修改时间和大小不变时复用上次的哈希。
+        计算哈希需要读取整个文件，不要在事件循环中以 refresh=True 调用。
+
+        Args:
+            refresh: 为False时只返回已知的版本，不读取文件
+        """
+        if not os.path.exists(model_path):
+            return "mock"
+        model = self._models.get(model_path)
+        if model is not None:
+            return model.version
+
+        cached = self._versions.get(model_path)
+        if not refresh:
+            return cached[2] if cached is not None else "unloaded"
+        if cached is not None and cached[0] == self._signature(model_path, cached[1]):
+            return cached[2]
+        artifact_path = served_artifact(model_path, self.backend)
+        if not os.path.exists(artifact_path):
+            return "unloaded"
+        signature = self._signature(model_path, artifact_path)
+        version = f"{self.backend}:{weights_hash(artifact_path)[:16]}"
+        self._versions[model_path] = (signature, artifact_path, version)
+        return version
+
+    def add_swap_listener(self, listener: Callable[[str, str], None]):
+        """注册模型切换回调，参数为 (旧版本, 新版本)"""
+        self._swap_listeners.append(listener)
+
+    def swap(self, model_path: str = MODEL_PATH, only_if_changed: bool = False) -> bool:
+        """
+        重新加载并预热模型，成功后替换旧实例并通知监听者
+
+        Args:
+            model_path: 模型文件路径
+            only_if_changed: 模型文件与已加载的相同时不重新加载（并发检测到文件变化时只切换一次）
+
+        Returns:
+            bool: 是否切换成功，失败时继续使用旧模型
+        """
+        with self._swap_lock:
+            old = self._models.get(model_path)
+            if only_if_changed and old is not None and old.signature == self._signature(
+                model_path, old.artifact_path
+            ):
+                # 其他线程已经完成了切换
+                return True
+            old_version = old.version if old is not None else "unloaded"
+            try:
+                model = self._load(model_path)
+                model.warmup(MODEL_WARMUP_RUNS, MODEL_WARMUP_SIZE)
+            except Exception as e:
+                if old is not None:
+                    # 新文件无法加载时不再反复重试，直到文件再次变化
+                    old.signature = self._signature(model_path, old.artifact_path)
+                print(f"模型切换失败，继续使用旧模型: {str(e)}")
+                return False
+
+            with self._lock:
+                self._models[model_path] = model
+                self._states[model_path] = "ready"
+        new_version = model.version
+        print(f"模型已切换: {old_version} -> {new_version}")
+
+        for listener in self._swap_listeners:
+            listener(old_version, new_version)
+        return True
+
+    def mark_ready(self, model_path: str = MODEL_PATH):
+        """标记模型已就绪（模型在推理子进程中加载时由主进程调用）"""
+        self._states[model_path] = "ready"
+
+    def warmup(
+        self,
+        model_path: str = MODEL_PATH,
+        runs: int = MODEL_WARMUP_RUNS,
+        image_size: int = MODEL_WARMUP_SIZE
+    ) -> bool:
+        """
+        加载模型并用合成图片执行若干次预热推理
+
+        Args:
+            model_path: 模型文件路径
+            runs: 预热推理次数
+            image_size: 合成图片边长
+
+        Returns:
+            bool: 预热是否成功
+        """
+        if not os.path.exists(model_path):
+            # 模拟模式无需加载模型
+            print(f"⚠️ 模型文件未找到: {model_path}，跳过预热（模拟模式）")
+            self._states[model_path] = "ready"
+            return True
+
+        try:
+            model = self.get(model_path)
+            start = time.time()
+            model.warmup(runs, image_size)
+            self._states[model_path] = "ready"
+            print(f"模型预热完成: {runs} 次推理，耗时 {time.time() - start:.3f} 秒")
+            return True
+        except Exception as e:
+            self._states[model_path] = "failed"
+            print(f"模型预热失败: {str(e)}")
+            return False
+
+    def is_ready(self, model_path: str = MODEL_PATH) -> bool:
+        """模型是否已完成加载和预热"""
+        return self._states.get(model_path) == "ready"
+
+    def status(self, model_path: str = MODEL_PATH) -> Dict[str, object]:
+        """获取模型状态信息"""
+        return {
+            "model_path": model_path,
+            "backend": self.backend,
+            "state": self._states.get(model_path, "unloaded"),
+            "ready": self.is_ready(model_path),
+            "version": self.version(model_path, refresh=False),
+            "mock_mode": not os.path.exists(model_path),
+        }
+
+
+# 全局模型注册表
+model_registry = ModelRegistry()
+
+
+def validate_image(image: Union[ImageSource, None]) -> bool:
+    """
+    验证图片是否有效
+    
+    Args:
+        image: 图片文件路径、原始字节或已解码的数组
         
     Returns:
         bool: 图片是否有效
     """
     try:
+        if image is None:
+            return False
+        
+        if isinstance(image, np.ndarray):
+            # 已解码的数组只需检查形状
+            return _ensure_bgr(image) is not None
+        
+        if not isinstance(image, str):
+            # 只读取文件头，不解码像素；超限且无法缩小解码时抛出异常，视为无效
+            info = probe_image(image)
+            return info is not None and reduced_decode_factor(info) >= 1
+        
         # 检查文件是否存在
-        if not os.path.exists(image_path):
+        if not os.path.exists(image):
             return False
             
         # 检查文件扩展名
         valid_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']
-        file_ext = os.path.splitext(image_path)[1].lower()
+        file_ext = os.path.splitext(image)[1].lower()
         if file_ext not in valid_extensions:
             return False
             
-        # 尝试读取图片
-        image = cv2.imread(image_path)
-        if image is None:
-            return False
-            
-        return True
+        # 读取文件头中的格式和尺寸，超限的图片视为无效
+        info = probe_image_file(image)
+        return info is not None and reduced_decode_factor(info) >= 1
         
     except Exception:
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,226 @@
+"""
+ONNX Runtime CPU推理后端
+
+首次使用时把 weights.pt 导出为ONNX模型并缓存到磁盘（按权重哈希和输入尺寸区分），
+之后直接用调优过的 CPUExecutionProvider 会话推理，
+letterbox预处理（ai.preprocess）和NMS后处理都不依赖PyTorch前向。
+"""
+import ast
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ai.inference import (
+    InferenceBackend, MODEL_INPUT_SIZE, NMS_MIN_CONFIDENCE, NMS_IOU, MAX_DETECTIONS, weights_hash
+)
+from ai.preprocess import preprocess_into, scale_boxes, tensor_pool
+
+# ONNX配置
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "model_cache")
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))  # 0 表示由ONNX Runtime决定
+ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS", "1"))
+# 关闭线程自旋可以避免空闲时占满CPU，与API进程共享CPU时更友好
+ONNX_ALLOW_SPINNING = os.getenv("ONNX_ALLOW_SPINNING", "0") == "1"
+ONNX_OPSET = int(os.getenv("ONNX_OPSET", "17"))
+
+
+def onnx_cache_path(
+    model_path: str,
+    input_size: int = MODEL_INPUT_SIZE,
+    variant: str = "fp32",
+    cache_dir: str = ONNX_CACHE_DIR
+) -> str:
+    """
+    ONNX模型在缓存目录中的路径，按权重哈希、输入尺寸和精度区分
+
+    Args:
+        model_path: weights.pt 路径
+        input_size: 模型输入边长
+        variant: fp32 或 int8
+        cache_dir: ONNX模型缓存目录
+    """
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    suffix = "" if variant == "fp32" else f".{variant}"
+    return os.path.join(cache_dir, f"{stem}-{weights_hash(model_path)[:16]}-{input_size}{suffix}.onnx")
+
+
+def export_onnx(model_path: str, input_size: int = MODEL_INPUT_SIZE, cache_dir: str = ONNX_CACHE_DIR) -> str:
+    """
+    把PyTorch权重导出为ONNX模型，已导出过则直接返回缓存路径
+
+    Args:
+        model_path: weights.pt 路径
+        input_size: 模型输入边长
+        cache_dir: ONNX模型缓存目录
+
+    Returns:
+        str: ONNX模型文件路径
+    """
+    onnx_path = onnx_cache_path(model_path, input_size, cache_dir=cache_dir)
+    if os.path.exists(onnx_path):
+        return onnx_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    print(f"📦 导出ONNX模型: {model_path} -> {onnx_path}")
+
+    # 在临时目录中导出，权重文件所在目录可能是只读挂载
+    work_dir = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        from ultralytics import YOLO
+        work_weights = os.path.join(work_dir, os.path.basename(model_path))
+        shutil.copy(model_path, work_weights)
+        exported = YOLO(work_weights).export(
+            format="onnx",
+            imgsz=input_size,
+            dynamic=True,
+            opset=ONNX_OPSET
+        )
+        # 原子替换，避免并发进程读到写了一半的文件
+        os.replace(exported, onnx_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"✅ ONNX模型已缓存: {onnx_path}")
+    return onnx_path
+
+
+def non_max_suppression(
+    predictions: np.ndarray,
+    conf_threshold: float = NMS_MIN_CONFIDENCE,
+    iou_threshold: float = NMS_IOU,
+    max_detections: int = MAX_DETECTIONS,
+    classes: Optional[List[int]] = None
+) -> np.ndarray:
+    """
+    对单张图片的YOLOv8原始输出做按类别NMS
+
+    Args:
+        predictions: 形状为 (4 + 类别数, 锚点数) 的原始输出，前4行为 cx, cy, w, h
+        classes: 只保留这些类别的框，None表示保留全部类别
+
+    Returns:
+        np.ndarray: (N, 6) 数组，每行为 [x1, y1, x2, y2, confidence, class_id]
+    """
+    scores = predictions[4:]
+    class_ids = scores.argmax(axis=0)
+    confidences = scores[class_ids, np.arange(scores.shape[1])]
+
+    keep = confidences > conf_threshold
+    if classes is not None:
+        keep &= np.isin(class_ids, classes)
+    if not keep.any():
+        return np.zeros((0, 6), dtype=np.float32)
+
+    cx, cy, w, h = predictions[:4, keep]
+    class_ids = class_ids[keep]
+    confidences = confidences[keep]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+    # 按类别偏移坐标，使一次NMS只在同类框之间抑制
+    offsets = class_ids[:, None].astype(np.float32) * 7680.0
+    shifted = boxes + offsets
+    xywh = np.concatenate([shifted[:, :2], shifted[:, 2:] - shifted[:, :2]], axis=1)
+    indices = cv2.dnn.NMSBoxes(xywh.tolist(), confidences.tolist(), conf_threshold, iou_threshold)
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)[:max_detections]
+
+    return np.concatenate([
+        boxes[indices],
+        confidences[indices, None],
+        class_ids[indices, None].astype(np.float32)
+    ], axis=1).astype(np.float32)
+
+
+class OnnxBackend(InferenceBackend):
+    """基于ONNX Runtime CPUExecutionProvider的推理后端"""
+
+    name = "onnx"
+
+    def __init__(
+        self,
+        model_path: str,
+        input_size: int = MODEL_INPUT_SIZE,
+        onnx_path: Optional[str] = None,
+        variant: str = "fp32"
+    ):
+        super().__init__(model_path)
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("未安装onnxruntime，无法使用ONNX推理后端")
+
+        self.input_size = input_size
+        self.variant = variant
+        self._explicit_onnx = onnx_path is not None
+        if variant != "fp32":
+            self.name = f"onnx-{variant}"
+
+        if onnx_path is None and variant == "int8":
+            # INT8模型只能使用通过精度校验后激活的产物
+            onnx_path = onnx_cache_path(model_path, input_size, variant="int8")
+            if not os.path.exists(onnx_path):
+                raise RuntimeError(
+                    f"未找到已激活的INT8模型: {onnx_path}，请先运行 python setup_model.py quantize"
+                )
+        self.onnx_path = onnx_path or export_onnx(model_path, input_size)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.enable_cpu_mem_arena = True
+        options.enable_mem_pattern = True
+        if ONNX_INTRA_OP_THREADS > 0:
+            options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+        options.inter_op_num_threads = max(ONNX_INTER_OP_THREADS, 1)
+        options.add_session_config_entry(
+            "session.intra_op.allow_spinning", "1" if ONNX_ALLOW_SPINNING else "0"
+        )
+
+        self.session = ort.InferenceSession(
+            self.onnx_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # 固定batch维度的模型只能逐张推理
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self._names = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+        print(f"ONNX模型加载成功: {self.onnx_path}")
+
+    @property
+    def names(self) -> Dict[int, str]:
+        return self._names
+
+    @property
+    def artifact_path(self) -> str:
+        # 自动导出的FP32模型由权重文件唯一确定；INT8或指定的ONNX文件可以单独替换
+        if self.variant == "fp32" and not self._explicit_onnx:
+            return self.model_path
+        return self.onnx_path
+
+    def predict(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        # 输入张量从池中借用，推理结束后归还；ONNX Runtime直接读取连续的numpy内存
+        with tensor_pool.lease(len(images), self.input_size) as batch:
+            metas = preprocess_into(images, batch)
+            # ONNX Runtime会话本身支持并发调用，无需加锁
+            if self.dynamic_batch:
+                outputs = self.session.run(None, {self.input_name: batch})[0]
+            else:
+                outputs = np.concatenate([
+                    self.session.run(None, {self.input_name: batch[i:i + 1]})[0]
+                    for i in range(len(images))
+                ])
+
+        results = []
+        classes = self.allowed_classes
+        for output, image, (ratio, pad) in zip(outputs, images, metas):
+            boxes = non_max_suppression(output, classes=classes)
+            boxes[:, :4] = scale_boxes(boxes[:, :4], image.shape, ratio, pad)
+            results.append(boxes)
+        return results
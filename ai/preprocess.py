@@ -0,0 +1,177 @@
+"""
+推理输入预处理
+
+letterbox、BGR转RGB、HWC转CHW和归一化一次写入预先分配的NCHW float32张量，
+每种输入尺寸在池中复用最大批大小的张量，较小的批次借用其前 N 项（仍是连续内存），
+推理热路径上不再为每个请求分配缩放、填充和归一化的中间数组，张量直接交给推理会话，不再复制。
+"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+import cv2
+import numpy as np
+
+# 每种输入尺寸保留的空闲张量数，通常不超过同时推理的批次数
+PREPROCESS_POOL_SIZE = int(os.getenv("PREPROCESS_POOL_SIZE", "4"))
+# 池中张量的批大小，应不小于微批和切片推理的最大批大小
+PREPROCESS_MAX_BATCH = int(os.getenv("PREPROCESS_MAX_BATCH", "8"))
+
+# letterbox填充色，与ultralytics保持一致
+LETTERBOX_COLOR = (114, 114, 114)
+_PAD_VALUE = np.float32(LETTERBOX_COLOR[0] / 255.0)
+_SCALE = np.float32(1.0 / 255.0)
+
+# 每张图片的 (缩放比例, (左侧填充, 顶部填充))
+LetterboxMeta = Tuple[float, Tuple[float, float]]
+
+
+def _letterbox_geometry(height: int, width: int, size: int) -> Tuple[float, int, int, int, int]:
+    """等比缩放后的 (缩放比例, 宽, 高, 左侧填充, 顶部填充)"""
+    ratio = min(size / height, size / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    pad_w, pad_h = (size - new_width) / 2, (size - new_height) / 2
+    return ratio, new_width, new_height, int(round(pad_w - 0.1)), int(round(pad_h - 0.1))
+
+
+def letterbox(image: np.ndarray, size: int) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """
+    等比缩放并居中填充到 size x size
+
+    Returns:
+        Tuple: (填充后的图片, 缩放比例, (左侧填充, 顶部填充))
+    """
+    height, width = image.shape[:2]
+    ratio, new_width, new_height, left, top = _letterbox_geometry(height, width, size)
+
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    bottom, right = size - new_height - top, size - new_width - left
+    padded = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+    return padded, ratio, (left, top)
+
+
+def letterbox_into(image: np.ndarray, out: np.ndarray) -> LetterboxMeta:
+    """
+    把一张BGR图片letterbox后写入 (3, size, size) 的float32张量
+
+    只填充四周的边框，图片区域由一次 multiply 完成通道翻转、转置和归一化。
+
+    Returns:
+        LetterboxMeta: (缩放比例, (左侧填充, 顶部填充))
+    """
+    size = out.shape[-1]
+    height, width = image.shape[:2]
+    ratio, new_width, new_height, left, top = _letterbox_geometry(height, width, size)
+
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    bottom, right = top + new_height, left + new_width
+    out[:, :top] = _PAD_VALUE
+    out[:, bottom:] = _PAD_VALUE
+    out[:, top:bottom, :left] = _PAD_VALUE
+    out[:, top:bottom, right:] = _PAD_VALUE
+    np.multiply(
+        image[:, :, ::-1].transpose(2, 0, 1), _SCALE,
+        out=out[:, top:bottom, left:right], dtype=np.float32, casting="unsafe"
+    )
+    return ratio, (left, top)
+
+
+def scale_boxes(boxes: np.ndarray, image_shape: Tuple[int, ...], ratio: float, pad: Tuple[float, float]) -> np.ndarray:
+    """把letterbox坐标系下的 (N, 4) 检测框映射回原图坐标"""
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+    height, width = image_shape[:2]
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+    return boxes
+
+
+def preprocess_into(images: List[np.ndarray], batch: np.ndarray) -> List[LetterboxMeta]:
+    """把一批图片预处理后写入 (N, 3, size, size) 张量的前 len(images) 项"""
+    return [letterbox_into(image, batch[i]) for i, image in enumerate(images)]
+
+
+def preprocess_images(images: List[np.ndarray], size: int) -> Tuple[np.ndarray, List[LetterboxMeta]]:
+    """
+    letterbox + BGR转RGB + 归一化，输出新分配的NCHW float32张量
+
+    推理热路径应使用 tensor_pool 中的张量，这里用于量化校准等一次性场景。
+
+    Returns:
+        Tuple: (形状为 (N, 3, size, size) 的张量, 每张图片的 (缩放比例, 填充))
+    """
+    batch = np.empty((len(images), 3, size, size), dtype=np.float32)
+    return batch, preprocess_into(images, batch)
+
+
+class TensorPool:
+    """
+    按输入尺寸复用的连续NCHW float32输入张量池
+
+    每个张量按最大批大小分配，借出时返回前 batch_size 项的切片，
+    不同批大小共用同一组张量。
+    """
+
+    def __init__(self, max_free: int = PREPROCESS_POOL_SIZE, max_batch: int = PREPROCESS_MAX_BATCH):
+        self.max_free = max(max_free, 0)
+        self.max_batch = max(max_batch, 1)
+        self._free: Dict[int, List[np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+        # 指标
+        self._allocated_total = 0
+        self._reused_total = 0
+
+    def acquire(self, batch_size: int, size: int) -> np.ndarray:
+        """借出一个 (batch_size, 3, size, size) 的张量，没有足够大的空闲张量时新分配"""
+        with self._lock:
+            free = self._free.get(size)
+            fits = [i for i, tensor in enumerate(free or []) if tensor.shape[0] >= batch_size]
+            if fits:
+                self._reused_total += 1
+                tensor = free.pop(min(fits, key=lambda i: free[i].shape[0]))
+                return tensor[:batch_size]
+            self._allocated_total += 1
+        tensor = np.empty((max(batch_size, self.max_batch), 3, size, size), dtype=np.float32)
+        return tensor[:batch_size]
+
+    def release(self, tensor: np.ndarray):
+        """归还张量，该尺寸的空闲张量已满时替换其中较小的一个，否则交给垃圾回收"""
+        tensor = tensor.base if tensor.base is not None else tensor
+        with self._lock:
+            free = self._free.setdefault(tensor.shape[-1], [])
+            if len(free) < self.max_free:
+                free.append(tensor)
+                return
+            smallest = min(range(len(free)), key=lambda i: free[i].shape[0], default=None)
+            if smallest is not None and free[smallest].shape[0] < tensor.shape[0]:
+                free[smallest] = tensor
+
+    @contextmanager
+    def lease(self, batch_size: int, size: int) -> Iterator[np.ndarray]:
+        """在 with 块内借用张量，退出时归还"""
+        tensor = self.acquire(batch_size, size)
+        try:
+            yield tensor
+        finally:
+            self.release(tensor)
+
+    def metrics(self) -> Dict[str, int]:
+        """张量池指标"""
+        with self._lock:
+            return {
+                "sizes": len(self._free),
+                "free": sum(len(free) for free in self._free.values()),
+                "free_bytes": sum(tensor.nbytes for free in self._free.values() for tensor in free),
+                "allocated_total": self._allocated_total,
+                "reused_total": self._reused_total,
+            }
+
+
+# 进程内共用的输入张量池
+tensor_pool = TensorPool()
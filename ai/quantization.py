@@ -0,0 +1,320 @@
+"""
+INT8训练后静态量化
+
+用一批海洋图片校准FP32 ONNX模型得到INT8模型，
+再在保留集上以FP32模型的检测结果为参照计算mAP@0.5，
+精度下降超过阈值时拒绝激活量化模型。
+"""
+import json
+import os
+from typing import Dict, Iterator, List, Optional
+
+import cv2
+import numpy as np
+
+from ai.inference import MODEL_INPUT_SIZE
+from ai.onnx_backend import OnnxBackend, export_onnx, onnx_cache_path
+from ai.preprocess import preprocess_images
+
+# 支持的图片扩展名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+
+# 量化配置
+QUANT_MAX_ACCURACY_DROP = float(os.getenv("QUANT_MAX_ACCURACY_DROP", "0.02"))
+QUANT_CALIBRATION_IMAGES = int(os.getenv("QUANT_CALIBRATION_IMAGES", "200"))
+
+
+def iter_images(image_dir: str, limit: Optional[int] = None) -> Iterator[np.ndarray]:
+    """按文件名顺序读取目录中的图片"""
+    if not os.path.isdir(image_dir):
+        raise FileNotFoundError(f"图片目录不存在: {image_dir}")
+
+    count = 0
+    for name in sorted(os.listdir(image_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is None:
+            continue
+        yield image
+        count += 1
+        if limit is not None and count >= limit:
+            break
+
+
+def _calibration_reader(input_name: str, image_dir: str, input_size: int, limit: int):
+    """构造ONNX Runtime校准数据读取器，逐张提供letterbox后的输入"""
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class ImageCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self._images = iter_images(image_dir, limit)
+
+        def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+            image = next(self._images, None)
+            if image is None:
+                return None
+            batch, _ = preprocess_images([image], input_size)
+            return {input_name: batch}
+
+    return ImageCalibrationReader()
+
+
+def _head_nodes_to_exclude(onnx_path: str) -> List[str]:
+    """
+    找出检测头中负责解码框坐标的非卷积节点
+
+    这些节点（DFL、拼接、坐标变换）对量化误差很敏感，保持FP32精度。
+    """
+    import onnx
+
+    model = onnx.load(onnx_path, load_external_data=False)
+    output_names = {output.name for output in model.graph.output}
+    producer = next((node for node in model.graph.node if output_names & set(node.output)), None)
+    if producer is None or not producer.name.startswith("/model."):
+        return []
+
+    # 输出节点形如 /model.22/Concat_5，取检测头的前缀 /model.22/
+    prefix = "/".join(producer.name.split("/")[:2]) + "/"
+    return [
+        node.name for node in model.graph.node
+        if node.name.startswith(prefix) and node.op_type != "Conv"
+    ]
+
+
+def quantize_model(
+    fp32_path: str,
+    int8_path: str,
+    calibration_dir: str,
+    input_size: int = MODEL_INPUT_SIZE,
+    calibration_images: int = QUANT_CALIBRATION_IMAGES,
+    method: str = "minmax"
+) -> str:
+    """
+    对FP32 ONNX模型做INT8静态量化
+
+    Args:
+        fp32_path: FP32 ONNX模型路径
+        int8_path: 输出的INT8模型路径
+        calibration_dir: 校准图片目录
+        input_size: 模型输入边长
+        calibration_images: 最多使用的校准图片数
+        method: 校准方法，minmax、entropy 或 percentile
+
+    Returns:
+        str: INT8模型路径
+    """
+    try:
+        import onnxruntime as ort
+        from onnxruntime.quantization import (
+            CalibrationMethod, QuantFormat, QuantType, quantize_static
+        )
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError:
+        raise RuntimeError("未安装onnxruntime，无法进行INT8量化")
+
+    methods = {
+        "minmax": CalibrationMethod.MinMax,
+        "entropy": CalibrationMethod.Entropy,
+        "percentile": CalibrationMethod.Percentile,
+    }
+    if method not in methods:
+        raise ValueError(f"未知的校准方法: {method}")
+
+    # 量化前做形状推断和图优化，量化效果更稳定
+    prepared_path = int8_path + ".prep.onnx"
+    quant_pre_process(fp32_path, prepared_path, skip_symbolic_shape=True)
+
+    try:
+        input_name = ort.InferenceSession(
+            prepared_path, providers=["CPUExecutionProvider"]
+        ).get_inputs()[0].name
+        reader = _calibration_reader(input_name, calibration_dir, input_size, calibration_images)
+
+        quantize_static(
+            prepared_path,
+            int8_path,
+            reader,
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            calibrate_method=methods[method],
+            nodes_to_exclude=_head_nodes_to_exclude(prepared_path)
+        )
+    finally:
+        if os.path.exists(prepared_path):
+            os.unlink(prepared_path)
+
+    return int8_path
+
+
+def _box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """一个框与一组框的IoU"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(area + areas - intersection, 1e-9)
+
+
+def _average_precision(recall: np.ndarray, precision: np.ndarray) -> float:
+    """全点插值的AP"""
+    recall = np.concatenate([[0.0], recall, [1.0]])
+    precision = np.concatenate([[1.0], precision, [0.0]])
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    changes = np.where(recall[1:] != recall[:-1])[0]
+    return float(np.sum((recall[changes + 1] - recall[changes]) * precision[changes + 1]))
+
+
+def detection_agreement(
+    references: List[np.ndarray],
+    candidates: List[np.ndarray],
+    iou_threshold: float = 0.5
+) -> Dict[str, float]:
+    """
+    以参照模型的检测结果为真值，计算候选模型的mAP@0.5和F1
+
+    Args:
+        references: 每张图片参照模型的 (N, 6) 检测框
+        candidates: 每张图片候选模型的 (M, 6) 检测框
+        iou_threshold: 匹配的IoU阈值
+
+    Returns:
+        Dict[str, float]: map50、precision、recall、f1
+    """
+    classes = set()
+    for boxes in references:
+        classes.update(boxes[:, 5].astype(int).tolist())
+
+    aps = []
+    true_positives_total = 0
+    candidates_total = sum(len(boxes) for boxes in candidates)
+    references_total = sum(len(boxes) for boxes in references)
+
+    for class_id in sorted(classes):
+        scores, matches = [], []
+        class_references = 0
+        for reference, candidate in zip(references, candidates):
+            gt = reference[reference[:, 5].astype(int) == class_id]
+            pred = candidate[candidate[:, 5].astype(int) == class_id]
+            class_references += len(gt)
+            used = np.zeros(len(gt), dtype=bool)
+            for box in pred[np.argsort(-pred[:, 4])]:
+                scores.append(box[4])
+                if len(gt) == 0:
+                    matches.append(False)
+                    continue
+                ious = _box_iou(box, gt)
+                ious[used] = 0
+                best = int(ious.argmax())
+                if ious[best] >= iou_threshold:
+                    used[best] = True
+                    matches.append(True)
+                else:
+                    matches.append(False)
+
+        if not scores:
+            aps.append(0.0)
+            continue
+        order = np.argsort(-np.asarray(scores))
+        hits = np.asarray(matches)[order]
+        tp = np.cumsum(hits)
+        fp = np.cumsum(~hits)
+        true_positives_total += int(tp[-1])
+        aps.append(_average_precision(tp / class_references, tp / np.maximum(tp + fp, 1)))
+
+    if not classes:
+        # 参照模型在保留集上没有任何检测时，只有候选模型也没有检测才算一致
+        agree = 1.0 if candidates_total == 0 else 0.0
+        return {"map50": agree, "precision": agree, "recall": 1.0, "f1": agree}
+
+    precision = true_positives_total / candidates_total if candidates_total else 0.0
+    recall = true_positives_total / references_total if references_total else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "map50": round(float(np.mean(aps)), 4),
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(f1, 4),
+    }
+
+
+def evaluate_quantized_model(
+    model_path: str,
+    fp32_path: str,
+    int8_path: str,
+    holdout_dir: str,
+    input_size: int = MODEL_INPUT_SIZE
+) -> Dict[str, float]:
+    """在保留集上比较INT8模型与FP32模型的检测结果"""
+    fp32 = OnnxBackend(model_path, input_size, onnx_path=fp32_path)
+    int8 = OnnxBackend(model_path, input_size, onnx_path=int8_path, variant="int8")
+
+    references, candidates = [], []
+    for image in iter_images(holdout_dir):
+        references.extend(fp32.predict([image]))
+        candidates.extend(int8.predict([image]))
+
+    if not references:
+        raise ValueError(f"保留集目录中没有可用的图片: {holdout_dir}")
+
+    metrics = detection_agreement(references, candidates)
+    metrics["images"] = len(references)
+    return metrics
+
+
+def build_int8_model(
+    model_path: str,
+    calibration_dir: str,
+    holdout_dir: str,
+    max_accuracy_drop: float = QUANT_MAX_ACCURACY_DROP,
+    input_size: int = MODEL_INPUT_SIZE,
+    calibration_images: int = QUANT_CALIBRATION_IMAGES,
+    method: str = "minmax"
+) -> Dict[str, object]:
+    """
+    生成INT8模型，通过精度校验后才激活
+
+    激活即把模型放到 onnx-int8 后端读取的缓存路径上，
+    未通过校验的模型不会被 classify_image 使用。
+
+    Returns:
+        Dict[str, object]: 校验指标、是否激活和模型路径
+    """
+    fp32_path = export_onnx(model_path, input_size)
+    active_path = onnx_cache_path(model_path, input_size, variant="int8")
+    candidate_path = active_path + ".candidate"
+
+    print(f"🔧 使用 {calibration_dir} 中的图片校准INT8模型...")
+    quantize_model(fp32_path, candidate_path, calibration_dir, input_size, calibration_images, method)
+
+    print(f"📏 在 {holdout_dir} 上比较INT8与FP32检测结果...")
+    metrics = evaluate_quantized_model(model_path, fp32_path, candidate_path, holdout_dir, input_size)
+    accuracy_drop = round(1.0 - metrics["map50"], 4)
+    activated = accuracy_drop <= max_accuracy_drop
+
+    report = {
+        "weights": model_path,
+        "input_size": input_size,
+        "calibration_method": method,
+        "metrics": metrics,
+        "accuracy_drop": accuracy_drop,
+        "max_accuracy_drop": max_accuracy_drop,
+        "activated": activated,
+        "model_path": active_path if activated else candidate_path,
+    }
+
+    if activated:
+        os.replace(candidate_path, active_path)
+    elif os.path.exists(active_path):
+        # 之前已通过校验的INT8模型保持不变
+        print(f"⚠️ 新模型未通过校验，继续使用已有的INT8模型: {active_path}")
+
+    with open(report["model_path"] + ".json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    return report
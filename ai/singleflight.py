@@ -0,0 +1,61 @@
+"""
+相同请求的单飞合并
+
+同一张图片在短时间内被重复提交（例如客户端超时重试）时，
+只有第一个请求真正执行推理，其余请求等待同一个进行中的结果。
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    按键合并并发的异步调用
+
+    进行中的调用在独立任务中执行，发起它的请求被取消时，
+    其他等待同一结果的请求不受影响。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+        # 指标
+        self._executed_total = 0
+        self._coalesced_total = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行 fn()，同一键已有进行中的调用时等待其结果
+
+        Args:
+            key: 合并键，通常为图片内容哈希
+            fn: 返回协程的无参函数
+
+        Returns:
+            Any: fn() 的结果，异常同样会传递给所有等待者
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self._executed_total += 1
+        else:
+            self._coalesced_total += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        """调用结束后移除记录，之后的相同请求会重新执行"""
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有等待者都已取消时，避免出现"异常未被获取"的警告
+        if not task.cancelled():
+            task.exception()
+
+    def metrics(self) -> Dict[str, int]:
+        """单飞合并指标"""
+        return {
+            "in_flight": len(self._calls),
+            "executed_total": self._executed_total,
+            "coalesced_total": self._coalesced_total,
+        }
@@ -0,0 +1,177 @@
+"""
+高分辨率图片的切片推理
+
+无人机和卫星图片通常有数千万像素，直接缩放到模型输入尺寸会让小型漂浮垃圾消失。
+切片模式把大图切成互相重叠的小块，分批并行推理后把检测框映射回原图坐标，
+再用NMS合并切片接缝处的重复检测。
+"""
+import os
+import threading
+from concurrent.futures import Executor
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ai.inference import (
+    MODEL_INPUT_SIZE, MODEL_PATH, DetectionResult, _mock_detections, _postprocess_boxes, model_registry
+)
+from executors import TILE_POOL_WORKERS, get_executor
+
+# 切片配置，均可在单次请求中覆盖
+TILE_SIZE = int(os.getenv("TILE_SIZE", str(MODEL_INPUT_SIZE)))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+# 单个请求同时推理的批次数，不超过共享切片线程池的大小
+TILE_WORKERS = min(int(os.getenv("TILE_WORKERS", str(os.cpu_count() or 1))), TILE_POOL_WORKERS)
+TILE_BATCH_SIZE = int(os.getenv("TILE_BATCH_SIZE", "8"))
+# 合并切片接缝处重复检测的IoU阈值
+TILE_MERGE_IOU = float(os.getenv("TILE_MERGE_IOU", "0.5"))
+
+
+def tile_origins(length: int, tile_size: int, overlap: float) -> List[int]:
+    """
+    一个维度上各切片的起点，最后一块贴齐图片边缘
+
+    Args:
+        length: 图片在该维度上的长度
+        tile_size: 切片边长
+        overlap: 相邻切片的重叠比例
+    """
+    if length <= tile_size:
+        return [0]
+    stride = max(int(tile_size * (1.0 - overlap)), 1)
+    origins = list(range(0, length - tile_size, stride))
+    origins.append(length - tile_size)
+    return origins
+
+
+def slice_image(image: np.ndarray, tile_size: int, overlap: float) -> Tuple[List[np.ndarray], List[Tuple[int, int]]]:
+    """
+    把图片切成互相重叠的切片（numpy视图，不复制像素）
+
+    Returns:
+        Tuple: (切片列表, 每个切片左上角在原图中的 (x, y) 坐标)
+    """
+    height, width = image.shape[:2]
+    tiles, offsets = [], []
+    for y in tile_origins(height, tile_size, overlap):
+        for x in tile_origins(width, tile_size, overlap):
+            tiles.append(image[y:y + tile_size, x:x + tile_size])
+            offsets.append((x, y))
+    return tiles, offsets
+
+
+def merge_detections(boxes: np.ndarray, iou_threshold: float = TILE_MERGE_IOU) -> np.ndarray:
+    """
+    对全图坐标下的 (N, 6) 检测框做按类别NMS，合并切片之间的重复检测
+
+    Args:
+        boxes: 每行为 [x1, y1, x2, y2, confidence, class_id]
+    """
+    if len(boxes) == 0:
+        return boxes
+
+    # 按类别偏移坐标，使一次NMS只在同类框之间抑制
+    offsets = boxes[:, 5:6] * (float(boxes[:, :4].max()) + 1.0)
+    shifted = boxes[:, :4] + offsets
+    xywh = np.concatenate([shifted[:, :2], shifted[:, 2:] - shifted[:, :2]], axis=1)
+    indices = cv2.dnn.NMSBoxes(xywh.tolist(), boxes[:, 4].tolist(), 0.0, iou_threshold)
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    return boxes[indices]
+
+
+def _map_shared(fn, items: list, limit: int, executor: Optional[Executor] = None) -> list:
+    """在执行器（默认共享切片线程池）中按顺序映射，同时最多 limit 个任务在执行或排队"""
+    pool = executor or get_executor("tile")
+    slots = threading.BoundedSemaphore(limit)
+    futures = []
+    try:
+        for item in items:
+            slots.acquire()
+            future = pool.submit(fn, *item)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+    finally:
+        # 出错时取消尚未开始的批次，不占用其他请求的线程
+        for future in futures:
+            future.cancel()
+
+
+def predict_tile_batch(tiles: List[np.ndarray], offsets: List[Tuple[int, int]]) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    用当前进程中的推理后端检测一批切片
+
+    检测框平移到原图坐标。推理使用进程池时在推理子进程中执行，因此同时返回类别查找表。
+
+    Returns:
+        Tuple: (每个切片的检测框, 类别查找表)
+    """
+    backend = model_registry.get(MODEL_PATH)
+    outputs = backend.predict(tiles)
+    for boxes, (x, y) in zip(outputs, offsets):
+        boxes[:, [0, 2]] += x
+        boxes[:, [1, 3]] += y
+    return outputs, backend.class_lookup
+
+
+def classify_tiled(
+    image: np.ndarray,
+    tile_size: Optional[int] = None,
+    overlap: Optional[float] = None,
+    workers: Optional[int] = None,
+    batch_size: int = TILE_BATCH_SIZE,
+    executor: Optional[Executor] = None
+) -> List[DetectionResult]:
+    """
+    切片推理一张大图
+
+    切片按 batch_size 分批提交给执行器推理，本请求最多 workers 个批次同时进行；
+    workers 超过共享切片线程池的大小时按线程池大小处理。
+    本函数只负责分发批次和合并结果，调用方应在推理执行器之外的线程中调用，
+    避免等待切片时占住推理工作者。
+    ONNX后端的会话可以并发调用；ultralytics后端的模型调用是串行的，
+    此时并行度主要来自 torch 自身的算子内线程。
+
+    Args:
+        image: BGR格式的图片数组
+        tile_size: 切片边长，默认 TILE_SIZE
+        overlap: 相邻切片的重叠比例，默认 TILE_OVERLAP
+        workers: 并行推理的批次数，默认 TILE_WORKERS，上限 TILE_POOL_WORKERS
+        executor: 执行各批次的执行器，默认为共享切片线程池；推理使用进程池时传入推理进程池
+
+    Returns:
+        List[DetectionResult]: 检测结果列表，检测框为相对整张图片的比例坐标
+    """
+    tile_size = tile_size or TILE_SIZE
+    overlap = TILE_OVERLAP if overlap is None else overlap
+    workers = min(max(workers or TILE_WORKERS, 1), TILE_POOL_WORKERS)
+
+    try:
+        if not 0.0 <= overlap < 1.0:
+            raise ValueError(f"切片重叠比例必须在 [0, 1) 之间: {overlap}")
+
+        model_path = MODEL_PATH
+        if not os.path.exists(model_path):
+            print(f"⚠️ 模型文件未找到: {model_path}，使用模拟模式")
+            return _mock_detections()
+
+        tiles, offsets = slice_image(image, tile_size, overlap)
+        batches = [
+            (tiles[i:i + batch_size], offsets[i:i + batch_size])
+            for i in range(0, len(tiles), batch_size)
+        ]
+
+        if executor is None and (workers == 1 or len(batches) == 1):
+            results = [predict_tile_batch(*batch) for batch in batches]
+        else:
+            results = _map_shared(predict_tile_batch, batches, workers, executor)
+
+        class_lookup = results[0][1]
+        all_boxes = [boxes for outputs, _ in results for boxes in outputs if len(boxes)]
+        merged = merge_detections(np.concatenate(all_boxes)) if all_boxes else np.zeros((0, 6), dtype=np.float32)
+        return _postprocess_boxes(merged, class_lookup, image.shape)
+
+    except Exception as e:
+        print(f"切片推理过程中发生错误: {str(e)}")
+        raise RuntimeError(f"切片推理失败: {str(e)}")
@@ -5,9 +5,18 @@
 """
 
 from .session import get_session, init_database
-from .models import Prediction, PredictionCreate, PredictionRead, PredictionStats
+from .models import (
+    DetectionCreate,
+    DetectionRecord,
+    InferenceRequest,
+    InferenceRequestCreate,
+    PredictionCreate,
+    PredictionRead,
+    PredictionStats
+)
 from .crud import (
     create_prediction,
+    create_inference_requests,
     get_predictions,
     get_predictions_count,
     get_prediction_stats,
@@ -17,11 +26,15 @@ from .crud import (
 __all__ = [
     "get_session",
     "init_database",
-    "Prediction",
-    "PredictionCreate", 
+    "DetectionCreate",
+    "DetectionRecord",
+    "InferenceRequest",
+    "InferenceRequestCreate",
+    "PredictionCreate",
     "PredictionRead",
     "PredictionStats",
     "create_prediction",
+    "create_inference_requests",
     "get_predictions",
     "get_predictions_count",
     "get_prediction_stats",
@@ -0,0 +1,90 @@
+"""
+垃圾类别代码
+
+检测记录只保存小整数类别代码，显示名称保存在 detection_class 表中。
+预置类别的代码固定，与 models.CATEGORY_NAMES 的显示名称对应；
+其他类别（例如自定义模型输出的名称）首次写入时追加代码。
+代码表很小且几乎不变，每个数据库引擎在进程内缓存一份。
+"""
+import threading
+import weakref
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, func, select
+
+from .models import DetectionClass
+
+# 预置类别，代码为序号+1，已写入数据库，只能在末尾追加
+PRESET_CLASSES = ("塑料瓶", "塑料袋", "罐头", "纸张", "玻璃瓶", "其他垃圾")
+
+_cache: "weakref.WeakKeyDictionary[object, Dict[str, int]]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _load(session: Session) -> Dict[str, int]:
+    """从数据库读取全部类别代码并更新缓存"""
+    codes = {label: code for code, label in session.exec(select(DetectionClass.code, DetectionClass.label)).all()}
+    with _lock:
+        _cache[session.get_bind()] = codes
+    return codes
+
+
+def _insert(session: Session, labels: Iterable[str]):
+    """追加类别，并发写入相同类别或相同代码时忽略冲突，由调用方重新读取"""
+    dialect = session.get_bind().dialect.name
+    upsert = (postgresql if dialect == "postgresql" else sqlite).insert(DetectionClass)
+    next_code = max(session.exec(select(func.max(DetectionClass.code))).one() or 0, len(PRESET_CLASSES)) + 1
+    rows = []
+    for label in labels:
+        if label in PRESET_CLASSES:
+            code = PRESET_CLASSES.index(label) + 1
+        else:
+            code, next_code = next_code, next_code + 1
+        rows.append({"code": code, "label": label})
+    session.execute(upsert.on_conflict_do_nothing(), rows)
+
+
+def seed_classes(session: Session):
+    """写入预置类别"""
+    if not set(PRESET_CLASSES) - set(_load(session)):
+        return
+    _insert(session, [label for label in PRESET_CLASSES if label not in _cache[session.get_bind()]])
+    session.commit()
+    _load(session)
+
+
+def class_code(session: Session, label: str) -> Optional[int]:
+    """类别名称对应的代码，数据库中没有该类别时返回None"""
+    with _lock:
+        codes = _cache.get(session.get_bind())
+    if codes is None or label not in codes:
+        codes = _load(session)
+    return codes.get(label)
+
+
+def class_codes(session: Session, labels: Iterable[str]) -> Dict[str, int]:
+    """
+    获取类别代码，缺少的类别在当前事务中追加
+
+    追加的类别随调用方的事务一起提交，事务回滚时不会留在缓存中。
+    """
+    labels = set(labels)
+    with _lock:
+        codes = dict(_cache.get(session.get_bind()) or {})
+    missing = labels - codes.keys()
+    if missing:
+        codes = _load(session)
+        missing = labels - codes.keys()
+    for _ in range(3):
+        if not missing:
+            break
+        _insert(session, sorted(missing))
+        codes = dict(session.exec(
+            select(DetectionClass.label, DetectionClass.code).where(DetectionClass.label.in_(labels))
+        ).all())
+        missing = labels - codes.keys()
+    if missing:
+        raise RuntimeError(f"无法分配类别代码: {', '.join(sorted(missing))}")
+    return {label: codes[label] for label in labels}
+
@@ -1,28 +1,140 @@
 """
 数据库CRUD操作
 """
-from sqlmodel import Session, select, func
+import base64
+from sqlmodel import Session, select, func, insert, update, delete, or_, and_, false
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-from .models import Prediction, PredictionCreate, PredictionStats
+from typing import List, Dict, Optional, Tuple
+from .models import (
+    DetectionClass, DetectionRecord, InferenceRequest, InferenceRequestCreate,
+    PredictionCreate, PredictionRead, PredictionStats, Job, JobItem
+)
+from .classes import class_code, class_codes
+from .rollups import add_to_rollups, refresh_rollup, hour_bucket, get_rollup_stats
 
 
-def create_prediction(session: Session, prediction: PredictionCreate) -> Prediction:
-    """创建新的检测记录"""
-    db_prediction = Prediction(
+def create_prediction(session: Session, prediction: PredictionCreate) -> PredictionRead:
+    """创建一条检测记录（只有一个检测结果的请求），返回带ID的记录"""
+    timestamp = prediction.timestamp or datetime.now()
+    code = class_codes(session, [prediction.label])[prediction.label]
+    db_request = InferenceRequest(filename=prediction.filename, timestamp=timestamp)
+    session.add(db_request)
+    session.flush()
+    db_detection = DetectionRecord(
+        request_id=db_request.id,
+        class_code=code,
+        confidence=prediction.confidence,
+        timestamp=timestamp
+    )
+    session.add(db_detection)
+    add_to_rollups(session, [(code, prediction.confidence, timestamp)])
+    session.commit()
+    return PredictionRead(
+        id=db_detection.id,
         filename=prediction.filename,
         label=prediction.label,
-        confidence=prediction.confidence
+        confidence=prediction.confidence,
+        timestamp=timestamp
     )
-    session.add(db_prediction)
+
+
+def insert_inference_requests(session: Session, requests: List[InferenceRequestCreate]) -> int:
+    """
+    批量插入检测请求及其检测结果，不提交事务
+
+    请求用 executemany 插入并按参数顺序取回ID（PostgreSQL合并为一条多行INSERT，
+    SQLite没有可保证顺序的批量RETURNING，逐行执行），检测结果再用一条 executemany 插入，
+    不构造ORM对象。没有检测结果的请求同样保存，统计汇总表在同一事务中更新。
+
+    Returns:
+        int: 插入的检测结果数
+    """
+    if not requests:
+        return 0
+    timestamp = datetime.now()
+    codes = class_codes(session, {d.label for request in requests for d in request.detections})
+    timestamps = [request.timestamp or timestamp for request in requests]
+    request_ids = session.execute(
+        insert(InferenceRequest).returning(InferenceRequest.id, sort_by_parameter_order=True),
+        [
+            {
+                "filename": request.filename,
+                "content_hash": request.content_hash,
+                "width": request.width,
+                "height": request.height,
+                "model_version": request.model_version,
+                "latency_ms": request.latency_ms,
+                "timestamp": detected_at
+            } for request, detected_at in zip(requests, timestamps)
+        ]
+    ).scalars().all()
+
+    rows, rollups = [], []
+    for request_id, request, detected_at in zip(request_ids, requests, timestamps):
+        for detection in request.detections:
+            x1, y1, x2, y2 = detection.box or (None, None, None, None)
+            rows.append({
+                "request_id": request_id,
+                "class_code": codes[detection.label],
+                "confidence": detection.confidence,
+                "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+                "timestamp": detected_at
+            })
+            rollups.append((codes[detection.label], detection.confidence, detected_at))
+    if rows:
+        session.execute(insert(DetectionRecord), rows)
+        add_to_rollups(session, rollups)
+    return len(rows)
+
+
+def create_inference_requests(session: Session, requests: List[InferenceRequestCreate]) -> int:
+    """
+    在一个事务中批量保存检测请求（可以是多个上传请求）
+
+    需要记录ID时请使用 create_prediction。
+
+    Returns:
+        int: 插入的检测结果数
+    """
+    if not requests:
+        return 0
+    count = insert_inference_requests(session, requests)
     session.commit()
-    session.refresh(db_prediction)
-    return db_prediction
+    return count
+
 
+def _prediction_query():
+    """检测结果关联请求和类别，输出与 PredictionRead 相同的字段"""
+    return select(
+        DetectionRecord.id,
+        InferenceRequest.filename,
+        DetectionClass.label,
+        DetectionRecord.confidence,
+        DetectionRecord.timestamp
+    ).join(
+        InferenceRequest, InferenceRequest.id == DetectionRecord.request_id
+    ).join(
+        DetectionClass, DetectionClass.code == DetectionRecord.class_code
+    )
 
-def get_prediction(session: Session, prediction_id: int) -> Optional[Prediction]:
+
+def _prediction_reads(rows) -> List[PredictionRead]:
+    return [
+        PredictionRead(id=id, filename=filename, label=label, confidence=confidence, timestamp=timestamp)
+        for id, filename, label, confidence, timestamp in rows
+    ]
+
+
+def _label_condition(session: Session, label: str):
+    """按类别筛选的条件，先把名称换成代码以便使用 (class_code, timestamp) 索引"""
+    code = class_code(session, label)
+    return DetectionRecord.class_code == code if code is not None else false()
+
+
+def get_prediction(session: Session, prediction_id: int) -> Optional[PredictionRead]:
     """根据ID获取检测记录"""
-    return session.get(Prediction, prediction_id)
+    rows = session.exec(_prediction_query().where(DetectionRecord.id == prediction_id)).all()
+    return _prediction_reads(rows)[0] if rows else None
 
 
 def get_predictions(
@@ -30,24 +142,92 @@ def get_predictions(
     skip: int=0,
     limit: int=100,
     label_filter: Optional[str]=None
-) -> List[Prediction]:
-    """获取检测记录列表"""
-    query = select(Prediction)
+) -> List[PredictionRead]:
+    """
+    获取检测记录列表（偏移分页）
+
+    深分页需要扫描并丢弃前面的全部记录，新代码请使用 get_predictions_page。
+    """
+    query = _prediction_query()
     
     if label_filter:
-        query = query.where(Prediction.label == label_filter)
+        query = query.where(_label_condition(session, label_filter))
     
-    query = query.offset(skip).limit(limit).order_by(Prediction.timestamp.desc())
+    query = query.order_by(DetectionRecord.timestamp.desc(), DetectionRecord.id.desc()).offset(skip).limit(limit)
     
-    return session.exec(query).all()
+    return _prediction_reads(session.exec(query).all())
+
+
+def encode_prediction_cursor(prediction: PredictionRead) -> str:
+    """把记录的 (检测时间, ID) 编码为不透明的分页游标"""
+    raw = f"{prediction.timestamp.isoformat()}|{prediction.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_prediction_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    解码分页游标
+
+    Raises:
+        ValueError: 游标格式无效
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, prediction_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(prediction_id)
+    except Exception:
+        raise ValueError(f"无效的分页游标: {cursor}")
+
+
+def get_predictions_page(
+    session: Session,
+    limit: int = 100,
+    label_filter: Optional[str] = None,
+    cursor: Optional[str] = None
+) -> Tuple[List[PredictionRead], Optional[str]]:
+    """
+    按 (检测时间, ID) 倒序的游标分页
+
+    每一页都从索引中上一页最后一条记录的位置开始读取，任意深度的分页代价相同；
+    翻页期间插入的新记录排在最前面，不会让后面的页重复或遗漏记录。
+
+    Args:
+        limit: 每页记录数
+        label_filter: 按类别筛选
+        cursor: 上一页返回的游标，为None时从最新的记录开始
+
+    Returns:
+        Tuple: (本页记录, 下一页游标，没有更多记录时为None)
+    """
+    query = _prediction_query()
+    
+    if label_filter:
+        query = query.where(_label_condition(session, label_filter))
+    
+    if cursor:
+        timestamp, prediction_id = decode_prediction_cursor(cursor)
+        # 单独的 timestamp <= t 条件让数据库直接在时间索引中定位，而不是从头扫描
+        query = query.where(
+            DetectionRecord.timestamp <= timestamp,
+            or_(DetectionRecord.timestamp < timestamp, DetectionRecord.id < prediction_id)
+        )
+    
+    # 多取一条用于判断是否还有下一页
+    query = query.order_by(DetectionRecord.timestamp.desc(), DetectionRecord.id.desc()).limit(limit + 1)
+    predictions = _prediction_reads(session.exec(query).all())
+    
+    if len(predictions) > limit:
+        predictions = predictions[:limit]
+        return predictions, encode_prediction_cursor(predictions[-1])
+    return predictions, None
 
 
 def get_predictions_count(session: Session, label_filter: Optional[str]=None) -> int:
     """获取检测记录总数"""
-    query = select(func.count(Prediction.id))
+    query = select(func.count(DetectionRecord.id))
     
     if label_filter:
-        query = query.where(Prediction.label == label_filter)
+        query = query.where(_label_condition(session, label_filter))
     
     return session.exec(query).first()
 
@@ -56,60 +236,289 @@ def get_predictions_by_date_range(
     session: Session,
     start_date: datetime,
     end_date: datetime
-) -> List[Prediction]:
+) -> List[PredictionRead]:
     """根据日期范围获取检测记录"""
-    query = select(Prediction).where(
-        Prediction.timestamp >= start_date,
-        Prediction.timestamp <= end_date
-    ).order_by(Prediction.timestamp.desc())
+    query = _prediction_query().where(
+        DetectionRecord.timestamp >= start_date,
+        DetectionRecord.timestamp <= end_date
+    ).order_by(DetectionRecord.timestamp.desc())
     
+    return _prediction_reads(session.exec(query).all())
+
+
+def get_request_detections(session: Session, request_id: int) -> List[DetectionRecord]:
+    """获取一次检测请求（一张图片）的全部检测结果，按置信度从高到低"""
+    query = select(DetectionRecord).where(
+        DetectionRecord.request_id == request_id
+    ).order_by(DetectionRecord.confidence.desc())
     return session.exec(query).all()
 
 
 def get_category_statistics(session: Session) -> Dict[str, int]:
     """获取各类别的统计数据"""
-    query = select(Prediction.label, func.count(Prediction.id)).group_by(Prediction.label)
+    query = select(DetectionClass.label, func.count(DetectionRecord.id)).join(
+        DetectionClass, DetectionClass.code == DetectionRecord.class_code
+    ).group_by(DetectionClass.label)
     results = session.exec(query).all()
     
     return {label: count for label, count in results}
 
 
 def get_prediction_stats(session: Session) -> PredictionStats:
-    """获取综合统计数据"""
-    # 总检测数量
-    total_count = session.exec(select(func.count(Prediction.id))).first()
-    
-    # 各类别统计
-    categories_count = get_category_statistics(session)
-    
-    # 平均置信度
-    avg_confidence = session.exec(select(func.avg(Prediction.confidence))).first() or 0.0
-    
-    # 最近24小时的检测数量
-    yesterday = datetime.now() - timedelta(days=1)
-    recent_count = session.exec(
-        select(func.count(Prediction.id)).where(Prediction.timestamp >= yesterday)
-    ).first()
-    
-    return PredictionStats(
-        total_predictions=total_count or 0,
-        categories_count=categories_count,
-        avg_confidence=round(avg_confidence, 3),
-        recent_predictions=recent_count or 0
-    )
+    """获取综合统计数据（读取统计汇总表）"""
+    return get_rollup_stats(session)
 
 
 def delete_prediction(session: Session, prediction_id: int) -> bool:
-    """删除检测记录"""
-    prediction = session.get(Prediction, prediction_id)
-    if prediction:
-        session.delete(prediction)
+    """删除检测记录（一个检测结果），所属的检测请求保留"""
+    detection = session.get(DetectionRecord, prediction_id)
+    if detection:
+        session.delete(detection)
+        session.flush()
+        refresh_rollup(session, detection.class_code, hour_bucket(detection.timestamp))
         session.commit()
         return True
     return False
 
 
-def get_recent_predictions(session: Session, limit: int=10) -> List[Prediction]:
+def get_recent_predictions(session: Session, limit: int=10) -> List[PredictionRead]:
     """获取最近的检测记录"""
-    query = select(Prediction).order_by(Prediction.timestamp.desc()).limit(limit)
+    query = _prediction_query().order_by(DetectionRecord.timestamp.desc(), DetectionRecord.id.desc()).limit(limit)
+    return _prediction_reads(session.exec(query).all())
+
+
+def create_job(session: Session, job: Job) -> Job:
+    """创建异步检测任务，图片通过 add_job_items 分批写入"""
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def add_job_items(session: Session, items: List[JobItem]):
+    """分批写入任务的图片"""
+    session.add_all(items)
+    session.commit()
+
+
+def enqueue_job(session: Session, job_id: str, total: int, failed: int = 0):
+    """图片全部写入后把任务放入队列，上传阶段已失败的图片直接计入进度"""
+    status = "queued" if failed < total else "completed"
+    session.execute(
+        update(Job).where(Job.id == job_id).values(
+            status=status,
+            total=total,
+            processed=failed,
+            failed=failed,
+            finished_at=datetime.now() if status == "completed" else None
+        )
+    )
+    session.commit()
+
+
+def get_job(session: Session, job_id: str) -> Optional[Job]:
+    """根据ID获取任务"""
+    return session.get(Job, job_id)
+
+
+def get_job_results(session: Session, job_id: str) -> List[Tuple[int, str, str, Optional[str], Optional[str]]]:
+    """获取任务中每张图片的状态和结果，不读取图片数据"""
+    query = select(
+        JobItem.position, JobItem.filename, JobItem.status, JobItem.result, JobItem.error
+    ).where(JobItem.job_id == job_id).order_by(JobItem.position)
     return session.exec(query).all()
+
+
+def claim_job(session: Session, lease_seconds: float) -> Optional[Job]:
+    """
+    领取一个待处理的任务
+
+    排队中（且已过重试等待时间）的任务和租约已过期的运行中任务都可以被领取，
+    通过比较 attempts 的条件更新保证同一任务只会被一个工作者领取。
+    """
+    while True:
+        now = datetime.now()
+        candidate = session.exec(
+            select(Job).where(or_(
+                and_(Job.status == "queued", or_(Job.locked_until == None, Job.locked_until < now)),  # noqa: E711
+                and_(Job.status == "running", Job.locked_until < now)
+            )).order_by(Job.created_at).limit(1)
+        ).first()
+        if candidate is None:
+            return None
+
+        if candidate.attempts >= candidate.max_attempts:
+            finish_job(session, candidate.id, "failed", candidate.error or "任务重试次数已用完")
+            continue
+
+        claimed = session.execute(
+            update(Job).where(
+                Job.id == candidate.id,
+                Job.attempts == candidate.attempts,
+                Job.status == candidate.status
+            ).values(
+                status="running",
+                attempts=candidate.attempts + 1,
+                locked_until=now + timedelta(seconds=lease_seconds),
+                started_at=candidate.started_at or now
+            )
+        )
+        session.commit()
+        if claimed.rowcount == 1:
+            session.refresh(candidate)
+            return candidate
+
+
+def get_pending_job_items(session: Session, job_id: str, after_position: int, limit: int) -> List[JobItem]:
+    """按序号获取任务中尚未处理的下一批图片"""
+    query = select(JobItem).where(
+        JobItem.job_id == job_id,
+        JobItem.status == "pending",
+        JobItem.position > after_position
+    ).order_by(JobItem.position).limit(limit)
+    return session.exec(query).all()
+
+
+def complete_job_item(
+    session: Session,
+    item_id: int,
+    job_id: str,
+    result: Optional[str],
+    error: Optional[str],
+    request: Optional[InferenceRequestCreate],
+    lease_seconds: float
+):
+    """
+    在一个事务中记录一张图片的结果、更新任务进度并续约
+
+    图片处理完成后清空图片数据，检测成功时检测请求和结果同时写入检测记录表。
+    只有仍处于 pending 的图片会被记录：租约过期后任务被其他工作者重新领取时，
+    同一张图片只计入一次进度、只保存一次检测记录。
+
+    Returns:
+        bool: 是否记录了结果，图片已被其他工作者处理时为False
+    """
+    updated = session.execute(
+        update(JobItem).where(JobItem.id == item_id, JobItem.status == "pending").values(
+            status="failed" if error else "done",
+            result=result,
+            error=error,
+            data=None
+        )
+    )
+    if updated.rowcount != 1:
+        session.rollback()
+        return False
+    session.execute(
+        update(Job).where(Job.id == job_id).values(
+            processed=Job.processed + 1,
+            succeeded=Job.succeeded + (0 if error else 1),
+            failed=Job.failed + (1 if error else 0),
+            locked_until=datetime.now() + timedelta(seconds=lease_seconds)
+        )
+    )
+    if request is not None:
+        insert_inference_requests(session, [request])
+    session.commit()
+    return True
+
+
+def renew_job_lease(session: Session, job_id: str, attempts: int, lease_seconds: float) -> bool:
+    """
+    延长任务的租约
+
+    Args:
+        attempts: 领取任务时的执行次数，任务已被其他工作者重新领取时不续约
+
+    Returns:
+        bool: 是否仍持有该任务
+    """
+    renewed = session.execute(
+        update(Job).where(Job.id == job_id, Job.status == "running", Job.attempts == attempts).values(
+            locked_until=datetime.now() + timedelta(seconds=lease_seconds)
+        )
+    )
+    session.commit()
+    return renewed.rowcount == 1
+
+
+def abort_job(session: Session, job_id: str, error: str):
+    """提交过程中失败的任务标记为失败，并清空已写入的图片数据"""
+    session.execute(
+        update(JobItem).where(JobItem.job_id == job_id, JobItem.data != None).values(data=None)  # noqa: E711
+    )
+    session.execute(
+        update(Job).where(Job.id == job_id).values(
+            status="failed",
+            error=error,
+            locked_until=None,
+            finished_at=datetime.now()
+        )
+    )
+    session.commit()
+
+
+def delete_job(session: Session, job_id: str):
+    """删除任务及其图片"""
+    session.execute(delete(JobItem).where(JobItem.job_id == job_id))
+    session.execute(delete(Job).where(Job.id == job_id))
+    session.commit()
+
+
+def finish_job(
+    session: Session, job_id: str, status: str, error: Optional[str] = None, attempts: Optional[int] = None
+) -> bool:
+    """
+    把任务标记为 completed 或 failed
+
+    Args:
+        attempts: 工作者领取任务时的执行次数；传入时只更新仍由该工作者持有的运行中任务，
+                  租约过期后被其他工作者重新领取的任务不受影响
+
+    Returns:
+        bool: 是否更新了任务
+    """
+    conditions = [Job.id == job_id]
+    if attempts is not None:
+        conditions += [Job.status == "running", Job.attempts == attempts]
+    finished = session.execute(
+        update(Job).where(*conditions).values(
+            status=status,
+            error=error,
+            locked_until=None,
+            finished_at=datetime.now()
+        )
+    )
+    session.commit()
+    return finished.rowcount == 1
+
+
+def release_job(
+    session: Session,
+    job_id: str,
+    error: Optional[str] = None,
+    consume_attempt: bool = True,
+    retry_delay: float = 0.0,
+    attempts: Optional[int] = None
+):
+    """
+    把运行中的任务放回队列
+
+    Args:
+        error: 本次执行失败的原因
+        consume_attempt: 是否计入重试次数，服务正常关闭时归还的任务不计入
+        retry_delay: 重新领取前的等待秒数
+        attempts: 工作者领取任务时的执行次数，传入时只归还仍由该工作者持有的任务
+    """
+    values = {
+        "status": "queued",
+        "locked_until": datetime.now() + timedelta(seconds=retry_delay) if retry_delay > 0 else None,
+        "error": error
+    }
+    if not consume_attempt:
+        values["attempts"] = Job.attempts - 1
+    conditions = [Job.id == job_id, Job.status == "running"]
+    if attempts is not None:
+        conditions.append(Job.attempts == attempts)
+    session.execute(update(Job).where(*conditions).values(**values))
+    session.commit()
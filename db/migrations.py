@@ -0,0 +1,135 @@
+"""
+轻量数据库迁移
+
+create_all 只会创建缺失的表，已有的表不会补上后来在模型中新增的索引。
+服务启动时比较模型声明的索引和数据库中已有的索引，缺失的直接创建。
+旧版本的 prediction 表在启动时迁移到 inference_request / detection 两张表，
+按类别名称汇总的旧统计汇总表改为按类别代码汇总后重建。
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import MetaData, Table, func, inspect, insert, select, text
+from sqlalchemy.engine import Engine
+from sqlmodel import SQLModel, Session
+
+from .models import DetectionRecord, InferenceRequest, PredictionRollup
+from .classes import class_codes
+
+# 旧版本每个检测结果一行的检测记录表，迁移后改名保留
+LEGACY_TABLE = "prediction"
+LEGACY_BACKUP_TABLE = "prediction_legacy"
+# 文件名相同的连续旧记录，检测时间相差在此范围内视为同一次请求
+LEGACY_REQUEST_WINDOW = timedelta(seconds=1)
+LEGACY_MIGRATION_CHUNK = 5000  # 迁移时每批读取的旧记录数
+
+
+def ensure_indexes(engine: Engine) -> List[str]:
+    """
+    为已存在的表创建模型中声明但数据库中缺失的索引
+
+    Returns:
+        List[str]: 新创建的索引名
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            print(f"创建索引 {index.name} ...")
+            index.create(bind=engine, checkfirst=True)
+            created.append(index.name)
+    return created
+
+
+def migrate_rollup_table(engine: Engine) -> bool:
+    """
+    旧的统计汇总表以类别名称为主键，删除后按类别代码重新建表
+
+    Returns:
+        bool: 是否重新建表，为True时调用方需要从检测记录重建汇总
+    """
+    table = PredictionRollup.__table__
+    inspector = inspect(engine)
+    if table.name not in inspector.get_table_names():
+        return False
+    if "class_code" in {column["name"] for column in inspector.get_columns(table.name)}:
+        return False
+    print("统计汇总表改为按类别代码汇总，正在重建 ...")
+    table.drop(engine)
+    table.create(engine)
+    return True
+
+
+def migrate_legacy_predictions(engine: Engine) -> int:
+    """
+    把旧的 prediction 表迁移到 inference_request / detection
+
+    旧版本逐条写入检测结果，每条记录有各自的检测时间，同一次上传的记录ID连续、时间只差几毫秒。
+    按ID顺序把文件名相同、检测时间与该组第一条记录相差不超过 LEGACY_REQUEST_WINDOW 的连续记录
+    合并为一次检测请求；检测结果保留原来的ID和检测时间，已发出的分页游标和记录ID仍然有效。
+    迁移按ID分批读取，在一个事务中完成，之后旧表改名为 prediction_legacy 保留备查。
+
+    Returns:
+        int: 迁移的记录数，没有旧表时为0
+    """
+    if LEGACY_TABLE not in inspect(engine).get_table_names():
+        return 0
+    legacy = Table(LEGACY_TABLE, MetaData(), autoload_with=engine)
+    requests, detections = InferenceRequest.__table__, DetectionRecord.__table__
+
+    with Session(engine) as session:
+        count = session.execute(select(func.count()).select_from(legacy)).scalar()
+        print(f"正在迁移旧检测记录表（{count} 条记录）...")
+        codes = class_codes(session, session.execute(select(legacy.c.label).distinct()).scalars().all())
+        request_id = session.execute(select(func.max(requests.c.id))).scalar() or 0
+
+        last_id, group = None, None  # group: (文件名, 该组第一条记录的检测时间)
+        while True:
+            query = select(legacy.c.id, legacy.c.filename, legacy.c.label, legacy.c.confidence, legacy.c.timestamp)
+            if last_id is not None:
+                query = query.where(legacy.c.id > last_id)
+            rows = session.execute(query.order_by(legacy.c.id).limit(LEGACY_MIGRATION_CHUNK)).all()
+            if not rows:
+                break
+            request_rows, detection_rows = [], []
+            for row in rows:
+                if not _same_request(group, row.filename, row.timestamp):
+                    request_id += 1
+                    group = (row.filename, row.timestamp)
+                    request_rows.append({"id": request_id, "filename": row.filename, "timestamp": row.timestamp})
+                detection_rows.append({
+                    "id": row.id,
+                    "request_id": request_id,
+                    "class_code": codes[row.label],
+                    "confidence": row.confidence,
+                    "timestamp": row.timestamp
+                })
+            if request_rows:
+                session.execute(insert(requests), request_rows)
+            session.execute(insert(detections), detection_rows)
+            last_id = rows[-1].id
+
+        if engine.dialect.name == "postgresql":
+            # 显式写入了ID，自增序列需要跟上
+            for table in ("inference_request", "detection"):
+                session.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"
+                ))
+        session.execute(text(f"ALTER TABLE {LEGACY_TABLE} RENAME TO {LEGACY_BACKUP_TABLE}"))
+        session.commit()
+
+    print(f"旧检测记录表已迁移，原表改名为 {LEGACY_BACKUP_TABLE}")
+    return count
+
+
+def _same_request(group: Optional[Tuple[str, datetime]], filename: str, timestamp: Optional[datetime]) -> bool:
+    """判断一条旧记录是否属于上一条记录所在的检测请求"""
+    if group is None or timestamp is None or group[1] is None:
+        return False
+    return filename == group[0] and abs(timestamp - group[1]) <= LEGACY_REQUEST_WINDOW
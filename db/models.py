@@ -1,36 +1,84 @@
 """
 数据库模型定义
 """
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Column, ForeignKey, Index, LargeBinary, SmallInteger
+from sqlalchemy import REAL
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional, Tuple
 
 
-class Prediction(SQLModel, table=True):
-    """检测记录数据模型"""
+class DetectionClass(SQLModel, table=True):
+    """垃圾类别代码表，检测记录只保存小整数代码"""
+    __tablename__ = "detection_class"
+
+    code: int = Field(sa_column=Column(SmallInteger, primary_key=True, autoincrement=False), description="类别代码")
+    label: str = Field(max_length=100, unique=True, description="类别显示名称")
+
+
+class InferenceRequest(SQLModel, table=True):
+    """一次图片检测请求，同一张图片的检测结果通过它关联"""
+    __tablename__ = "inference_request"
+    model_config = {"protected_namespaces": ()}
+
     id: Optional[int] = Field(default=None, primary_key=True)
     filename: str = Field(max_length=255, description="上传的图片文件名")
-    label: str = Field(max_length=100, description="检测到的垃圾类别")
-    confidence: float = Field(description="置信度分数 (0-1)")
-    timestamp: datetime = Field(default_factory=datetime.now, description="检测时间")
-    
-    class Config:
-        """模型配置"""
-        json_schema_extra = {
-            "example": {
-                "filename": "ocean_trash_001.jpg",
-                "label": "塑料瓶",
-                "confidence": 0.85,
-                "timestamp": "2024-01-15T10:30:00"
-            }
-        }
+    content_hash: Optional[str] = Field(default=None, max_length=64, index=True, description="图片内容SHA-256")
+    width: Optional[int] = Field(default=None, description="图片宽度（像素）")
+    height: Optional[int] = Field(default=None, description="图片高度（像素）")
+    model_version: Optional[str] = Field(default=None, max_length=64, description="检测使用的模型版本")
+    latency_ms: Optional[float] = Field(default=None, sa_column=Column(REAL), description="检测耗时（毫秒）")
+    timestamp: datetime = Field(default_factory=datetime.now, index=True, description="检测时间")
+
+
+class DetectionRecord(SQLModel, table=True):
+    """一个检测结果"""
+    __tablename__ = "detection"
+    # 历史记录按时间倒序分页、按类别筛选和分组统计都走索引，
+    # (class_code, timestamp) 的前缀同时覆盖只按类别的查询；检测时间冗余保存一份，分页不必关联请求表
+    __table_args__ = (
+        Index("ix_detection_class_timestamp", "class_code", "timestamp"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    request_id: int = Field(foreign_key="inference_request.id", index=True, description="所属检测请求")
+    class_code: int = Field(
+        sa_column=Column(SmallInteger, ForeignKey("detection_class.code"), nullable=False), description="类别代码"
+    )
+    confidence: float = Field(sa_column=Column(REAL, nullable=False), description="置信度分数 (0-1)")
+    x1: Optional[float] = Field(default=None, sa_column=Column(REAL), description="检测框左上角x（相对图片宽度的比例）")
+    y1: Optional[float] = Field(default=None, sa_column=Column(REAL), description="检测框左上角y（相对图片高度的比例）")
+    x2: Optional[float] = Field(default=None, sa_column=Column(REAL), description="检测框右下角x（相对图片宽度的比例）")
+    y2: Optional[float] = Field(default=None, sa_column=Column(REAL), description="检测框右下角y（相对图片高度的比例）")
+    timestamp: datetime = Field(default_factory=datetime.now, index=True, description="检测时间")
+
+
+class DetectionCreate(SQLModel):
+    """创建检测结果的数据模型"""
+    label: str
+    confidence: float
+    box: Optional[Tuple[float, float, float, float]] = None  # (x1, y1, x2, y2)，相对图片宽高的比例，模拟模式下为空
+
+
+class InferenceRequestCreate(SQLModel):
+    """创建检测请求及其全部检测结果的数据模型"""
+    model_config = {"protected_namespaces": ()}
+
+    filename: str
+    content_hash: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    model_version: Optional[str] = None
+    latency_ms: Optional[float] = None
+    timestamp: Optional[datetime] = None  # 为空时使用写入时间
+    detections: List[DetectionCreate] = []
 
 
 class PredictionCreate(SQLModel):
-    """创建检测记录的数据模型"""
+    """创建单条检测记录的数据模型（保存为只有一个检测结果的请求）"""
     filename: str
     label: str
     confidence: float
+    timestamp: Optional[datetime] = None  # 为空时使用写入时间
 
 
 class PredictionRead(SQLModel):
@@ -42,9 +90,70 @@ class PredictionRead(SQLModel):
     timestamp: datetime
 
 
+class PredictionRollup(SQLModel, table=True):
+    """按类别和小时汇总的检测统计，与检测记录在同一事务中增量更新"""
+    __tablename__ = "prediction_rollup"
+
+    class_code: int = Field(
+        sa_column=Column(SmallInteger, ForeignKey("detection_class.code"), primary_key=True), description="类别代码"
+    )
+    bucket: datetime = Field(primary_key=True, index=True, description="小时起点")
+    count: int = Field(default=0, description="检测数量")
+    confidence_sum: float = Field(default=0.0, description="置信度之和")
+    confidence_min: float = Field(default=1.0, description="最低置信度")
+    confidence_max: float = Field(default=0.0, description="最高置信度")
+
+
 class PredictionStats(SQLModel):
     """统计数据模型"""
     total_predictions: int
     categories_count: dict
     avg_confidence: float
-    recent_predictions: int  # 最近24小时的检测数量
\ No newline at end of file
+    recent_predictions: int  # 最近24小时的检测数量
+
+
+class TimeseriesPoint(SQLModel):
+    """趋势图中的一个时间段"""
+    bucket: datetime  # 时间段起点
+    count: int
+    avg_confidence: float
+    min_confidence: float
+    max_confidence: float
+
+
+class PredictionTimeseries(SQLModel):
+    """按时间段聚合的检测趋势，没有检测记录的时间段不返回"""
+    bucket: str  # minute/hour/day/week
+    start: datetime
+    end: datetime
+    label: Optional[str] = None
+    points: List[TimeseriesPoint]
+
+
+class Job(SQLModel, table=True):
+    """异步检测任务，同时作为持久化工作队列的队列项"""
+    id: str = Field(primary_key=True, max_length=32, description="任务ID")
+    status: str = Field(default="queued", max_length=16, index=True, description="queued/running/completed/failed")
+    total: int = Field(default=0, description="图片总数")
+    processed: int = Field(default=0, description="已处理的图片数")
+    succeeded: int = Field(default=0, description="检测成功的图片数")
+    failed: int = Field(default=0, description="检测失败的图片数")
+    attempts: int = Field(default=0, description="已执行的次数")
+    max_attempts: int = Field(default=3, description="最大执行次数")
+    error: Optional[str] = Field(default=None, description="任务失败原因")
+    locked_until: Optional[datetime] = Field(default=None, description="工作者租约到期时间")
+    created_at: datetime = Field(default_factory=datetime.now, index=True, description="提交时间")
+    started_at: Optional[datetime] = Field(default=None, description="开始处理时间")
+    finished_at: Optional[datetime] = Field(default=None, description="完成时间")
+
+
+class JobItem(SQLModel, table=True):
+    """异步检测任务中的一张图片"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: str = Field(foreign_key="job.id", index=True, max_length=32)
+    position: int = Field(description="图片在任务中的序号")
+    filename: str = Field(max_length=255)
+    status: str = Field(default="pending", max_length=16, description="pending/done/failed")
+    data: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary), description="待检测的图片，处理后清空")
+    result: Optional[str] = Field(default=None, description="检测结果JSON")
+    error: Optional[str] = Field(default=None, description="失败原因")
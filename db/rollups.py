@@ -0,0 +1,326 @@
+"""
+检测统计汇总表
+
+按 (类别代码, 小时) 汇总检测数量、置信度之和与最低/最高置信度，读取时关联类别表得到类别名称，
+与检测记录在同一事务中增量更新，统计和趋势接口只读取汇总表，不再扫描全部检测记录。
+汇总表与检测记录不一致时（例如手工修改了数据库）可以重建：
+
+    python -m db.rollups
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, case, delete, insert, type_coerce
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, func, select
+
+from .models import (
+    DetectionClass, DetectionRecord, PredictionRollup, PredictionStats, PredictionTimeseries, TimeseriesPoint
+)
+
+ROLLUP_BUCKET = timedelta(hours=1)
+
+# 趋势图的时间段长度；分钟粒度直接聚合检测记录，其余粒度读取小时汇总表
+TIMESERIES_BUCKETS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+# 未指定开始时间时的默认时间范围
+TIMESERIES_DEFAULT_SPANS = {
+    "minute": timedelta(hours=6),
+    "hour": timedelta(days=7),
+    "day": timedelta(days=90),
+    "week": timedelta(weeks=104),
+}
+# 一次查询最多的时间段数
+TIMESERIES_MAX_POINTS = int(os.getenv("TIMESERIES_MAX_POINTS", "2000"))
+
+# SQLite截断时间的格式和修饰符，按SQLAlchemy保存DateTime的文本格式输出，
+# 可以与Python写入的时间直接比较；每周从周一开始，与PostgreSQL的 date_trunc('week') 一致
+_SQLITE_BUCKET_FORMATS = {
+    "minute": ("%Y-%m-%d %H:%M:00.000000",),
+    "hour": ("%Y-%m-%d %H:00:00.000000",),
+    "day": ("%Y-%m-%d 00:00:00.000000",),
+    "week": ("%Y-%m-%d 00:00:00.000000", "-6 days", "weekday 1"),
+}
+
+# (类别代码, 置信度, 检测时间)
+RollupRecord = Tuple[int, float, datetime]
+
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    """检测时间所在小时的起点"""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def local_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """带时区的时间转换为本地时间并去掉时区，与检测记录保存的 datetime.now() 一致"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+def bucket_expression(dialect: str, bucket: str, column):
+    """SQL中把时间截断到所在时间段（minute/hour/day/week）的起点"""
+    if dialect == "sqlite":
+        fmt, *modifiers = _SQLITE_BUCKET_FORMATS[bucket]
+        return type_coerce(func.strftime(fmt, column, *modifiers), DateTime)
+    if dialect == "postgresql":
+        return func.date_trunc(bucket, column)
+    raise NotImplementedError(f"统计汇总不支持的数据库类型: {dialect}")
+
+
+def _aggregate(records: Iterable[RollupRecord]) -> List[Dict[str, object]]:
+    """在内存中按 (类别代码, 小时) 合并记录，按主键排序以免并发事务互相死锁"""
+    rollups: Dict[Tuple[int, datetime], Dict[str, object]] = {}
+    for code, confidence, timestamp in records:
+        key = (code, hour_bucket(timestamp))
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollups[key] = {
+                "class_code": code,
+                "bucket": key[1],
+                "count": 1,
+                "confidence_sum": confidence,
+                "confidence_min": confidence,
+                "confidence_max": confidence,
+            }
+            continue
+        rollup["count"] += 1
+        rollup["confidence_sum"] += confidence
+        rollup["confidence_min"] = min(rollup["confidence_min"], confidence)
+        rollup["confidence_max"] = max(rollup["confidence_max"], confidence)
+    return [rollups[key] for key in sorted(rollups)]
+
+
+def add_to_rollups(session: Session, records: Iterable[RollupRecord]) -> int:
+    """
+    把新的检测记录累加到汇总表，不提交事务
+
+    使用 INSERT ... ON CONFLICT DO UPDATE，并发写入同一小时的请求不会丢失计数。
+
+    Returns:
+        int: 更新的 (类别代码, 小时) 数
+    """
+    rows = _aggregate(records)
+    if not rows:
+        return 0
+    dialect = session.get_bind().dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        raise NotImplementedError(f"统计汇总不支持的数据库类型: {dialect}")
+    upsert = (postgresql if dialect == "postgresql" else sqlite).insert(PredictionRollup)
+    table, excluded = PredictionRollup.__table__, upsert.excluded
+    session.execute(upsert.on_conflict_do_update(
+        index_elements=[table.c.class_code, table.c.bucket],
+        set_={
+            "count": table.c.count + excluded.count,
+            "confidence_sum": table.c.confidence_sum + excluded.confidence_sum,
+            "confidence_min": case(
+                (excluded.confidence_min < table.c.confidence_min, excluded.confidence_min),
+                else_=table.c.confidence_min
+            ),
+            "confidence_max": case(
+                (excluded.confidence_max > table.c.confidence_max, excluded.confidence_max),
+                else_=table.c.confidence_max
+            ),
+        }
+    ), rows)
+    return len(rows)
+
+
+def refresh_rollup(session: Session, class_code: int, bucket: datetime):
+    """
+    从检测记录重新计算一个 (类别代码, 小时)，不提交事务
+
+    删除记录后最低/最高置信度无法增量回退，只重算受影响的一个小时。
+    """
+    count, confidence_sum, confidence_min, confidence_max = session.exec(
+        select(
+            func.count(DetectionRecord.id),
+            func.sum(DetectionRecord.confidence),
+            func.min(DetectionRecord.confidence),
+            func.max(DetectionRecord.confidence)
+        ).where(
+            DetectionRecord.class_code == class_code,
+            DetectionRecord.timestamp >= bucket,
+            DetectionRecord.timestamp < bucket + ROLLUP_BUCKET
+        )
+    ).one()
+    session.execute(delete(PredictionRollup).where(
+        PredictionRollup.class_code == class_code, PredictionRollup.bucket == bucket
+    ))
+    if count:
+        session.execute(insert(PredictionRollup).values(
+            class_code=class_code,
+            bucket=bucket,
+            count=count,
+            confidence_sum=confidence_sum,
+            confidence_min=confidence_min,
+            confidence_max=confidence_max
+        ))
+
+
+def rebuild_rollups(session: Session) -> int:
+    """
+    清空汇总表并从全部检测记录重新计算
+
+    Returns:
+        int: 汇总表的行数
+    """
+    bucket = bucket_expression(session.get_bind().dialect.name, "hour", DetectionRecord.timestamp)
+    session.execute(delete(PredictionRollup))
+    session.execute(insert(PredictionRollup).from_select(
+        ["class_code", "bucket", "count", "confidence_sum", "confidence_min", "confidence_max"],
+        select(
+            DetectionRecord.class_code,
+            bucket,
+            func.count(DetectionRecord.id),
+            func.sum(DetectionRecord.confidence),
+            func.min(DetectionRecord.confidence),
+            func.max(DetectionRecord.confidence)
+        ).group_by(DetectionRecord.class_code, bucket)
+    ))
+    session.commit()
+    return session.exec(select(func.count()).select_from(PredictionRollup)).one()
+
+
+def ensure_rollups(session: Session) -> bool:
+    """汇总表为空而已有检测记录时（汇总表加入之前的数据库）重建，返回是否重建"""
+    if session.exec(select(PredictionRollup.class_code).limit(1)).first() is not None:
+        return False
+    if session.exec(select(DetectionRecord.id).limit(1)).first() is None:
+        return False
+    print("正在从检测记录生成统计汇总表 ...")
+    rebuild_rollups(session)
+    return True
+
+
+def get_rollup_stats(session: Session, now: datetime = None) -> PredictionStats:
+    """
+    从汇总表读取综合统计数据
+
+    最近24小时中完整的小时读取汇总表，开头不足一小时的部分按检测时间索引计数。
+    """
+    since = (now or datetime.now()) - timedelta(days=1)
+    boundary = hour_bucket(since) + ROLLUP_BUCKET
+
+    rows = session.exec(
+        select(
+            DetectionClass.label,
+            func.sum(PredictionRollup.count),
+            func.sum(PredictionRollup.confidence_sum),
+            func.sum(case((PredictionRollup.bucket >= boundary, PredictionRollup.count), else_=0))
+        ).join(
+            DetectionClass, DetectionClass.code == PredictionRollup.class_code
+        ).group_by(DetectionClass.label)
+    ).all()
+    partial_hour = session.exec(
+        select(func.count(DetectionRecord.id)).where(
+            DetectionRecord.timestamp >= since, DetectionRecord.timestamp < boundary
+        )
+    ).one()
+
+    total_count = sum(count for _, count, _, _ in rows)
+    confidence_sum = sum(total for _, _, total, _ in rows)
+    return PredictionStats(
+        total_predictions=total_count,
+        categories_count={label: count for label, count, _, _ in rows},
+        avg_confidence=round(confidence_sum / total_count, 3) if total_count else 0.0,
+        recent_predictions=sum(recent for _, _, _, recent in rows) + partial_hour
+    )
+
+
+def get_prediction_timeseries(
+    session: Session,
+    bucket: str = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    label: Optional[str] = None,
+    now: Optional[datetime] = None
+) -> PredictionTimeseries:
+    """
+    按时间段聚合检测数量和置信度
+
+    小时、天和周读取小时汇总表，起止时间按小时对齐；分钟粒度按检测时间索引聚合检测记录。
+    聚合全部在数据库中完成，返回的点数不超过时间段数。
+
+    Args:
+        bucket: 时间段粒度 minute/hour/day/week
+        start: 开始时间，默认按粒度取最近一段时间；带时区时转换为本地时间
+        end: 结束时间（不含），默认为当前时间；带时区时转换为本地时间
+        label: 按类别筛选
+
+    Raises:
+        ValueError: 粒度无效、时间范围为空或时间段数超过上限
+    """
+    width = TIMESERIES_BUCKETS.get(bucket)
+    if width is None:
+        raise ValueError(f"无效的时间段粒度: {bucket}")
+    end = local_naive(end) or now or datetime.now()
+    start = local_naive(start) or end - TIMESERIES_DEFAULT_SPANS[bucket]
+    if start >= end:
+        raise ValueError("开始时间必须早于结束时间")
+    if (end - start) / width > TIMESERIES_MAX_POINTS:
+        raise ValueError(f"时间范围过大：按{bucket}聚合最多返回{TIMESERIES_MAX_POINTS}个时间段")
+
+    dialect = session.get_bind().dialect.name
+    if bucket == "minute":
+        key = bucket_expression(dialect, bucket, DetectionRecord.timestamp)
+        query = select(
+            key,
+            func.count(DetectionRecord.id),
+            func.sum(DetectionRecord.confidence),
+            func.min(DetectionRecord.confidence),
+            func.max(DetectionRecord.confidence)
+        ).where(DetectionRecord.timestamp >= start, DetectionRecord.timestamp < end)
+        if label:
+            query = query.join(
+                DetectionClass, DetectionClass.code == DetectionRecord.class_code
+            ).where(DetectionClass.label == label)
+    else:
+        key = bucket_expression(dialect, bucket, PredictionRollup.bucket)
+        query = select(
+            key,
+            func.sum(PredictionRollup.count),
+            func.sum(PredictionRollup.confidence_sum),
+            func.min(PredictionRollup.confidence_min),
+            func.max(PredictionRollup.confidence_max)
+        ).where(PredictionRollup.bucket >= hour_bucket(start), PredictionRollup.bucket < end)
+        if label:
+            query = query.join(
+                DetectionClass, DetectionClass.code == PredictionRollup.class_code
+            ).where(DetectionClass.label == label)
+
+    rows = session.exec(query.group_by(key).order_by(key)).all()
+    return PredictionTimeseries(
+        bucket=bucket,
+        start=start,
+        end=end,
+        label=label,
+        points=[
+            TimeseriesPoint(
+                bucket=point,
+                count=count,
+                avg_confidence=round(confidence_sum / count, 3),
+                min_confidence=round(confidence_min, 3),
+                max_confidence=round(confidence_max, 3)
+            ) for point, count, confidence_sum, confidence_min, confidence_max in rows
+        ]
+    )
+
+
+def main():
+    """从检测记录重建统计汇总表"""
+    from .session import engine, create_db_and_tables
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        rows = rebuild_rollups(session)
+    print(f"统计汇总表已重建，共 {rows} 行")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,107 @@
 数据库连接和会话管理
 """
 import os
-from typing import Generator
+from typing import Any, Dict, Generator
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlmodel import SQLModel, create_engine, Session
 
+from .classes import seed_classes
+from .migrations import ensure_indexes, migrate_legacy_predictions, migrate_rollup_table
+from .rollups import ensure_rollups, rebuild_rollups
+
 # 数据库配置
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ocean_trash_detection.db")
 
+# 连接池配置（SQLite文件数据库和PostgreSQL共用）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # 等待空闲连接的秒数
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # 连接最长复用秒数，-1 表示不回收
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))  # PostgreSQL语句超时，0 表示不限制
+
+# SQLite调优：WAL模式下读写互不阻塞，synchronous=NORMAL 在WAL下仍能保证数据库一致
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))  # 每个连接的页缓存
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    return _is_sqlite(url) and (url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url)
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """按数据库类型生成 create_engine 的连接和连接池参数"""
+    if _is_sqlite_memory(url):
+        # 内存数据库每个连接都是独立的库，保持SQLAlchemy的默认单连接池
+        return {"connect_args": {"check_same_thread": False}}
+    options: Dict[str, Any] = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    if _is_sqlite(url):
+        # busy_timeout 由连接时的PRAGMA设置，timeout 参数保持一致
+        options["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        return options
+    options["pool_pre_ping"] = DB_POOL_PRE_PING
+    if url.startswith("postgresql") and DB_STATEMENT_TIMEOUT_MS > 0:
+        options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """每个新的SQLite连接建立时应用调优PRAGMA"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def create_tuned_engine(url: str = DATABASE_URL, echo: bool = False) -> Engine:
+    """创建数据库引擎，SQLite连接自动应用调优PRAGMA"""
+    db_engine = create_engine(url, echo=echo, **engine_options(url))
+    if _is_sqlite(url):
+        event.listen(db_engine, "connect", apply_sqlite_pragmas)
+    return db_engine
+
+
 # 创建数据库引擎
-engine = create_engine(
+engine = create_tuned_engine(
     DATABASE_URL,
-    echo=False,  # 设置为True可以看到SQL语句
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+    echo=False  # 设置为True可以看到SQL语句
 )
 
 
 def create_db_and_tables():
-    """创建数据库和表"""
+    """创建数据库和表，迁移旧检测记录表，并为已有的表补建新增的索引和统计汇总"""
     SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed_classes(session)
+    migrated = migrate_legacy_predictions(engine)
+    migrated = migrate_rollup_table(engine) or migrated
+    created = ensure_indexes(engine)
+    if created:
+        print(f"已为现有数据补建 {len(created)} 个索引")
+    with Session(engine) as session:
+        if migrated:
+            rebuild_rollups(session)
+        else:
+            ensure_rollups(session)
     print("数据库和表创建成功")
 
 
@@ -0,0 +1,304 @@
+"""
+检测记录的后写队列
+
+开启后，检测接口只把检测请求（及其检测结果）放入进程内的有界队列就返回响应，
+后台写入器按批大小或时间窗口把请求批量写入数据库。
+数据库变慢时队列写满：配置了溢出文件时把记录追加到本地文件，数据库恢复后再补写；
+没有溢出文件时请求在入队处等待，把压力传回调用方。
+"""
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlmodel import Session
+
+from .session import engine
+from .models import DetectionCreate, InferenceRequestCreate
+from .crud import create_inference_requests
+
+# 后写队列配置
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))  # 队列中最多的检测请求数
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))  # 每个事务最多写入的检测请求数
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))  # 凑批的最长等待秒数
+WRITE_BEHIND_SPILL_PATH = os.getenv("WRITE_BEHIND_SPILL_PATH", "")  # 为空时队列满后等待而不溢出
+WRITE_BEHIND_RETRY_DELAY = float(os.getenv("WRITE_BEHIND_RETRY_DELAY", "1.0"))
+
+
+def _write_requests(requests: List[InferenceRequestCreate]) -> int:
+    """写入器不在请求上下文中，每批使用独立的会话"""
+    with Session(engine) as session:
+        return create_inference_requests(session, requests)
+
+
+def _append_spill(path: str, requests: List[InferenceRequestCreate]):
+    """把检测请求追加到溢出文件，每行一条JSON"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for request in requests:
+            f.write(json.dumps(request.model_dump(mode="json"), ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _rewrite_spill(path: str, requests: List[InferenceRequestCreate]):
+    """用剩余的检测请求原子替换溢出文件"""
+    temp_path = path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    _append_spill(temp_path, requests)
+    os.replace(temp_path, path)
+
+
+def _read_spill(path: str) -> List[InferenceRequestCreate]:
+    """
+    读取溢出文件，忽略进程崩溃时写了一半的最后一行
+
+    旧版本每行是一个检测结果（filename/label/confidence/timestamp），按只有一个检测结果的请求读取。
+    """
+    requests = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "label" in record:
+                record = {
+                    "filename": record["filename"],
+                    "timestamp": record["timestamp"],
+                    "detections": [DetectionCreate(label=record["label"], confidence=record["confidence"])],
+                }
+            requests.append(InferenceRequestCreate.model_validate(record))
+    return requests
+
+
+class WriteBehindQueue:
+    """
+    检测记录的后写队列
+
+    入队时记下检测时间，批量写入和补写都保留原始时间。
+    进程正常关闭时写完队列中的全部记录，写不进数据库的记录转入溢出文件。
+    数据库写入通过 db_runner、溢出文件读写通过 file_runner 在后台执行器中执行，
+    未提供时使用事件循环的默认线程池。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = WRITE_BEHIND_QUEUE_SIZE,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+        spill_path: str = WRITE_BEHIND_SPILL_PATH,
+        retry_delay: float = WRITE_BEHIND_RETRY_DELAY,
+        writer=_write_requests,
+        db_runner: Optional[Callable[..., Awaitable[Any]]] = None,
+        file_runner: Optional[Callable[..., Awaitable[Any]]] = None
+    ):
+        self.maxsize = max(maxsize, 1)
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.retry_delay = retry_delay
+        self.writer = writer
+        self.db_runner = db_runner
+        self.file_runner = file_runner
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # 指标
+        self._enqueued_total = 0
+        self._written_total = 0
+        self._batches_total = 0
+        self._failed_batches = 0
+        self._spilled_total = 0
+        self._replayed_total = 0
+        self._last_batch_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """启动后台写入器，必须在事件循环中调用"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._closing = False
+        self._task = asyncio.ensure_future(self._run())
+        print(f"检测记录后写队列已启动: 容量 {self.maxsize}, 批大小 {self.batch_size}")
+
+    async def stop(self):
+        """写完队列中的记录后停止"""
+        if not self.running:
+            return
+        self._closing = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        print(f"检测记录后写队列已停止，累计写入 {self._written_total} 个检测请求")
+
+    async def submit(self, requests: List[InferenceRequestCreate]):
+        """
+        把检测请求放入队列
+
+        队列已满时写入溢出文件；没有配置溢出文件时等待队列腾出空间。
+        """
+        if not requests:
+            return
+        now = datetime.now()
+        records = [r.model_copy(update={"timestamp": r.timestamp or now}) for r in requests]
+        self._enqueued_total += len(records)
+
+        if not self.running:
+            # 写入器未启动（例如关闭过程中）时直接写库
+            await self._write(records)
+            return
+
+        for i, record in enumerate(records):
+            try:
+                self._queue.put_nowait(record)
+            except asyncio.QueueFull:
+                if self.spill_path:
+                    await self._spill(records[i:])
+                    return
+                await self._queue.put(record)
+
+    async def _run(self):
+        """按批大小或时间窗口取出记录并写入"""
+        if self.spill_path:
+            await self._replay_spill()
+        while True:
+            batch, done = await self._next_batch()
+            # 数据库恢复写入且队列已空时补写溢出的记录
+            if batch and await self._write(batch) and self.spill_path and self._queue.empty():
+                await self._replay_spill()
+            if done:
+                return
+
+    async def _next_batch(self):
+        """
+        等待第一条记录，然后在时间窗口内凑满一批
+
+        Returns:
+            Tuple: (记录列表, 是否收到停止信号)
+        """
+        first = await self._queue.get()
+        if first is None:
+            return self._drain(), True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                record = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if record is None:
+                return batch + self._drain(), True
+            batch.append(record)
+        return batch, False
+
+    def _drain(self) -> List[InferenceRequestCreate]:
+        """取出队列中剩余的全部记录"""
+        records = []
+        while not self._queue.empty():
+            record = self._queue.get_nowait()
+            if record is not None:
+                records.append(record)
+        return records
+
+    @staticmethod
+    async def _call(runner: Optional[Callable[..., Awaitable[Any]]], fn, *args):
+        """在指定的执行器中执行阻塞函数，避免阻塞事件循环"""
+        if runner is not None:
+            return await runner(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def _write(self, records: List[InferenceRequestCreate]) -> bool:
+        """分批写入数据库，返回是否全部写入成功"""
+        written = True
+        for start in range(0, len(records), self.batch_size):
+            written = await self._write_batch(records[start:start + self.batch_size]) and written
+        return written
+
+    async def _write_batch(self, batch: List[InferenceRequestCreate]) -> bool:
+        """写入一批记录；失败时转入溢出文件，没有溢出文件时等待后重试"""
+        while True:
+            started = time.monotonic()
+            try:
+                await self._call(self.db_runner, self.writer, batch)
+            except Exception as e:
+                self._failed_batches += 1
+                print(f"检测记录批量写入失败: {str(e)}")
+                if self.spill_path:
+                    await self._spill(batch)
+                    return False
+                if self._closing:
+                    print(f"⚠️ 关闭过程中丢弃 {len(batch)} 条未写入的检测记录")
+                    return False
+                # 重试期间队列逐渐写满，新的请求在入队处等待
+                await asyncio.sleep(self.retry_delay)
+                continue
+            self._batches_total += 1
+            self._written_total += len(batch)
+            self._last_batch_seconds = time.monotonic() - started
+            return True
+
+    async def _spill(self, records: List[InferenceRequestCreate]):
+        """把记录追加到本地溢出文件"""
+        await self._call(self.file_runner, _append_spill, self.spill_path, records)
+        self._spilled_total += len(records)
+
+    async def _replay_spill(self):
+        """
+        把溢出文件中的记录补写到数据库
+
+        溢出文件先改名为 .replay 再补写，补写期间新溢出的记录写入新文件；
+        补写失败时只把尚未写入的记录留在 .replay 文件中，下次再试。
+        """
+        replaying = self.spill_path + ".replay"
+        while True:
+            if not os.path.exists(replaying):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replaying)
+            records = await self._call(self.file_runner, _read_spill, replaying)
+            for start in range(0, len(records), self.batch_size):
+                try:
+                    await self._call(self.db_runner, self.writer, records[start:start + self.batch_size])
+                except Exception as e:
+                    print(f"溢出记录补写失败，稍后重试: {str(e)}")
+                    await self._call(self.file_runner, _rewrite_spill, replaying, records[start:])
+                    self._replayed_total += start
+                    return
+            os.remove(replaying)
+            self._replayed_total += len(records)
+            print(f"已补写 {len(records)} 条溢出的检测记录")
+
+    def metrics(self) -> Dict[str, object]:
+        """后写队列运行指标"""
+        return {
+            "enabled": True,
+            "running": self.running,
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "maxsize": self.maxsize,
+            "enqueued_total": self._enqueued_total,
+            "written_total": self._written_total,
+            "batches_total": self._batches_total,
+            "failed_batches": self._failed_batches,
+            "spilled_total": self._spilled_total,
+            "replayed_total": self._replayed_total,
+            "spill_pending": bool(self.spill_path) and (
+                os.path.exists(self.spill_path) or os.path.exists(self.spill_path + ".replay")
+            ),
+            "last_batch_seconds": round(self._last_batch_seconds, 4),
+        }
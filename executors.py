@@ -0,0 +1,166 @@
+"""
+后台执行器管理
+
+CPU密集的图片解码、模型推理以及同步的数据库操作都不能直接在
+asyncio事件循环中执行，否则会阻塞 /health 等其他请求。
+这里为它们分别提供有界的专用线程池（推理可选进程池）。
+切片推理请求的分发和合并在专用线程池中执行，只等待各批次而不占用推理工作者；
+批次在进程内共享的切片线程池（推理使用进程池时为推理进程池）中执行，并发请求不会各自创建线程。
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict
+
+# 执行器配置
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")  # thread | process
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "2"))
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+# 同时分发的切片推理请求数，这些线程大部分时间在等待切片批次完成
+TILED_REQUEST_WORKERS = int(os.getenv("TILED_REQUEST_WORKERS", "2"))
+# 切片推理线程池大小，超过CPU核数只会增加争抢和张量内存
+TILE_POOL_WORKERS = min(int(os.getenv("TILE_POOL_WORKERS", str(os.cpu_count() or 1))), os.cpu_count() or 1)
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))  # 0 表示按CPU核数和推理并发数自动计算
+
+_executors: Dict[str, Executor] = {}
+_pending: Dict[str, int] = {"inference": 0, "preprocess": 0, "db": 0, "tiled": 0}
+_lock = threading.Lock()
+
+
+def _torch_threads() -> int:
+    """每个推理工作者可用的torch线程数"""
+    if TORCH_THREADS > 0:
+        return TORCH_THREADS
+    return max(1, (os.cpu_count() or 1) // max(INFERENCE_WORKERS, 1))
+
+
+def configure_torch_threads():
+    """限制torch的算子内线程数，避免多个推理工作者争抢CPU"""
+    try:
+        import torch
+        torch.set_num_threads(_torch_threads())
+    except ImportError:
+        pass
+
+
+def _warmup_model() -> bool:
+    """加载并预热当前进程中的模型"""
+    from ai.inference import model_registry
+    return model_registry.warmup()
+
+
+def _init_inference_process():
+    """推理子进程初始化：限制线程数并加载、预热模型"""
+    configure_torch_threads()
+    _warmup_model()
+
+
+def _create_executor(name: str) -> Executor:
+    """按名称创建执行器"""
+    if name == "inference":
+        if INFERENCE_EXECUTOR == "process":
+            # torch在fork后的子进程中可能死锁，使用spawn启动子进程
+            return ProcessPoolExecutor(
+                max_workers=max(INFERENCE_WORKERS, 1),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_inference_process
+            )
+        configure_torch_threads()
+        return ThreadPoolExecutor(max_workers=max(INFERENCE_WORKERS, 1), thread_name_prefix="inference")
+    if name == "preprocess":
+        return ThreadPoolExecutor(max_workers=max(PREPROCESS_WORKERS, 1), thread_name_prefix="preprocess")
+    if name == "db":
+        return ThreadPoolExecutor(max_workers=max(DB_WORKERS, 1), thread_name_prefix="db")
+    if name == "tiled":
+        return ThreadPoolExecutor(max_workers=max(TILED_REQUEST_WORKERS, 1), thread_name_prefix="tiled")
+    if name == "tile":
+        return ThreadPoolExecutor(max_workers=max(TILE_POOL_WORKERS, 1), thread_name_prefix="tile")
+    raise ValueError(f"未知的执行器: {name}")
+
+
+def get_executor(name: str) -> Executor:
+    """获取（必要时创建）指定名称的执行器"""
+    executor = _executors.get(name)
+    if executor is None:
+        with _lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = _create_executor(name)
+                _executors[name] = executor
+    return executor
+
+
+async def _run(name: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """在指定执行器中运行同步函数并等待结果"""
+    loop = asyncio.get_running_loop()
+    call = partial(fn, *args, **kwargs) if kwargs else partial(fn, *args)
+    _pending[name] += 1
+    try:
+        return await loop.run_in_executor(get_executor(name), call)
+    finally:
+        _pending[name] -= 1
+
+
+async def run_inference(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """在推理执行器中运行模型推理"""
+    return await _run("inference", fn, *args, **kwargs)
+
+
+async def run_preprocess(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """在预处理线程池中运行图片解码等CPU操作"""
+    return await _run("preprocess", fn, *args, **kwargs)
+
+
+async def run_tiled(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """在切片请求线程池中分发切片推理，不占用推理执行器"""
+    return await _run("tiled", fn, *args, **kwargs)
+
+
+async def run_db(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """在数据库线程池中运行同步的数据库操作"""
+    return await _run("db", fn, *args, **kwargs)
+
+
+def uses_process_pool() -> bool:
+    """推理是否在独立进程中执行"""
+    return INFERENCE_EXECUTOR == "process"
+
+
+async def warmup_inference_workers() -> bool:
+    """
+    启动并预热全部推理子进程
+
+    Returns:
+        bool: 全部子进程预热是否成功
+    """
+    results = await asyncio.gather(*(
+        run_inference(_warmup_model) for _ in range(max(INFERENCE_WORKERS, 1))
+    ))
+    return all(results)
+
+
+def shutdown_executors(wait: bool = True):
+    """关闭全部执行器，下次使用时会重新创建"""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+def executor_metrics() -> Dict[str, Any]:
+    """获取执行器配置和排队中的任务数"""
+    return {
+        "inference_executor": INFERENCE_EXECUTOR,
+        "inference_workers": INFERENCE_WORKERS,
+        "preprocess_workers": PREPROCESS_WORKERS,
+        "db_workers": DB_WORKERS,
+        "tiled_request_workers": TILED_REQUEST_WORKERS,
+        "tile_pool_workers": TILE_POOL_WORKERS,
+        "torch_threads": _torch_threads(),
+        "pending": dict(_pending),
+    }
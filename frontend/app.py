@@ -3,7 +3,7 @@
 """
 import os
 import io
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import streamlit as st
 import requests
@@ -22,6 +22,25 @@ st.set_page_config(
 # API基础URL - 支持本地开发和生产环境
 API_BASE_URL = os.getenv("API_BASE_URL", st.secrets.get("API_BASE_URL", "http://localhost:8000"))
 
+
+def history_previous_page():
+    """历史记录翻到上一页"""
+    st.session_state.history_page = max(st.session_state.history_page - 1, 0)
+
+
+def history_next_page(next_cursor: str):
+    """历史记录翻到下一页，记下该页的起始游标"""
+    page = st.session_state.history_page + 1
+    cursors = st.session_state.history_cursors
+    del cursors[page:]
+    cursors.append(next_cursor)
+    st.session_state.history_page = page
+
+
+# 趋势图的时间段粒度和默认显示的天数
+TIMESERIES_BUCKETS = {"分钟": ("minute", 0), "小时": ("hour", 7), "天": ("day", 90), "周": ("week", 365)}
+
+
 # 应用标题和描述
 st.title("🌊 海洋垃圾检测系统")
 st.markdown("""
@@ -207,19 +226,22 @@ elif page == "📊 历史记录":
             index=1
         )
     
+    # 游标分页：记录每一页的起始游标，筛选条件变化时回到第一页
+    history_key = (category_filter, records_per_page)
+    if st.session_state.get("history_key") != history_key:
+        st.session_state.history_key = history_key
+        st.session_state.history_cursors = [None]
+        st.session_state.history_page = 0
+    
     with col3:
-        page_number = st.number_input(
-            "页码",
-            min_value=1,
-            value=1
-        )
+        st.metric("页码", st.session_state.history_page + 1)
     
     # 获取历史记录
     try:
-        params = {
-            "skip": (page_number - 1) * records_per_page,
-            "limit": records_per_page
-        }
+        params = {"limit": records_per_page}
+        cursor = st.session_state.history_cursors[st.session_state.history_page]
+        if cursor:
+            params["cursor"] = cursor
         
         if category_filter != "全部":
             params["label_filter"] = category_filter
@@ -242,6 +264,25 @@ elif page == "📊 历史记录":
                 
                 st.dataframe(display_df, use_container_width=True, hide_index=True)
                 
+                # 翻页：下一页的游标在响应头中返回
+                next_cursor = response.headers.get("X-Next-Cursor")
+                nav_previous, nav_next = st.columns(2)
+                with nav_previous:
+                    st.button(
+                        "⬅️ 上一页",
+                        disabled=st.session_state.history_page == 0,
+                        on_click=history_previous_page,
+                        use_container_width=True
+                    )
+                with nav_next:
+                    st.button(
+                        "下一页 ➡️",
+                        disabled=not next_cursor,
+                        on_click=history_next_page,
+                        args=(next_cursor,),
+                        use_container_width=True
+                    )
+                
                 # 显示统计信息
                 st.subheader("📈 本页统计")
                 col1, col2, col3, col4 = st.columns(4)
@@ -276,7 +317,7 @@ elif page == "📈 统计分析":
     try:
         # 获取统计数据
         stats_response = requests.get(f"{API_BASE_URL}/api/stats")
-        recent_response = requests.get(f"{API_BASE_URL}/api/recent", params={"limit": 20})
+        recent_response = requests.get(f"{API_BASE_URL}/api/recent", params={"limit": 10})
         
         if stats_response.status_code == 200:
             stats = stats_response.json()
@@ -329,6 +370,72 @@ elif page == "📈 统计分析":
                     )
                     st.plotly_chart(fig_bar, use_container_width=True)
             
+            # 检测趋势
+            st.subheader("📉 检测趋势")
+            col1, col2, col3 = st.columns(3)
+            
+            with col1:
+                bucket_name = st.selectbox("时间粒度", list(TIMESERIES_BUCKETS), index=1)
+            
+            bucket, default_days = TIMESERIES_BUCKETS[bucket_name]
+            today = datetime.now().date()
+            
+            with col2:
+                date_range = st.date_input(
+                    "日期范围",
+                    value=(today - timedelta(days=default_days), today),
+                    max_value=today,
+                    key=f"trend_range_{bucket}"
+                )
+            
+            with col3:
+                trend_label = st.selectbox("垃圾类别", ["全部"] + list(stats["categories_count"].keys()))
+            
+            if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+                trend_params = {
+                    "bucket": bucket,
+                    "start": datetime.combine(date_range[0], datetime.min.time()).isoformat(),
+                    "end": datetime.combine(date_range[1] + timedelta(days=1), datetime.min.time()).isoformat()
+                }
+                if trend_label != "全部":
+                    trend_params["label"] = trend_label
+                
+                trend_response = requests.get(f"{API_BASE_URL}/api/stats/timeseries", params=trend_params)
+                
+                if trend_response.status_code == 200:
+                    points = trend_response.json()["points"]
+                    
+                    if points:
+                        trend_df = pd.DataFrame(points)
+                        trend_df["bucket"] = pd.to_datetime(trend_df["bucket"])
+                        
+                        col1, col2 = st.columns(2)
+                        
+                        with col1:
+                            fig_count = px.bar(trend_df, x="bucket", y="count", title="检测数量趋势")
+                            fig_count.update_layout(xaxis_title="时间", yaxis_title="检测数量")
+                            st.plotly_chart(fig_count, use_container_width=True)
+                        
+                        with col2:
+                            fig_confidence = px.line(
+                                trend_df,
+                                x="bucket",
+                                y=["avg_confidence", "min_confidence", "max_confidence"],
+                                title="置信度趋势"
+                            )
+                            fig_confidence.update_layout(
+                                xaxis_title="时间",
+                                yaxis_title="置信度",
+                                legend_title_text=""
+                            )
+                            st.plotly_chart(fig_confidence, use_container_width=True)
+                    else:
+                        st.info("📝 所选时间范围内暂无检测记录")
+                else:
+                    st.warning(f"⚠️ 获取趋势数据失败：{trend_response.json().get('detail', trend_response.status_code)}")
+            else:
+                st.info("请选择开始和结束日期")
+            
             # 最近检测记录
             if recent_response.status_code == 200:
                 recent_data = recent_response.json()
@@ -340,27 +447,12 @@ elif page == "📈 统计分析":
                     recent_df['timestamp'] = pd.to_datetime(recent_df['timestamp'])
                     recent_df['日期时间'] = recent_df['timestamp'].dt.strftime('%m-%d %H:%M')
                     
-                    # 时间趋势图
-                    fig_timeline = px.scatter(
-                        recent_df,
-                        x='timestamp',
-                        y='confidence',
-                        color='label',
-                        title="最近检测置信度趋势",
-                        hover_data=['filename']
-                    )
-                    fig_timeline.update_layout(
-                        xaxis_title="时间",
-                        yaxis_title="置信度"
-                    )
-                    st.plotly_chart(fig_timeline, use_container_width=True)
-                    
                     # 最近记录表格
                     display_recent = recent_df[['filename', 'label', 'confidence', '日期时间']].copy()
                     display_recent.columns = ['文件名', '垃圾类别', '置信度', '检测时间']
                     display_recent['置信度'] = display_recent['置信度'].round(3)
                     
-                    st.dataframe(display_recent.head(10), use_container_width=True, hide_index=True)
+                    st.dataframe(display_recent, use_container_width=True, hide_index=True)
         
         else:
             st.error(f"❌ 获取统计数据失败：HTTP {stats_response.status_code}")
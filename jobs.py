@@ -0,0 +1,405 @@
+"""
+异步检测任务
+
+POST /api/jobs 把图片写入数据库中的持久化队列后立即返回任务ID，
+后台工作者从队列中领取任务逐张检测，GET /api/jobs/{id} 查询进度和结果。
+服务重启后未完成的任务会被重新领取，已完成的图片不会重复检测。
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from db.session import engine
+from db.models import DetectionCreate, InferenceRequestCreate, Job, JobItem
+from db.crud import (
+    create_job, add_job_items, enqueue_job, claim_job, get_pending_job_items,
+    complete_job_item, finish_job, release_job, renew_job_lease, abort_job, delete_job, get_job, get_job_results
+)
+from executors import run_db
+
+# 任务队列配置
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # 同时处理的任务数
+JOB_ITEM_CONCURRENCY = int(os.getenv("JOB_ITEM_CONCURRENCY", "8"))  # 单个任务同时检测的图片数
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))  # 暂时失败后重新领取前的等待秒数
+JOB_MAX_ITEMS = int(os.getenv("JOB_MAX_ITEMS", "10000"))  # 单个任务的最大图片数
+JOB_INSERT_CHUNK = 50  # 提交任务时每个事务写入的图片数
+JOB_EVENT_BUFFER = int(os.getenv("JOB_EVENT_BUFFER", "256"))  # 每个订阅者最多缓存的事件数
+
+# 检测函数：输入图片字节，返回 [{"class_name": ..., "confidence": ...}, ...]
+ClassifyFn = Callable[[bytes], Awaitable[List[Dict[str, Any]]]]
+# 图片元数据函数：输入图片字节，返回随检测请求保存的字段（content_hash/width/height/model_version）
+DescribeFn = Callable[[bytes], Awaitable[Dict[str, Any]]]
+
+
+class RetryableJobError(RuntimeError):
+    """暂时性的失败（例如推理队列已满），整个任务稍后重试"""
+
+
+class JobSubscription:
+    """
+    一个任务的进度事件订阅
+
+    工作者不会因为订阅者读取慢而等待：缓冲区写满时丢弃事件并标记 lagged，
+    订阅者应从数据库重新同步后清除标记。
+    """
+
+    def __init__(self, job_id: str, maxsize: int = JOB_EVENT_BUFFER):
+        self.job_id = job_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.lagged = False
+
+    def publish(self, event: Dict[str, Any]):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """等待下一个事件，超时返回None"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+def _new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _with_session(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """工作者不在请求上下文中，每次数据库操作使用独立的会话"""
+    with Session(engine) as session:
+        return fn(session, *args, **kwargs)
+
+
+class JobQueue:
+    """
+    基于数据库的异步检测任务队列
+
+    workers 个工作循环各自领取一个任务，即任务级并发上限；
+    每个任务内最多 item_concurrency 张图片同时检测。
+    工作者持有任务期间定期续约，进程异常退出后租约过期，任务会被其他工作者重新领取。
+    """
+
+    def __init__(
+        self,
+        classify: ClassifyFn,
+        describe: Optional[DescribeFn] = None,
+        workers: int = JOB_WORKERS,
+        item_concurrency: int = JOB_ITEM_CONCURRENCY,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        retry_delay: float = JOB_RETRY_DELAY
+    ):
+        self.classify = classify
+        self.describe = describe
+        self.workers = max(workers, 1)
+        self.item_concurrency = max(item_concurrency, 1)
+        self.max_attempts = max(max_attempts, 1)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._active: Dict[str, int] = {}
+        self._subscribers: Dict[str, List[JobSubscription]] = {}
+
+        # 指标
+        self._submitted_total = 0
+        self._completed_total = 0
+        self._failed_total = 0
+        self._retried_total = 0
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    def start(self):
+        """启动工作循环，必须在事件循环中调用"""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._run()) for _ in range(self.workers)]
+        print(f"异步任务队列已启动: 工作者 {self.workers}, 单任务并发 {self.item_concurrency}")
+
+    async def stop(self):
+        """停止工作循环，正在处理的任务归还队列，不计入重试次数"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job_id, attempts in list(self._active.items()):
+            await run_db(_with_session, release_job, job_id, consume_attempt=False, attempts=attempts)
+        self._active.clear()
+
+    def subscribe(self, job_id: str) -> JobSubscription:
+        """订阅本进程中该任务的单张图片完成事件和任务结束事件"""
+        subscription = JobSubscription(job_id)
+        self._subscribers.setdefault(job_id, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: JobSubscription):
+        """取消订阅"""
+        subscribers = self._subscribers.get(subscription.job_id, [])
+        if subscription in subscribers:
+            subscribers.remove(subscription)
+        if not subscribers:
+            self._subscribers.pop(subscription.job_id, None)
+
+    def _publish(self, job_id: str, event: Dict[str, Any]):
+        for subscription in self._subscribers.get(job_id, []):
+            subscription.publish(event)
+
+    async def submit(self, entries, max_items: int = JOB_MAX_ITEMS) -> Job:
+        """
+        创建任务并写入图片，全部写入后才进入队列
+
+        写入过程中出错（包括客户端断开）时任务标记为失败，已写入的图片数据被清空。
+
+        Args:
+            entries: 异步迭代器，依次产出 (文件名, 图片字节, 错误信息)
+            max_items: 单个任务的最大图片数，超出时任务标记为失败并抛出ValueError；
+                       没有任何图片时删除任务并抛出ValueError
+
+        Returns:
+            Job: 新创建的任务
+        """
+        job = Job(id=_new_job_id(), status="receiving", max_attempts=self.max_attempts)
+        job = await run_db(_with_session, create_job, job)
+
+        total = failed = 0
+        chunk: List[JobItem] = []
+        try:
+            async for filename, data, error in entries:
+                if total >= max_items:
+                    raise ValueError(f"任务图片数量超过限制（最多{max_items}张）")
+                chunk.append(JobItem(
+                    job_id=job.id,
+                    position=total,
+                    filename=filename[:255],
+                    status="failed" if error else "pending",
+                    data=data,
+                    error=error
+                ))
+                total += 1
+                failed += 1 if error else 0
+                if len(chunk) >= JOB_INSERT_CHUNK:
+                    await run_db(_with_session, add_job_items, chunk)
+                    chunk = []
+            if chunk:
+                await run_db(_with_session, add_job_items, chunk)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                message = "任务提交被中断"
+            elif isinstance(e, ValueError):
+                message = str(e)
+            else:
+                message = f"提交任务失败: {str(e)}"
+            # 任务不会再进入队列，不能停留在 receiving 状态；请求被取消时也要完成清理
+            await asyncio.shield(run_db(_with_session, abort_job, job.id, message))
+            raise
+
+        if total == 0:
+            # 客户端拿不到任务ID，不留下空任务
+            await run_db(_with_session, delete_job, job.id)
+            raise ValueError("没有找到可检测的图片")
+
+        await run_db(_with_session, enqueue_job, job.id, total, failed)
+        self._submitted_total += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+        job.status = "queued" if failed < total else "completed"
+        job.total = total
+        job.processed = job.failed = failed
+        return job
+
+    async def _run(self):
+        """工作循环：领取任务并处理，队列为空时等待新任务或轮询间隔"""
+        while True:
+            try:
+                job = await run_db(_with_session, claim_job, self.lease_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"领取异步任务失败: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._active[job.id] = job.attempts
+            processing = asyncio.ensure_future(self._process(job))
+            renewing = asyncio.ensure_future(self._renew_lease(job))
+            try:
+                await asyncio.wait({processing, renewing}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                renewing.cancel()
+                if not processing.done():
+                    # 租约已丢失，或工作循环被取消
+                    processing.cancel()
+                await asyncio.gather(processing, renewing, return_exceptions=True)
+                self._active.pop(job.id, None)
+
+    async def _renew_lease(self, job: Job):
+        """
+        处理任务期间定期续约，单张图片检测很慢时租约也不会过期
+
+        任务已被其他工作者重新领取时返回，由工作循环停止处理该任务。
+        """
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                owned = await run_db(_with_session, renew_job_lease, job.id, job.attempts, self.lease_seconds)
+            except Exception as e:
+                print(f"异步任务 {job.id} 续约失败: {str(e)}")
+                continue
+            if not owned:
+                print(f"异步任务 {job.id} 已被其他工作者接管，停止处理")
+                return
+
+    async def _process(self, job: Job):
+        """逐批检测任务中尚未处理的图片"""
+        print(f"开始处理异步任务 {job.id}（第 {job.attempts} 次）")
+        semaphore = asyncio.Semaphore(self.item_concurrency)
+        position = -1
+        try:
+            while True:
+                items = await run_db(
+                    _with_session, get_pending_job_items, job.id, position, self.item_concurrency * 2
+                )
+                if not items:
+                    break
+                position = items[-1].position
+                # 等本批图片全部结束后再处理异常，避免任务归还队列后仍有图片在检测
+                outcomes = await asyncio.gather(
+                    *[self._process_item(job, item, semaphore) for item in items],
+                    return_exceptions=True
+                )
+                for outcome in outcomes:
+                    if isinstance(outcome, BaseException):
+                        raise outcome
+        except asyncio.CancelledError:
+            raise
+        except RetryableJobError as e:
+            self._retried_total += 1
+            print(f"异步任务 {job.id} 暂时失败，稍后重试: {str(e)}")
+            await run_db(
+                _with_session, release_job, job.id, str(e), retry_delay=self.retry_delay, attempts=job.attempts
+            )
+            return
+        except Exception as e:
+            print(f"异步任务 {job.id} 失败: {str(e)}")
+            await self._finish(job, "failed", str(e))
+            return
+
+        await self._finish(job, "completed")
+
+    async def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        """结束仍由本工作者持有的任务并通知订阅者，任务已被其他工作者接管时不做任何事"""
+        finished = await run_db(_with_session, finish_job, job.id, status, error, attempts=job.attempts)
+        if not finished:
+            print(f"异步任务 {job.id} 已被其他工作者接管，不再更新状态")
+            return
+        if status == "completed":
+            self._completed_total += 1
+            print(f"异步任务 {job.id} 处理完成")
+        else:
+            self._failed_total += 1
+        self._publish(job.id, {"type": "end", "status": status})
+
+    async def _process_item(self, job: Job, item: JobItem, semaphore: asyncio.Semaphore):
+        """检测一张图片并在一个事务中保存结果和进度"""
+        async with semaphore:
+            result, error, request, detections, shown = None, None, None, [], []
+            try:
+                started = time.perf_counter()
+                detections = await self.classify(item.data)
+                latency_ms = (time.perf_counter() - started) * 1000
+                # 检测框只写入检测记录表，图片结果（保存的和实时推送的）保持与同步接口一致的格式
+                shown = [{"class_name": d["class_name"], "confidence": d["confidence"]} for d in detections]
+                result = json.dumps(shown, ensure_ascii=False)
+                metadata = await self.describe(item.data) if self.describe is not None else {}
+                request = InferenceRequestCreate(
+                    filename=item.filename,
+                    latency_ms=round(latency_ms, 3),
+                    detections=[
+                        DetectionCreate(label=d["class_name"], confidence=d["confidence"], box=d.get("box"))
+                        for d in detections
+                    ],
+                    **metadata
+                )
+            except (asyncio.CancelledError, RetryableJobError):
+                raise
+            except Exception as e:
+                # 图片本身的问题重试也不会成功，直接记录为失败
+                error = str(e)
+
+            recorded = await run_db(
+                _with_session, complete_job_item,
+                item.id, job.id, result, error, request, self.lease_seconds
+            )
+            if not recorded:
+                # 其他工作者已经处理过这张图片
+                return
+            self._publish(job.id, {"type": "item", "item": {
+                "position": item.position,
+                "filename": item.filename,
+                "status": "failed" if error else "done",
+                "success": error is None,
+                "detections": shown,
+                "error": error,
+            }})
+
+    def metrics(self) -> Dict[str, object]:
+        """任务队列运行指标"""
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "item_concurrency": self.item_concurrency,
+            "active_jobs": len(self._active),
+            "submitted_total": self._submitted_total,
+            "completed_total": self._completed_total,
+            "failed_total": self._failed_total,
+            "retried_total": self._retried_total,
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+        }
+
+
+def parse_job_results(rows: List[Tuple[int, str, str, Optional[str], Optional[str]]]) -> List[Dict[str, Any]]:
+    """把数据库中的图片结果转换为响应条目"""
+    return [
+        {
+            "position": position,
+            "filename": filename,
+            "status": status,
+            "success": status == "done",
+            "detections": json.loads(result) if result else [],
+            "error": error,
+        }
+        for position, filename, status, result, error in rows
+    ]
+
+
+def load_job_snapshot(job_id: str) -> Tuple[Optional[Job], List[Tuple[int, str, str, Optional[str], Optional[str]]]]:
+    """读取任务状态和全部图片结果，用于事件流的初始同步和重新同步"""
+    with Session(engine) as session:
+        job = get_job(session, job_id)
+        if job is None:
+            return None, []
+        return job, get_job_results(session, job_id)
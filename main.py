@@ -1,23 +1,50 @@
 """
 海洋垃圾检测 FastAPI 后端服务
 """
+import asyncio
+import hashlib
+import json
 import os
 import time
-import tempfile
-from typing import List, Optional
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlmodel import Session
 
-from ai.inference import classify_image, validate_image
-from models import PredictionResponse, ErrorResponse, Detection, CATEGORY_NAMES
+from ai.inference import DECODE_TARGET_SIZE, DetectionResult, decode_image, validate_image, model_registry
+from ai.image_io import ImageTooLargeError, probe_image
+from ai.preprocess import tensor_pool
+from ai.batching import BatchScheduler, SchedulerOverloadedError, BATCH_MAX_SIZE
+from ai.cache import ResultCache, RESULT_CACHE_ENABLED
+from ai.singleflight import SingleFlight
+from ai.tiling import classify_tiled
+from executors import (
+    INFERENCE_WORKERS, TILE_POOL_WORKERS, get_executor, run_inference, run_preprocess, run_db, run_tiled,
+    uses_process_pool, warmup_inference_workers, shutdown_executors, executor_metrics
+)
+from jobs import JobQueue, RetryableJobError, parse_job_results, load_job_snapshot
+from uploads import (
+    MAX_FILE_SIZE, MAX_BATCH_UPLOAD_SIZE, MULTIPART_OVERHEAD, BATCH_MAX_ITEMS,
+    PooledBuffer, UploadLimitMiddleware, UploadTooLargeError, upload_buffers,
+    read_upload, read_upload_bytes, archive_format, iter_archive
+)
+from models import (
+    PredictionResponse, BatchPredictionResponse, BatchItemResult, JobResponse,
+    ErrorResponse, Detection, CATEGORY_NAMES
+)
 from db.session import get_session, init_database
-from db.models import PredictionCreate, PredictionRead, PredictionStats
+from db.writer import WriteBehindQueue, DB_WRITE_BEHIND
+from db.models import (
+    DetectionCreate, InferenceRequestCreate, PredictionRead, PredictionStats, PredictionTimeseries
+)
+from db.rollups import get_prediction_timeseries
 from db.crud import (
-    create_prediction, get_predictions,
-    get_prediction_stats, get_recent_predictions
+    create_inference_requests, get_predictions, get_predictions_page, get_job, get_job_results,
+    get_prediction_stats
 )
 
 # 创建FastAPI应用
@@ -34,16 +61,111 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # 浏览器端需要读取分页游标
+)
+
+# 接收请求体时即限制上传大小，超限的请求不会被完整读入
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/api/predict": MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+        "/api/predict/batch": MAX_BATCH_UPLOAD_SIZE,
+        "/api/predict/batch/stream": MAX_BATCH_UPLOAD_SIZE,
+        "/api/jobs": MAX_BATCH_UPLOAD_SIZE,
+    },
 )
 
+# 动态微批推理调度器，批量推理在专用执行器中运行
+inference_scheduler = BatchScheduler(runner=run_inference, concurrency=INFERENCE_WORKERS)
+
+# 批量检测时同时推理的图片数，保持调度器批次饱满
+BATCH_ITEM_CONCURRENCY = BATCH_MAX_SIZE * INFERENCE_WORKERS * 2
+
+# Server-Sent Events响应头，禁止代理缓冲以便逐条送达
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# 没有新事件时，间隔多少秒从数据库重新同步一次任务进度并发送心跳
+JOB_EVENTS_SYNC_INTERVAL = float(os.getenv("JOB_EVENTS_SYNC_INTERVAL", "2.0"))
+
+# 重复上传图片的检测结果缓存
+result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
+
+# 合并相同图片的并发推理，重试请求等待进行中的结果
+inference_flight = SingleFlight()
+
+# 检测记录后写队列，开启后响应不再等待数据库
+prediction_writer = WriteBehindQueue(db_runner=run_db, file_runner=run_preprocess) if DB_WRITE_BEHIND else None
+
+
+
+def _fingerprint(data: bytes) -> Dict[str, object]:
+    """图片内容的SHA-256、文件头中的尺寸和模型版本（模型文件变化后需要重新计算哈希）"""
+    info = probe_image(data)
+    return {
+        "content_hash": hashlib.sha256(data).hexdigest(),
+        "width": info.width if info else None,
+        "height": info.height if info else None,
+        "model_version": model_registry.version(),
+    }
+
+
+async def _describe_upload(file_content: bytes) -> Dict[str, object]:
+    """随检测请求保存的图片元数据：内容哈希、尺寸和模型版本"""
+    return await run_preprocess(_fingerprint, file_content)
+
+
+async def _classify_job_item(file_content: bytes) -> List[dict]:
+    """异步任务的单张图片检测，推理队列已满时整个任务稍后重试"""
+    try:
+        raw_results, _ = await _classify_upload(file_content)
+    except HTTPException as e:
+        if e.status_code == 503:
+            raise RetryableJobError(str(e.detail))
+        raise ValueError(str(e.detail))
+    return [
+        {"class_name": CATEGORY_NAMES.get(class_name, class_name), "confidence": round(confidence, 3), "box": box}
+        for class_name, confidence, box in raw_results
+    ]
+
+
+# 基于数据库的异步检测任务队列
+job_queue = JobQueue(classify=_classify_job_item, describe=_describe_upload)
+
+
 # 应用启动时初始化数据库
 @app.on_event("startup")
 async def startup_event():
     """应用启动时的初始化操作"""
     init_database()
+    if result_cache is not None:
+        # 模型切换后旧模型的检测结果全部失效
+        model_registry.add_swap_listener(result_cache.on_model_swap)
+    # 加载并预热模型，避免首个请求承担模型加载开销
+    if uses_process_pool():
+        # 模型在推理子进程中加载，主进程只记录就绪状态
+        if await warmup_inference_workers():
+            model_registry.mark_ready()
+    else:
+        await run_inference(model_registry.warmup)
+    inference_scheduler.start()
+    job_queue.start()
+    if prediction_writer is not None:
+        prediction_writer.start()
     print("海洋垃圾检测API服务启动完成")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时的清理操作"""
+    await job_queue.stop()
+    await inference_scheduler.stop()
+    if prediction_writer is not None:
+        # 写完队列中的检测记录后再关闭数据库线程池
+        await prediction_writer.stop()
+    shutdown_executors()
+    if result_cache is not None:
+        result_cache.close()
+
+
 @app.get("/")
 async def root():
     """根路径健康检查"""
@@ -51,12 +173,23 @@ async def root():
 
 
 @app.post("/api/predict", response_model=PredictionResponse)
-async def predict_trash(file: UploadFile = File(...), session: Session = Depends(get_session)):
+async def predict_trash(
+    file: UploadFile = File(...),
+    tiled: bool = Query(False, description="是否对高分辨率图片使用切片推理"),
+    tile_size: Optional[int] = Query(None, ge=64, le=4096, description="切片边长（像素）"),
+    tile_overlap: Optional[float] = Query(None, ge=0.0, lt=1.0, description="相邻切片的重叠比例"),
+    tile_workers: Optional[int] = Query(None, ge=1, le=64, description="并行推理的切片批次数，不超过服务端切片线程池大小"),
+    session: Session = Depends(get_session)
+):
     """
     预测上传图片中的海洋垃圾类别
     
     Args:
         file: 上传的图片文件
+        tiled: 是否使用切片推理，适用于无人机和卫星拍摄的大图
+        tile_size: 切片边长，默认 TILE_SIZE
+        tile_overlap: 相邻切片的重叠比例，默认 TILE_OVERLAP
+        tile_workers: 并行推理的切片批次数，默认 TILE_WORKERS，超过 TILE_POOL_WORKERS 时按其处理
         session: 数据库会话
         
     Returns:
@@ -72,63 +205,54 @@ async def predict_trash(file: UploadFile = File(...), session: Session = Depends
                 detail="文件类型错误，请上传图片文件"
             )
         
-        # 验证文件大小 (10MB限制)
-        MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-        file_content = await file.read()
-        if len(file_content) > MAX_FILE_SIZE:
+        # 验证文件大小 (10MB限制)，分块读入可复用的缓冲区，超限时立即停止读取
+        try:
+            upload = await read_upload(file)
+        except UploadTooLargeError:
             raise HTTPException(
                 status_code=400,
                 detail="文件大小超过限制（最大10MB）"
             )
         
-        # 创建临时文件保存上传的图片
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
-        
+        # 切片参数会影响检测结果，需要参与缓存键
+        tiling = None
+        if tiled:
+            if tile_workers is not None:
+                # 切片批次在共享线程池中执行，并行度不能由客户端放大
+                tile_workers = min(tile_workers, TILE_POOL_WORKERS)
+            tiling = {"tile_size": tile_size, "overlap": tile_overlap, "workers": tile_workers}
         try:
-            # 验证图片文件
-            if not validate_image(temp_file_path):
-                raise HTTPException(
-                    status_code=400,
-                    detail="无效的图片文件"
-                )
-            
-            # 调用AI推理
-            raw_results = classify_image(temp_file_path)
-            
-            # 转换结果格式并保存到数据库
-            detections = []
-            for class_name, confidence in raw_results:
-                # 获取中文类别名称
-                display_name = CATEGORY_NAMES.get(class_name, class_name)
-                detections.append(Detection(
-                    class_name=display_name,
-                    confidence=round(confidence, 3)
-                ))
-                
-                # 保存检测结果到数据库
-                prediction_data = PredictionCreate(
-                    filename=file.filename or "unknown.jpg",
-                    label=display_name,
-                    confidence=round(confidence, 3)
-                )
-                create_prediction(session, prediction_data)
-            
-            processing_time = time.time() - start_time
-            
-            return PredictionResponse(
-                success=True,
-                detections=detections,
-                message=f"检测完成，发现 {len(detections)} 个垃圾对象",
-                processing_time=round(processing_time, 3)
-            )
-            
+            metadata = await _describe_upload(upload.view)
+            raw_results, cached = await _classify_upload(upload.view, tiling, upload, metadata["content_hash"])
         finally:
-            # 清理临时文件
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-                
+            upload.release()
+        latency_ms = (time.time() - start_time) * 1000
+        
+        # 转换结果格式
+        detections = []
+        for class_name, confidence, _ in raw_results:
+            # 获取中文类别名称
+            display_name = CATEGORY_NAMES.get(class_name, class_name)
+            detections.append(Detection(
+                class_name=display_name,
+                confidence=round(confidence, 3)
+            ))
+        
+        # 保存检测结果（开启后写模式时只入队，不等待数据库）
+        await _persist_requests(session, [
+            _inference_request(file.filename or "unknown.jpg", raw_results, metadata, latency_ms)
+        ])
+        
+        processing_time = time.time() - start_time
+        
+        return PredictionResponse(
+            success=True,
+            detections=detections,
+            message=f"检测完成，发现 {len(detections)} 个垃圾对象",
+            processing_time=round(processing_time, 3),
+            cached=cached
+        )
+        
     except HTTPException:
         # 重新抛出HTTP异常
         raise
@@ -146,36 +270,511 @@ async def predict_trash(file: UploadFile = File(...), session: Session = Depends
         )
 
 
+async def _classify_upload(
+    file_content: bytes,
+    tiling: Optional[dict] = None,
+    upload: Optional[PooledBuffer] = None,
+    content_hash: Optional[str] = None
+) -> Tuple[list, bool]:
+    """
+    检测一张上传的图片，依次尝试结果缓存和进行中的相同请求
+
+    Args:
+        file_content: 图片字节或缓冲区视图
+        tiling: 切片推理参数
+        upload: file_content 所在的池化缓冲区，推理任务解码完成前保持持有
+        content_hash: 已经计算好的图片SHA-256，整图推理时直接用作单飞合并的键
+
+    Returns:
+        Tuple: (检测结果列表, 是否命中缓存)
+    """
+    options = {"tiling": {k: v for k, v in tiling.items() if k != "workers"}} if tiling else None
+    
+    # 相同图片重复上传时直接使用缓存的检测结果
+    cache_key, raw_results = None, None
+    if result_cache is not None:
+        cache_key, raw_results = await run_preprocess(result_cache.lookup, file_content, options)
+    if raw_results is not None:
+        return raw_results, True
+    
+    # 相同图片已在推理中时等待同一个结果，每个请求仍各自保存记录
+    flight_key = cache_key or (content_hash if content_hash and not options else None)
+    if flight_key is None:
+        flight_key = await run_preprocess(_content_hash, file_content, options)
+    def start_inference():
+        # 推理任务可能比发起它的请求活得更久，解码完成前不能归还缓冲区
+        if upload is not None:
+            upload.retain()
+        return _infer_upload(file_content, cache_key, tiling, upload)
+    
+    raw_results = await inference_flight.do(flight_key, start_inference)
+    return raw_results, False
+
+
+def _content_hash(data: bytes, options: Optional[dict] = None) -> str:
+    """图片内容和推理选项的SHA-256，用作单飞合并的键"""
+    digest = hashlib.sha256(data)
+    if options:
+        digest.update(repr(sorted(options.items())).encode())
+    return digest.hexdigest()
+
+
+async def _infer_upload(
+    file_content: bytes,
+    cache_key: Optional[str],
+    tiling: Optional[dict] = None,
+    upload: Optional[PooledBuffer] = None
+):
+    """解码、验证并推理一张上传的图片，结果写入缓存"""
+    # 直接在内存中解码一次，验证和推理共用同一个数组；
+    # 整图推理只需要模型输入尺寸，切片推理需要原始分辨率
+    target_size = None if tiling is not None else DECODE_TARGET_SIZE
+    try:
+        image = await run_preprocess(decode_image, file_content, target_size=target_size)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        if upload is not None:
+            upload.release()
+    if not validate_image(image):
+        raise HTTPException(
+            status_code=400,
+            detail="无效的图片文件"
+        )
+    
+    if tiling is not None:
+        # 大图切片后自行分批推理，不经过微批调度器；分发线程只等待各批次，不占住推理工作者，
+        # 整图请求的微批仍可与切片批次交替执行。推理使用进程池时批次交给推理子进程
+        executor = get_executor("inference") if uses_process_pool() else None
+        raw_results = await run_tiled(classify_tiled, image, executor=executor, **tiling)
+    else:
+        # 调用AI推理（与并发请求合并为一个批次）
+        try:
+            raw_results = await inference_scheduler.submit(image)
+        except SchedulerOverloadedError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    
+    if result_cache is not None:
+        await run_preprocess(result_cache.put, cache_key, raw_results)
+    return raw_results
+
+
+def _inference_request(
+    filename: str, raw_results: List[DetectionResult], metadata: Dict[str, object], latency_ms: float
+) -> InferenceRequestCreate:
+    """一张图片的检测结果（含检测框）转换为待保存的检测请求"""
+    return InferenceRequestCreate(
+        filename=filename,
+        latency_ms=round(latency_ms, 3),
+        detections=[
+            DetectionCreate(label=CATEGORY_NAMES.get(class_name, class_name), confidence=round(confidence, 3), box=box)
+            for class_name, confidence, box in raw_results
+        ],
+        **metadata
+    )
+
+
+def _save_requests(session: Session, requests: List[InferenceRequestCreate]):
+    """在一个事务中保存检测请求及其全部检测结果"""
+    create_inference_requests(session, requests)
+
+
+async def _persist_requests(session: Session, requests: List[InferenceRequestCreate]):
+    """开启后写模式时放入后写队列，否则在数据库线程池中同步保存"""
+    if prediction_writer is not None:
+        await prediction_writer.submit(requests)
+    else:
+        await run_db(_save_requests, session, requests)
+
+
+@app.post("/api/predict/batch", response_model=BatchPredictionResponse)
+async def predict_batch(files: List[UploadFile] = File(...), session: Session = Depends(get_session)):
+    """
+    批量预测多张图片，或ZIP/TAR压缩包中的全部图片
+    
+    单张图片失败只记录在对应条目中，不影响同批其他图片。
+    
+    Args:
+        files: 上传的图片文件或压缩包，可以混合上传
+        session: 数据库会话
+        
+    Returns:
+        BatchPredictionResponse: 每张图片的检测结果和汇总统计
+    """
+    start_time = time.time()
+    items: List[Optional[BatchItemResult]] = []
+    requests: List[InferenceRequestCreate] = []
+    
+    async for index, item, request in _iter_batch_results(files):
+        items.extend([None] * (index + 1 - len(items)))
+        items[index] = item
+        if request is not None:
+            requests.append(request)
+    
+    if not items:
+        raise HTTPException(status_code=400, detail="没有找到可检测的图片")
+    
+    await _persist_requests(session, requests)
+    return _batch_summary(items, requests, start_time)
+
+
+@app.post("/api/predict/batch/stream")
+async def predict_batch_stream(files: List[UploadFile] = File(...), session: Session = Depends(get_session)):
+    """
+    批量预测并以Server-Sent Events逐张推送结果
+    
+    每张图片检测完成后立即推送一个 item 事件（按完成顺序，index 为上传顺序），
+    全部完成后推送 summary 事件。客户端读取慢时服务端会暂停检测，不会无限堆积结果。
+    
+    Args:
+        files: 上传的图片文件或压缩包，可以混合上传
+        session: 数据库会话
+        
+    Returns:
+        StreamingResponse: text/event-stream 响应
+    """
+    async def events():
+        start_time = time.time()
+        items: List[BatchItemResult] = []
+        requests: List[InferenceRequestCreate] = []
+        try:
+            async for index, item, request in _iter_batch_results(files):
+                items.append(item)
+                if request is not None:
+                    requests.append(request)
+                yield _sse("item", {"index": index, **item.dict()})
+        except HTTPException as e:
+            yield _sse("error", {"detail": e.detail})
+            return
+        
+        await _persist_requests(session, requests)
+        yield _sse("summary", _batch_summary(items, requests, start_time).dict(exclude={"items"}))
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+async def _iter_batch_results(files: List[UploadFile]):
+    """
+    检测批量上传中的每张图片，按完成顺序产出结果
+    
+    结果先放入有界队列；调用方消费慢时队列写满，检测任务停在写入处并占住并发名额，
+    读取压缩包的循环随之暂停，从而把背压一直传到上传数据的读取。
+    
+    Yields:
+        Tuple: (图片在上传中的序号, BatchItemResult, 待保存的检测请求，失败时为None)
+    """
+    results: asyncio.Queue = asyncio.Queue(maxsize=BATCH_ITEM_CONCURRENCY)
+    # 限制同时推理的图片数，既能凑满推理批次，又不会压垮调度队列
+    semaphore = asyncio.Semaphore(BATCH_ITEM_CONCURRENCY)
+    tasks = []
+    done = object()
+    
+    async def produce():
+        cancelled = False
+        try:
+            await read_uploads()
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # 被调用方取消时不再写入完成标记，其余情况（包括出错）都通知消费方结束
+            if not cancelled:
+                await results.put(done)
+    
+    async def read_uploads():
+        count = 0
+        async for filename, file_content, error in _iter_batch_uploads(files):
+            if count >= BATCH_MAX_ITEMS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"批量图片数量超过限制（最多{BATCH_MAX_ITEMS}张）"
+                )
+            index = count
+            count += 1
+            # 推理跟不上时暂停读取压缩包，避免把整个压缩包读进内存
+            await semaphore.acquire()
+            if error is not None:
+                await results.put((index, BatchItemResult(filename=filename, success=False, error=error), None))
+                semaphore.release()
+                continue
+            tasks.append(asyncio.ensure_future(
+                _predict_batch_item(index, filename, file_content, semaphore, results)
+            ))
+        await asyncio.gather(*tasks)
+    
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            entry = await results.get()
+            if entry is done:
+                break
+            yield entry
+        # 读取上传数据时的异常（例如图片数量超限）在这里抛给调用方
+        await producer
+    finally:
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+def _batch_summary(
+    items: List[BatchItemResult], requests: List[InferenceRequestCreate], start_time: float
+) -> BatchPredictionResponse:
+    """汇总批量检测结果"""
+    categories_count: Dict[str, int] = {}
+    total_detections = 0
+    for request in requests:
+        for detection in request.detections:
+            categories_count[detection.label] = categories_count.get(detection.label, 0) + 1
+            total_detections += 1
+    succeeded = sum(1 for item in items if item.success)
+    
+    return BatchPredictionResponse(
+        success=succeeded > 0,
+        total=len(items),
+        succeeded=succeeded,
+        failed=len(items) - succeeded,
+        total_detections=total_detections,
+        categories_count=categories_count,
+        items=items,
+        message=f"批量检测完成，{succeeded}/{len(items)} 张图片成功，发现 {total_detections} 个垃圾对象",
+        processing_time=round(time.time() - start_time, 3)
+    )
+
+
+def _sse(event: str, data) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+
+async def _iter_batch_uploads(files: List[UploadFile]):
+    """
+    依次产出批量上传中的每张图片，压缩包逐个条目展开
+
+    Yields:
+        Tuple: (文件名, 图片字节, 错误信息)
+    """
+    for file in files:
+        filename = file.filename or "unknown"
+        fmt = archive_format(file.filename, file.content_type)
+        
+        if fmt is None:
+            if not file.content_type or not file.content_type.startswith('image/'):
+                yield filename, None, "文件类型错误，请上传图片文件或ZIP/TAR压缩包"
+                continue
+            try:
+                file_content = await read_upload_bytes(file)
+            except UploadTooLargeError:
+                yield filename, None, "文件大小超过限制（最大10MB）"
+                continue
+            yield filename, file_content, None
+            continue
+        
+        # 在预处理线程池中逐个解压条目，不阻塞事件循环
+        entries = iter_archive(file.file, fmt)
+        while True:
+            try:
+                entry = await run_preprocess(next, entries, None)
+            except ValueError as e:
+                yield filename, None, str(e)
+                break
+            if entry is None:
+                break
+            name, data, error = entry
+            yield f"{filename}/{name}", data, error
+
+
+async def _predict_batch_item(
+    index: int,
+    filename: str,
+    file_content: bytes,
+    semaphore: asyncio.Semaphore,
+    results: asyncio.Queue
+):
+    """检测批量上传中的一张图片，失败时放入带错误信息的条目"""
+    try:
+        request = None
+        try:
+            started = time.time()
+            metadata = await _describe_upload(file_content)
+            raw_results, cached = await _classify_upload(file_content, content_hash=metadata["content_hash"])
+            detections = [
+                Detection(
+                    class_name=CATEGORY_NAMES.get(class_name, class_name),
+                    confidence=round(confidence, 3)
+                ) for class_name, confidence, _ in raw_results
+            ]
+            item = BatchItemResult(filename=filename, success=True, detections=detections, cached=cached)
+            request = _inference_request(filename, raw_results, metadata, (time.time() - started) * 1000)
+        except HTTPException as e:
+            item = BatchItemResult(filename=filename, success=False, error=str(e.detail))
+        except Exception as e:
+            item = BatchItemResult(filename=filename, success=False, error=f"处理图片时发生错误: {str(e)}")
+        await results.put((index, item, request))
+    finally:
+        semaphore.release()
+
+
+@app.post("/api/jobs", response_model=JobResponse, status_code=202)
+async def submit_job(files: List[UploadFile] = File(...)):
+    """
+    提交异步检测任务，立即返回任务ID
+    
+    接受多张图片或ZIP/TAR压缩包，图片写入持久化队列后由后台工作者处理，
+    不受同步接口的客户端超时限制。
+    
+    Args:
+        files: 上传的图片文件或压缩包
+        
+    Returns:
+        JobResponse: 新创建的任务
+    """
+    try:
+        job = await job_queue.submit(_iter_batch_uploads(files))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"提交任务失败: {str(e)}")
+    
+    return _job_response(job)
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+async def get_job_status(
+    job_id: str,
+    include_items: bool = Query(True, description="是否返回每张图片的结果"),
+    session: Session = Depends(get_session)
+):
+    """
+    查询异步检测任务的进度和结果
+    
+    Args:
+        job_id: 任务ID
+        include_items: 是否返回每张图片的结果
+        session: 数据库会话
+        
+    Returns:
+        JobResponse: 任务状态
+    """
+    job = await run_db(get_job, session, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    items = None
+    if include_items:
+        items = parse_job_results(await run_db(get_job_results, session, job_id))
+    return _job_response(job, items)
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    以Server-Sent Events推送异步任务的进度
+    
+    先推送已完成图片的结果，之后每张图片完成时推送一个 item 事件，
+    任务结束时推送 end 事件。由其他进程处理的任务按 JOB_EVENTS_SYNC_INTERVAL 从数据库同步。
+    
+    Args:
+        job_id: 任务ID
+        
+    Returns:
+        StreamingResponse: text/event-stream 响应
+    """
+    job, _ = await run_db(load_job_snapshot, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    async def events():
+        # 先订阅再读取数据库，两者之间完成的图片按序号去重
+        subscription = job_queue.subscribe(job_id)
+        sent = set()
+        try:
+            while True:
+                job, rows = await run_db(load_job_snapshot, job_id)
+                subscription.lagged = False
+                for item in parse_job_results(rows):
+                    if item["status"] != "pending" and item["position"] not in sent:
+                        sent.add(item["position"])
+                        yield _sse("item", item)
+                if job is None or job.status in ("completed", "failed"):
+                    yield _sse("end", _job_response(job).dict() if job else {"status": "deleted"})
+                    return
+                
+                while True:
+                    event = await subscription.get(JOB_EVENTS_SYNC_INTERVAL)
+                    if event is None:
+                        yield ": keep-alive\n\n"
+                        break
+                    if event["type"] != "item" or subscription.lagged:
+                        break
+                    if event["item"]["position"] not in sent:
+                        sent.add(event["item"]["position"])
+                        yield _sse("item", event["item"])
+        finally:
+            job_queue.unsubscribe(subscription)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def _job_response(job, items: Optional[List[dict]] = None) -> JobResponse:
+    """把任务记录转换为响应模型"""
+    return JobResponse(
+        job_id=job.id,
+        status=job.status,
+        total=job.total,
+        processed=job.processed,
+        succeeded=job.succeeded,
+        failed=job.failed,
+        progress=round(job.processed / job.total, 4) if job.total else 0.0,
+        attempts=job.attempts,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        items=items
+    )
+
+
 @app.get("/api/history", response_model=List[PredictionRead])
 async def get_prediction_history(
-    skip: int = Query(0, ge=0, description="跳过的记录数"),
+    response: Response,
+    skip: int = Query(0, ge=0, description="跳过的记录数（偏移分页，建议改用cursor）"),
     limit: int = Query(100, ge=1, le=1000, description="返回的记录数"),
     label_filter: Optional[str] = Query(None, description="按类别筛选"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
     session: Session = Depends(get_session)
 ):
     """
     获取检测历史记录
     
+    按检测时间倒序的游标分页：还有下一页时响应头 X-Next-Cursor 返回游标，
+    把它作为 cursor 参数即可获取下一页，任意深度的分页代价相同。
+    
     Args:
-        skip: 跳过的记录数
+        skip: 跳过的记录数，仅在不传 cursor 时使用
         limit: 返回的记录数
         label_filter: 按类别筛选
+        cursor: 分页游标
         session: 数据库会话
         
     Returns:
         List[PredictionRead]: 检测记录列表
     """
     try:
-        predictions = get_predictions(session, skip=skip, limit=limit, label_filter=label_filter)
-        return [
-            PredictionRead(
-                id=p.id,
-                filename=p.filename,
-                label=p.label,
-                confidence=p.confidence,
-                timestamp=p.timestamp
-            ) for p in predictions
-        ]
+        if skip and not cursor:
+            # 兼容旧的偏移分页
+            predictions = await run_db(
+                get_predictions, session, skip=skip, limit=limit, label_filter=label_filter
+            )
+        else:
+            predictions, next_cursor = await run_db(
+                get_predictions_page, session, limit=limit, label_filter=label_filter, cursor=cursor
+            )
+            if next_cursor:
+                response.headers["X-Next-Cursor"] = next_cursor
+        return predictions
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取历史记录失败: {str(e)}")
 
@@ -192,15 +791,50 @@ async def get_statistics(session: Session = Depends(get_session)):
         PredictionStats: 统计数据
     """
     try:
-        stats = get_prediction_stats(session)
+        stats = await run_db(get_prediction_stats, session)
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取统计数据失败: {str(e)}")
 
 
+@app.get("/api/stats/timeseries", response_model=PredictionTimeseries)
+async def get_statistics_timeseries(
+    bucket: str = Query("hour", pattern="^(minute|hour|day|week)$", description="时间段粒度 minute/hour/day/week"),
+    start: Optional[datetime] = Query(None, description="开始时间，默认按粒度取最近一段时间"),
+    end: Optional[datetime] = Query(None, description="结束时间（不含），默认为当前时间"),
+    label: Optional[str] = Query(None, description="按类别筛选"),
+    session: Session = Depends(get_session)
+):
+    """
+    获取按时间段聚合的检测趋势
+    
+    每个时间段返回检测数量和平均/最低/最高置信度，聚合在数据库中完成。
+    
+    Args:
+        bucket: 时间段粒度
+        start: 开始时间
+        end: 结束时间
+        label: 按类别筛选
+        session: 数据库会话
+        
+    Returns:
+        PredictionTimeseries: 趋势数据
+    """
+    try:
+        return await run_db(
+            get_prediction_timeseries, session, bucket=bucket, start=start, end=end, label=label
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取趋势数据失败: {str(e)}")
+
+
 @app.get("/api/recent", response_model=List[PredictionRead])
 async def get_recent_detections(
+    response: Response,
     limit: int = Query(10, ge=1, le=50, description="返回的记录数"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
     session: Session = Depends(get_session)
 ):
     """
@@ -208,36 +842,58 @@ async def get_recent_detections(
     
     Args:
         limit: 返回的记录数
+        cursor: 分页游标，用法与 /api/history 相同
         session: 数据库会话
         
     Returns:
         List[PredictionRead]: 最近的检测记录
     """
     try:
-        predictions = get_recent_predictions(session, limit=limit)
-        return [
-            PredictionRead(
-                id=p.id,
-                filename=p.filename,
-                label=p.label,
-                confidence=p.confidence,
-                timestamp=p.timestamp
-            ) for p in predictions
-        ]
+        predictions, next_cursor = await run_db(
+            get_predictions_page, session, limit=limit, cursor=cursor
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return predictions
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取最近记录失败: {str(e)}")
 
 
-@app.get("/health")
-async def health_check():
-    """健康检查端点"""
+@app.get("/api/metrics")
+async def get_metrics():
+    """获取推理服务运行指标"""
+    # 缓存指标需要获取缓存锁，写入磁盘层时可能短暂等待，不在事件循环中执行
+    cache_metrics = await run_preprocess(result_cache.metrics) if result_cache is not None else {"enabled": False}
     return {
-        "status": "healthy",
-        "service": "ocean-trash-detection",
-        "timestamp": time.time()
+        "batching": inference_scheduler.metrics(),
+        "executors": executor_metrics(),
+        "upload_buffers": upload_buffers.metrics(),
+        "preprocess_tensors": tensor_pool.metrics(),
+        "result_cache": cache_metrics,
+        "singleflight": inference_flight.metrics(),
+        "jobs": job_queue.metrics(),
+        "write_behind": prediction_writer.metrics() if prediction_writer is not None else {"enabled": False}
     }
 
 
+@app.get("/health")
+async def health_check():
+    """健康检查端点，模型预热完成后才报告ready"""
+    model_status = model_registry.status()
+    ready = model_status["ready"]
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "starting",
+            "service": "ocean-trash-detection",
+            "model": model_status,
+            "timestamp": time.time()
+        }
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,6 +1,7 @@
 """
 API响应模型定义
 """
+from datetime import datetime
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 
@@ -17,6 +18,56 @@ class PredictionResponse(BaseModel):
     detections: List[Detection]
     message: str = ""
     processing_time: float
+    cached: bool = False  # 是否命中结果缓存
+
+
+class BatchItemResult(BaseModel):
+    """批量检测中单张图片的结果"""
+    filename: str
+    success: bool
+    detections: List[Detection] = []
+    cached: bool = False
+    error: Optional[str] = None
+
+
+class BatchPredictionResponse(BaseModel):
+    """批量预测响应模型"""
+    success: bool
+    total: int
+    succeeded: int
+    failed: int
+    total_detections: int
+    categories_count: Dict[str, int]
+    items: List[BatchItemResult]
+    message: str = ""
+    processing_time: float
+
+
+class JobItemResult(BaseModel):
+    """异步任务中单张图片的结果"""
+    position: int
+    filename: str
+    status: str
+    success: bool
+    detections: List[Detection] = []
+    error: Optional[str] = None
+
+
+class JobResponse(BaseModel):
+    """异步任务状态响应模型"""
+    job_id: str
+    status: str
+    total: int
+    processed: int
+    succeeded: int
+    failed: int
+    progress: float
+    attempts: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    items: Optional[List[JobItemResult]] = None
 
 
 class ErrorResponse(BaseModel):
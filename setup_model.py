@@ -1,7 +1,13 @@
 """
 设置YOLOv8模型脚本
+
+用法:
+    python setup_model.py                 # 下载模型并生成类别映射
+    python setup_model.py quantize --calibration-dir DIR --holdout-dir DIR
 """
+import argparse
 import os
+import sys
 from ultralytics import YOLO
 
 def download_yolo_model():
@@ -82,7 +88,48 @@ def map_yolo_to_trash(yolo_class_name):
     
     print("✅ 类别映射文件已创建: ai/class_mapping.py")
 
-if __name__ == "__main__":
+def quantize_int8_model(args) -> bool:
+    """
+    生成INT8量化模型，精度下降超过阈值时拒绝激活
+    """
+    from ai.quantization import build_int8_model
+
+    print("🧮 开始INT8静态量化...")
+
+    if not os.path.exists(args.weights):
+        print(f"❌ 模型文件未找到: {args.weights}")
+        return False
+
+    try:
+        report = build_int8_model(
+            args.weights,
+            args.calibration_dir,
+            args.holdout_dir,
+            max_accuracy_drop=args.max_accuracy_drop,
+            input_size=args.input_size,
+            calibration_images=args.calibration_images,
+            method=args.method
+        )
+    except Exception as e:
+        print(f"❌ INT8量化失败: {e}")
+        return False
+
+    metrics = report["metrics"]
+    print(f"📊 保留集图片数: {metrics['images']}")
+    print(f"📊 mAP@0.5（以FP32为参照）: {metrics['map50']:.4f}，F1: {metrics['f1']:.4f}")
+    print(f"📊 精度下降: {report['accuracy_drop']:.4f}（阈值 {report['max_accuracy_drop']:.4f}）")
+
+    if report["activated"]:
+        print(f"✅ INT8模型已激活: {report['model_path']}")
+        print("💡 设置 INFERENCE_BACKEND=onnx-int8 即可使用INT8模型推理")
+        return True
+
+    print(f"❌ 精度下降超过阈值，INT8模型未激活: {report['model_path']}")
+    return False
+
+
+def setup_model() -> bool:
+    """下载模型并生成类别映射"""
     print("🌊 海洋垃圾检测模型设置")
     print("="*50)
     
@@ -95,4 +142,45 @@ if __name__ == "__main__":
         print("⚠️ 注意：这是通用模型，检测效果可能不如专门训练的海洋垃圾模型")
     else:
         print("\n❌ 模型设置失败")
-        print("💡 系统将继续使用模拟模式")
\ No newline at end of file
+        print("💡 系统将继续使用模拟模式")
+    return success
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    from ai.inference import MODEL_INPUT_SIZE, MODEL_PATH
+    from ai.quantization import QUANT_CALIBRATION_IMAGES, QUANT_MAX_ACCURACY_DROP
+
+    parser = argparse.ArgumentParser(description="海洋垃圾检测模型设置")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("setup", help="下载模型并生成类别映射（默认）")
+
+    quantize = subparsers.add_parser("quantize", help="生成并校验INT8量化模型")
+    quantize.add_argument("--calibration-dir", required=True, help="校准图片目录")
+    quantize.add_argument("--holdout-dir", required=True, help="精度校验用的保留集图片目录")
+    quantize.add_argument("--weights", default=MODEL_PATH, help="模型权重文件路径")
+    quantize.add_argument("--input-size", type=int, default=MODEL_INPUT_SIZE, help="模型输入边长")
+    quantize.add_argument(
+        "--max-accuracy-drop", type=float, default=QUANT_MAX_ACCURACY_DROP,
+        help="允许的最大mAP@0.5下降，超过则不激活INT8模型"
+    )
+    quantize.add_argument(
+        "--calibration-images", type=int, default=QUANT_CALIBRATION_IMAGES,
+        help="最多使用的校准图片数"
+    )
+    quantize.add_argument(
+        "--method", choices=["minmax", "entropy", "percentile"], default="minmax",
+        help="校准方法"
+    )
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == "quantize":
+        sys.exit(0 if quantize_int8_model(args) else 1)
+
+    setup_model()
@@ -0,0 +1,449 @@
+"""
+数据库CRUD测试
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event
+from sqlmodel import SQLModel, Session, create_engine, func, select
+
+from db.crud import (
+    create_inference_requests, create_prediction, delete_prediction, get_predictions_page, get_request_detections
+)
+from db.models import (
+    DetectionCreate, DetectionRecord, InferenceRequest, InferenceRequestCreate, PredictionCreate, PredictionRollup
+)
+from db.rollups import get_prediction_timeseries, get_rollup_stats, rebuild_rollups
+import db.migrations
+from db.classes import class_code
+from db.migrations import ensure_indexes, migrate_legacy_predictions, migrate_rollup_table
+from db.session import create_tuned_engine, engine_options
+from db.writer import WriteBehindQueue, _read_spill
+from executors import run_db, run_preprocess, shutdown_executors
+
+
+def _test_engine():
+    """每个测试使用独立的临时数据库"""
+    path = os.path.join(tempfile.mkdtemp(), "db.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+def _request(filename, label, confidence, timestamp=None):
+    """只有一个检测结果的检测请求"""
+    return InferenceRequestCreate(
+        filename=filename, timestamp=timestamp,
+        detections=[DetectionCreate(label=label, confidence=confidence)]
+    )
+
+
+def _count(engine, model=DetectionRecord):
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(model)).one()
+
+
+def test_create_inference_requests():
+    """测试批量保存检测请求：请求取回ID后，检测结果一次executemany写入"""
+    print("💾 测试批量保存检测请求...")
+
+    engine = _test_engine()
+    statements = []
+    event.listen(
+        engine, "before_cursor_execute",
+        lambda conn, cursor, statement, params, context, executemany: statements.append((statement, executemany))
+    )
+
+    requests = [
+        InferenceRequestCreate(
+            filename=f"img{i}.jpg", content_hash=f"{i:064x}", width=4000, height=3000,
+            model_version="onnx:abc", latency_ms=12.5,
+            detections=[DetectionCreate(label="塑料瓶", confidence=0.5 + j / 100) for j in range(3)]
+        ) for i in range(10)
+    ] + [InferenceRequestCreate(filename="empty.jpg")]
+    with Session(engine) as session:
+        assert create_inference_requests(session, requests) == 30
+        assert create_inference_requests(session, []) == 0
+
+    requests_inserts = [sql for sql, _ in statements if sql.startswith("INSERT INTO inference_request ")]
+    detection_inserts = [(sql, many) for sql, many in statements if sql.startswith("INSERT INTO detection ")]
+    assert 1 <= len(requests_inserts) <= len(requests), f"请求应在一次executemany中插入: {requests_inserts}"
+    assert len(detection_inserts) == 1 and detection_inserts[0][1], f"检测结果应只执行一次executemany: {detection_inserts}"
+    assert not any(
+        sql.startswith("SELECT") and "detection_class" not in sql for sql, _ in statements
+    ), "除类别代码外不应回读"
+    assert statements.index(detection_inserts[0]) > max(
+        i for i, (sql, _) in enumerate(statements) if sql in requests_inserts
+    ), "检测结果应在全部请求取回ID之后写入"
+    print("  ✅ 10张图片的30个检测结果批量写入，没有回读")
+
+    with Session(engine) as session:
+        assert _count(engine, InferenceRequest) == 11 and _count(engine) == 30
+        first = session.exec(select(InferenceRequest).where(InferenceRequest.filename == "img0.jpg")).one()
+        assert (first.width, first.height, first.model_version, first.latency_ms) == (4000, 3000, "onnx:abc", 12.5)
+        detections = get_request_detections(session, first.id)
+        assert [d.confidence for d in detections] == [0.52, 0.51, 0.5] and detections[0].class_code == 1
+        assert all(d.timestamp == first.timestamp for d in detections)
+    print("  ✅ 同一张图片的检测结果关联到同一个请求，类别保存为小整数代码")
+
+
+def test_write_behind_queue():
+    """测试后写队列的批量写入、溢出文件和关闭时刷新"""
+    print("📮 测试检测记录后写队列...")
+
+    engine = _test_engine()
+    state = {"down": False, "batches": []}
+
+    def writer(requests):
+        if state["down"]:
+            raise RuntimeError("数据库不可用")
+        state["batches"].append(len(requests))
+        with Session(engine) as session:
+            return create_inference_requests(session, requests)
+
+    def count():
+        return _count(engine)
+
+    spill_path = os.path.join(tempfile.mkdtemp(), "spill.jsonl")
+    detected_at = datetime.now() - timedelta(hours=1)
+
+    async def scenario():
+        queue = WriteBehindQueue(
+            maxsize=8, batch_size=3, flush_interval=0.05, spill_path=spill_path, writer=writer,
+            db_runner=run_db, file_runner=run_preprocess
+        )
+        queue.start()
+        records = [_request(f"{i}.jpg", "塑料瓶", 0.9) for i in range(6)]
+        await queue.submit(records)
+        await asyncio.sleep(0.3)
+        assert count() == 6 and state["batches"] == [3, 3], f"应按批大小写入: {state['batches']}"
+        print("  ✅ 记录按批大小批量写入")
+
+        # 数据库不可用时写不进的批次和放不进队列的记录都转入溢出文件
+        state["down"] = True
+        await queue.submit([_request("late.jpg", "塑料袋", 0.8, detected_at)] * 10)
+        await asyncio.sleep(0.3)
+        metrics = queue.metrics()
+        assert count() == 6 and metrics["spilled_total"] == 10 and metrics["spill_pending"], metrics
+        print("  ✅ 数据库不可用时记录转入溢出文件")
+
+        state["down"] = False
+        await queue.submit([_request("6.jpg", "塑料瓶", 0.9)])
+        await queue.stop()
+        metrics = queue.metrics()
+        assert count() == 17 and metrics["depth"] == 0 and not metrics["spill_pending"], metrics
+        print("  ✅ 数据库恢复后补写溢出记录，关闭时写完队列")
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        shutdown_executors()
+
+    with Session(engine) as session:
+        late = session.exec(
+            select(DetectionRecord).join(InferenceRequest).where(InferenceRequest.filename == "late.jpg")
+        ).all()
+        assert len(late) == 10 and all(p.timestamp == detected_at for p in late), "补写应保留检测时间"
+    print("  ✅ 补写的记录保留原始检测时间")
+
+    # 旧版本的溢出文件每行一个检测结果
+    legacy_path = os.path.join(tempfile.mkdtemp(), "legacy.jsonl")
+    with open(legacy_path, "w", encoding="utf-8") as f:
+        f.write('{"filename": "old.jpg", "label": "纸张", "confidence": 0.7, "timestamp": "2024-01-15T10:30:00"}\n')
+    [legacy] = _read_spill(legacy_path)
+    assert legacy.filename == "old.jpg" and legacy.detections[0].label == "纸张"
+    assert legacy.timestamp == datetime(2024, 1, 15, 10, 30)
+    print("  ✅ 旧格式的溢出文件仍能补写")
+
+
+def test_sqlite_tuning():
+    """测试SQLite调优PRAGMA和WAL模式下读写互不阻塞"""
+    print("⚙️ 测试SQLite调优配置...")
+
+    path = os.path.join(tempfile.mkdtemp(), "tuned.db")
+    engine = create_tuned_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    with engine.connect() as conn:
+        pragmas = {
+            name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+            for name in ("journal_mode", "synchronous", "busy_timeout", "temp_store")
+        }
+    assert pragmas == {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000, "temp_store": 2}, pragmas
+    print("  ✅ 连接时应用WAL、synchronous=NORMAL等PRAGMA")
+
+    # 写事务未提交时，其他连接仍能立即读取
+    with Session(engine) as writer, Session(engine) as reader:
+        create_inference_requests(writer, [_request("a.jpg", "塑料瓶", 0.9)])
+        writer.add(InferenceRequest(filename="b.jpg"))
+        writer.flush()
+        assert reader.exec(select(func.count(InferenceRequest.id))).one() == 1
+        writer.commit()
+    print("  ✅ 写事务进行中读取不被阻塞")
+
+    options = engine_options("postgresql://user@localhost/db")
+    assert options["pool_pre_ping"] and "statement_timeout" in options["connect_args"]["options"]
+    print("  ✅ PostgreSQL连接池和语句超时参数")
+
+
+def test_prediction_indexes():
+    """测试检测记录索引和旧数据库的索引补建"""
+    print("🗂️ 测试检测记录索引...")
+
+    engine = _test_engine()
+    with engine.connect() as conn:
+        plan = " ".join(str(row[-1]) for row in conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT * FROM detection WHERE class_code = 1 ORDER BY timestamp DESC LIMIT 20"
+        ))
+    assert "ix_detection_class_timestamp" in plan and "TEMP B-TREE" not in plan, plan
+    print("  ✅ 按类别筛选并按时间排序走复合索引，无需额外排序")
+
+    # 模拟索引加入模型之前创建的数据库
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_detection_class_timestamp")
+        conn.exec_driver_sql("DROP INDEX ix_detection_timestamp")
+    created = ensure_indexes(engine)
+    assert sorted(created) == ["ix_detection_class_timestamp", "ix_detection_timestamp"], created
+    assert ensure_indexes(engine) == [], "已存在的索引不应重复创建"
+    print("  ✅ 启动时为已有的表补建缺失的索引")
+
+
+def test_keyset_pagination():
+    """测试游标分页的顺序、筛选和翻页期间插入新记录"""
+    print("📄 测试游标分页...")
+
+    engine = _test_engine()
+    base = datetime(2024, 1, 15, 10, 0, 0)
+    with Session(engine) as session:
+        # 部分记录检测时间相同，由ID决定顺序
+        create_inference_requests(session, [
+            _request(f"{i}.jpg", "塑料瓶" if i % 2 else "纸张", 0.5, base + timedelta(seconds=i // 3))
+            for i in range(25)
+        ])
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            page, cursor = get_predictions_page(session, limit=10, cursor=cursor)
+            seen.extend((p.timestamp, p.id) for p in page)
+            pages += 1
+            if pages == 1:
+                # 翻页期间插入的新记录排在最前面，不影响后面的页
+                create_inference_requests(session, [_request("new.jpg", "纸张", 0.9)])
+            if cursor is None:
+                break
+        assert pages == 3 and len(seen) == 25 and len(set(seen)) == 25, f"分页重复或遗漏: {pages}, {len(seen)}"
+        assert seen == sorted(seen, reverse=True), "应按 (检测时间, ID) 倒序"
+        print("  ✅ 翻页顺序稳定，新插入的记录不造成重复或遗漏")
+
+        page, cursor = get_predictions_page(session, limit=20, label_filter="塑料瓶")
+        assert len(page) == 12 and cursor is None and all(p.label == "塑料瓶" for p in page)
+        print("  ✅ 类别筛选与游标分页可以组合")
+
+        # 深页从游标位置在索引中定位，不随前面的记录数增加而变慢
+        statements = []
+        event.listen(
+            engine, "before_cursor_execute",
+            lambda conn, cursor, statement, params, context, executemany: statements.append((statement, params))
+        )
+        _, deep_cursor = get_predictions_page(session, limit=20)
+        get_predictions_page(session, limit=10, cursor=deep_cursor)
+        statement, params = statements[-1]
+        plan = " ".join(str(row[-1]) for row in session.connection().exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + statement, params
+        ))
+        assert "SEARCH detection USING INDEX ix_detection_timestamp (timestamp<?)" in plan, plan
+        print("  ✅ 游标条件在时间索引中定位，深页无需扫描前面的记录")
+
+        try:
+            get_predictions_page(session, cursor="not-a-cursor")
+            raise AssertionError("无效游标应报错")
+        except ValueError:
+            print("  ✅ 无效游标被拒绝")
+
+
+def test_prediction_rollups():
+    """测试统计汇总表的增量更新、删除和重建"""
+    print("📈 测试统计汇总表...")
+
+    engine = _test_engine()
+    now = datetime(2024, 1, 15, 10, 30, 0)
+    records = [
+        ("塑料瓶", 0.5, 0), ("塑料瓶", 0.7, 0.2), ("纸张", 0.9, 30), ("塑料瓶", 0.2, 23.9), ("塑料瓶", 0.3, 24.1)
+    ]
+    with Session(engine) as session:
+        # 分两批写入，同一小时的汇总行被累加
+        for batch in (records[:2], records[2:]):
+            create_inference_requests(session, [
+                _request("a.jpg", label, confidence, now - timedelta(hours=hours))
+                for label, confidence, hours in batch
+            ])
+        extra = create_prediction(session, PredictionCreate(filename="b.jpg", label="纸张", confidence=0.1))
+
+        stats = get_rollup_stats(session, now=now)
+        assert stats.total_predictions == 6 and stats.categories_count == {"塑料瓶": 4, "纸张": 2}, stats
+        assert stats.avg_confidence == 0.45, stats
+        # 23.9小时前的记录落在不足一小时的开头部分，24.1小时前的不计入
+        assert stats.recent_predictions == 4, stats
+        current = session.get(PredictionRollup, (class_code(session, "塑料瓶"), datetime(2024, 1, 15, 10, 0)))
+        assert (current.count, current.confidence_min, current.confidence_max) == (2, 0.5, 0.7), current
+        print("  ✅ 写入检测记录时同一事务更新汇总表，统计结果与原始记录一致")
+
+        delete_prediction(session, extra.id)
+        stats = get_rollup_stats(session, now=now)
+        assert stats.total_predictions == 5 and stats.categories_count == {"塑料瓶": 4, "纸张": 1}, stats
+        print("  ✅ 删除记录后重算受影响的小时")
+
+        def snapshot():
+            return sorted(
+                (r.class_code, r.bucket, r.count, round(r.confidence_sum, 6), r.confidence_min, r.confidence_max)
+                for r in session.exec(select(PredictionRollup)).all()
+            )
+
+        incremental = snapshot()
+        assert rebuild_rollups(session) == 3
+        assert snapshot() == incremental, "重建结果应与增量更新一致"
+        print("  ✅ 从检测记录重建的汇总表与增量结果一致")
+
+    # 以类别名称为主键的旧汇总表删除后按类别代码重新建表
+    assert not migrate_rollup_table(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE prediction_rollup")
+        conn.exec_driver_sql(
+            "CREATE TABLE prediction_rollup (label VARCHAR(100), bucket DATETIME, count INTEGER, "
+            "confidence_sum FLOAT, confidence_min FLOAT, confidence_max FLOAT, PRIMARY KEY (label, bucket))"
+        )
+    assert migrate_rollup_table(engine)
+    with Session(engine) as session:
+        rebuild_rollups(session)
+        assert snapshot() == incremental
+    print("  ✅ 旧的按类别名称汇总表迁移为按类别代码汇总")
+
+
+def test_prediction_timeseries():
+    """测试按时间段聚合的检测趋势"""
+    print("📉 测试检测趋势...")
+
+    engine = _test_engine()
+    # 2024-01-15 是周一
+    base = datetime(2024, 1, 15, 0, 0, 0)
+    offsets = [timedelta(minutes=m) for m in (0, 0.5, 1, 61)] + [timedelta(days=d) for d in (1, 6, 7, 14)]
+    with Session(engine) as session:
+        create_inference_requests(session, [
+            _request(f"{i}.jpg", "塑料瓶" if i % 2 else "纸张", 0.1 * (i + 1), base + offset)
+            for i, offset in enumerate(offsets)
+        ])
+        end = base + timedelta(days=21)
+
+        series = get_prediction_timeseries(session, "hour", start=base, end=end)
+        assert [(p.bucket, p.count) for p in series.points][:2] == [(base, 3), (base + timedelta(hours=1), 1)]
+        first = series.points[0]
+        assert (first.avg_confidence, first.min_confidence, first.max_confidence) == (0.2, 0.1, 0.3), first
+        print("  ✅ 按小时聚合检测数量和置信度")
+
+        series = get_prediction_timeseries(session, "week", start=base, end=end)
+        assert [(p.bucket, p.count) for p in series.points] == [
+            (base, 6), (base + timedelta(weeks=1), 1), (base + timedelta(weeks=2), 1)
+        ], series.points
+        series = get_prediction_timeseries(session, "day", start=base, end=end, label="塑料瓶")
+        assert sum(p.count for p in series.points) == 4 and series.label == "塑料瓶"
+        print("  ✅ 按天和周（从周一开始）聚合，支持按类别筛选")
+
+        series = get_prediction_timeseries(session, "minute", start=base, end=base + timedelta(hours=2))
+        assert [p.count for p in series.points] == [2, 1, 1], series.points
+        print("  ✅ 分钟粒度直接聚合检测记录")
+
+        # 带时区的参数（例如 ...Z）转换为与检测记录相同的本地时间
+        naive = get_prediction_timeseries(session, "hour", start=base, end=end)
+        for tz in (None, timezone.utc, timezone(timedelta(hours=-5))):
+            aware = get_prediction_timeseries(session, "hour", start=base.astimezone(tz), end=end.astimezone(tz))
+            assert aware.points == naive.points and aware.start == base and aware.start.tzinfo is None, tz
+        print("  ✅ 带时区的起止时间按本地时间比较")
+
+        for kwargs in ({"bucket": "year"}, {"start": end, "end": base}, {"bucket": "minute", "start": base, "end": end}):
+            try:
+                get_prediction_timeseries(session, **kwargs)
+                raise AssertionError(f"应拒绝: {kwargs}")
+            except ValueError:
+                pass
+        print("  ✅ 拒绝无效粒度、空时间范围和过多的时间段")
+
+
+def test_legacy_migration():
+    """测试旧的 prediction 表迁移到检测请求和检测结果两张表"""
+    print("🗄️ 测试旧检测记录表迁移...")
+
+    engine = _test_engine()
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE prediction (id INTEGER PRIMARY KEY, filename VARCHAR(255), label VARCHAR(100), "
+            "confidence FLOAT, timestamp DATETIME)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO prediction VALUES "
+            "(3, 'a.jpg', '塑料瓶', 0.9, '2024-01-15 10:30:00.001000'), "
+            "(4, 'a.jpg', '纸张', 0.6, '2024-01-15 10:30:00.004000'), "
+            "(7, 'b.jpg', '塑料袋', 0.8, '2024-01-15 10:30:00.006000'), "
+            "(9, 'a.jpg', '自定义', 0.5, '2024-01-15 10:30:00.009000'), "
+            "(12, 'c.jpg', '纸张', 0.7, '2024-01-15 10:30:00.010000'), "
+            "(13, 'c.jpg', '纸张', 0.4, '2024-01-15 10:30:05.000000')"
+        )
+
+    # 旧版本逐条写入，同一次上传的记录检测时间各不相同；分批读取时请求也不能被拆开
+    original_chunk, db.migrations.LEGACY_MIGRATION_CHUNK = db.migrations.LEGACY_MIGRATION_CHUNK, 1
+    try:
+        assert migrate_legacy_predictions(engine) == 6
+    finally:
+        db.migrations.LEGACY_MIGRATION_CHUNK = original_chunk
+    assert migrate_legacy_predictions(engine) == 0, "旧表迁移后不应重复迁移"
+    with engine.connect() as conn:
+        tables = {row[0] for row in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "prediction" not in tables and "prediction_legacy" in tables
+    print("  ✅ 迁移一次后旧表改名为 prediction_legacy")
+
+    assert _count(engine, InferenceRequest) == 5 and _count(engine) == 6
+    with Session(engine) as session:
+        page, _ = get_predictions_page(session, limit=10)
+        assert [(p.id, p.filename, p.label) for p in page] == [
+            (13, "c.jpg", "纸张"), (12, "c.jpg", "纸张"), (9, "a.jpg", "自定义"), (7, "b.jpg", "塑料袋"), (4, "a.jpg", "纸张"), (3, "a.jpg", "塑料瓶")
+        ], page
+        request_id = session.exec(select(DetectionRecord.request_id).where(DetectionRecord.id == 3)).one()
+        assert [d.id for d in get_request_detections(session, request_id)] == [3, 4]
+        request_id = session.exec(select(DetectionRecord.request_id).where(DetectionRecord.id == 12)).one()
+        assert [d.id for d in get_request_detections(session, request_id)] == [12], "相隔超过时间窗口的记录属于不同请求"
+        assert create_inference_requests(session, [_request("c.jpg", "塑料瓶", 0.7)]) == 1
+        assert session.exec(select(func.max(DetectionRecord.id))).one() == 14
+    print("  ✅ 同一请求的记录合并，记录ID、文件名和类别保持不变")
+
+
+def main():
+    """运行所有测试"""
+    print("🧪 开始数据库CRUD测试...\n")
+
+    tests = [
+        ("批量保存检测请求", test_create_inference_requests),
+        ("检测记录后写队列", test_write_behind_queue),
+        ("SQLite调优配置", test_sqlite_tuning),
+        ("检测记录索引", test_prediction_indexes),
+        ("游标分页", test_keyset_pagination),
+        ("统计汇总表", test_prediction_rollups),
+        ("检测趋势", test_prediction_timeseries),
+        ("旧检测记录表迁移", test_legacy_migration),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            print(f"✅ {test_name} 测试通过\n")
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test_name} 测试失败: {e}\n")
+
+    print(f"📊 {passed}/{len(tests)} 个测试通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
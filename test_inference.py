@@ -0,0 +1,633 @@
+"""
+AI推理模块测试脚本
+"""
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from ai.inference import (
+    InferenceBackend, ModelRegistry, MODEL_PATH, CONFIDENCE_THRESHOLD, DECODE_TARGET_SIZE, classify_image, decode_image,
+    load_image, validate_image, build_class_lookup, map_yolo_to_trash, _postprocess_boxes
+)
+from ai.image_io import ImageTooLargeError, probe_image
+from ai.batching import BatchScheduler, SchedulerOverloadedError
+from ai.cache import ResultCache
+from ai.singleflight import SingleFlight
+import ai.tiling
+from ai.tiling import _map_shared, classify_tiled, merge_detections, slice_image, tile_origins
+from ai.onnx_backend import non_max_suppression
+from ai.preprocess import TensorPool, letterbox, preprocess_images, preprocess_into
+from ai.quantization import detection_agreement
+from executors import get_executor, run_inference, run_db, run_tiled, shutdown_executors
+
+
+def test_model_registry():
+    """测试模型注册表的加载、复用和预热状态"""
+    print("🧠 测试模型注册表...")
+
+    registry = ModelRegistry()
+    assert not registry.is_ready(), "预热前不应报告ready"
+    assert registry.status()["state"] == "unloaded"
+
+    assert registry.warmup(runs=1), "模型预热失败"
+    assert registry.is_ready(), "预热后应报告ready"
+    print(f"  ✅ 预热完成，状态: {registry.status()['state']}")
+
+    if os.path.exists(MODEL_PATH):
+        # 同一进程内多次获取应复用同一个模型实例
+        assert registry.get() is registry.get(), "模型未被复用"
+        print("  ✅ 模型实例复用正常")
+    else:
+        print("  ⚠️ 跳过模型复用测试（需要weights.pt模型文件）")
+
+
+def test_model_reload():
+    """测试模型文件被替换后重新加载，版本取自实际加载的文件"""
+    print("🔄 测试模型文件替换...")
+
+    import ai.inference as inference
+
+    class FakeBackend(inference.InferenceBackend):
+        name = "fake"
+
+        def __init__(self, model_path):
+            super().__init__(model_path)
+            with open(model_path, "rb") as f:
+                self.weights = f.read()
+
+        @property
+        def names(self):
+            return {0: "bottle"}
+
+        def predict(self, images):
+            return [np.zeros((0, 6), dtype=np.float32) for _ in images]
+
+    original = inference.create_backend
+    inference.create_backend = lambda model_path, backend: FakeBackend(model_path)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "weights.pt")
+            with open(path, "wb") as f:
+                f.write(b"old weights")
+            registry = ModelRegistry(backend="fake", reload_interval=0.01)
+            swaps = []
+            registry.add_swap_listener(lambda old, new: swaps.append((old, new)))
+
+            expected = registry.version(path)
+            model = registry.get(path)
+            assert model.version == registry.version(path) == expected and expected.startswith("fake:")
+            print(f"  ✅ 未加载和已加载时版本一致: {expected}")
+
+            with open(path, "wb") as f:
+                f.write(b"new weights, retrained")
+            # 检查间隔内继续使用已加载的模型，版本也保持不变
+            assert registry.get(path) is model and registry.version(path) == expected
+            time.sleep(0.02)
+            reloaded = registry.get(path)
+            assert reloaded is not model and reloaded.weights == b"new weights, retrained"
+            assert registry.version(path) == reloaded.version != expected
+            assert swaps == [(expected, reloaded.version)], swaps
+            print("  ✅ 文件替换后推理前重新加载，版本随之变化并通知监听者")
+
+            os.remove(path)
+            time.sleep(0.02)
+            assert registry.get(path) is reloaded, "文件被删除时应继续使用已加载的模型"
+    finally:
+        inference.create_backend = original
+
+
+def test_in_memory_inference():
+    """测试直接从内存字节和数组进行验证与推理"""
+    print("🧮 测试内存推理路径...")
+
+    image = np.full((240, 320, 3), 200, dtype=np.uint8)
+    ok, encoded = cv2.imencode(".jpg", image)
+    assert ok, "测试图片编码失败"
+    data = encoded.tobytes()
+
+    for source in (data, memoryview(data), bytearray(data)):
+        decoded = decode_image(source)
+        assert decoded is not None and decoded.shape == (240, 320, 3), "内存解码失败"
+        assert validate_image(decoded)
+    print("  ✅ bytes/memoryview/bytearray 解码正常")
+
+    assert not validate_image(b"not an image"), "无效字节应验证失败"
+    assert not validate_image(decode_image(b"")), "空字节应验证失败"
+    print("  ✅ 无效数据被正确拒绝")
+
+    for source in (data, image):
+        results = classify_image(source)
+        assert isinstance(results, list)
+    print("  ✅ 字节和数组均可直接推理")
+
+
+def test_image_pixel_guard():
+    """测试解码前的文件头探测和像素数限制"""
+    print("💣 测试像素数限制...")
+
+    image = np.random.randint(0, 255, (400, 600, 3), dtype=np.uint8)
+    jpeg = cv2.imencode(".jpg", image)[1].tobytes()
+    png = cv2.imencode(".png", image)[1].tobytes()
+
+    info = probe_image(jpeg)
+    assert info == ("JPEG", 600, 400), f"文件头探测错误: {info}"
+    assert probe_image(b"not an image") is None
+    print("  ✅ 只读取文件头即可获得格式和尺寸")
+
+    # 超限的JPEG按最小满足上限的倍数缩小解码
+    decoded = decode_image(jpeg, max_pixels=600 * 400 // 4)
+    assert decoded.shape == (200, 300, 3), f"缩小解码尺寸错误: {decoded.shape}"
+    decoded = decode_image(jpeg, max_pixels=600 * 400 // 10)
+    assert decoded.shape == (100, 150, 3), f"缩小解码尺寸错误: {decoded.shape}"
+    print("  ✅ 超限JPEG在DCT域缩小解码")
+
+    for data, max_pixels in ((png, 600 * 400 - 1), (jpeg, 600 * 400 // 100)):
+        try:
+            decode_image(data, max_pixels=max_pixels)
+            raise AssertionError("超限图片应被拒绝")
+        except ImageTooLargeError:
+            pass
+    print("  ✅ 无法缩小解码的超限图片被拒绝")
+
+
+def test_reduced_decode():
+    """测试按模型输入尺寸缩小解码JPEG并应用EXIF方向"""
+    print("🔬 测试JPEG缩小解码...")
+
+    image = np.random.randint(0, 255, (1500, 3000, 3), dtype=np.uint8)
+    jpeg = cv2.imencode(".jpg", image)[1].tobytes()
+
+    # 长边3000，缩小4倍后为750仍不小于640，缩小8倍则不足
+    assert decode_image(jpeg, target_size=640).shape == (375, 750, 3)
+    assert decode_image(jpeg, target_size=2000).shape == (1500, 3000, 3)
+    assert decode_image(jpeg).shape == (1500, 3000, 3), "未指定输入尺寸时应完整解码"
+    png = cv2.imencode(".png", image[:300, :600])[1].tobytes()
+    assert decode_image(png, target_size=64).shape == (300, 600, 3), "PNG不支持缩小解码"
+    print("  ✅ 选择长边不小于模型输入尺寸的最大倍数")
+
+    # EXIF方向为6（顺时针旋转90度）时，解码结果为竖图
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    Image.fromarray(image[:, :, ::-1]).save(buffer, format="JPEG", exif=exif.tobytes())
+    assert decode_image(buffer.getvalue(), target_size=640).shape == (750, 375, 3)
+    print("  ✅ 缩小解码后按EXIF方向旋转")
+
+    # 文件路径与内存字节走同一条解码路径
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "large.jpg")
+        with open(path, "wb") as f:
+            f.write(jpeg)
+        expected = decode_image(jpeg, target_size=DECODE_TARGET_SIZE).shape
+        assert load_image(path).shape == load_image(jpeg).shape == expected
+    print(f"  ✅ 文件路径输入同样缩小解码为 {expected[1]}x{expected[0]}")
+
+
+def test_onnx_postprocessing():
+    """测试ONNX后端的letterbox和按类别NMS"""
+    print("📐 测试ONNX后处理...")
+
+    image = np.zeros((480, 960, 3), dtype=np.uint8)
+    padded, ratio, (pad_left, pad_top) = letterbox(image, 640)
+    assert padded.shape == (640, 640, 3)
+    assert abs(ratio - 640 / 960) < 1e-6 and pad_left == 0 and pad_top == 160
+    print("  ✅ letterbox尺寸和填充正确")
+
+    # 3个锚点、2个类别：前两个框同类且高度重叠，第三个框与第一个重叠但类别不同
+    predictions = np.array([
+        [100, 102, 100],   # cx
+        [100, 100, 100],   # cy
+        [50, 50, 50],      # w
+        [50, 50, 50],      # h
+        [0.9, 0.8, 0.1],   # 类别0分数
+        [0.0, 0.0, 0.7],   # 类别1分数
+    ], dtype=np.float32)
+    boxes = non_max_suppression(predictions)
+    assert boxes.shape == (2, 6), f"NMS结果异常: {boxes}"
+    assert sorted(boxes[:, 5].tolist()) == [0.0, 1.0], "不同类别的框不应互相抑制"
+    assert np.allclose(boxes[boxes[:, 5] == 0][0, :4], [75, 75, 125, 125])
+    print("  ✅ 按类别NMS结果正确")
+
+    filtered = non_max_suppression(predictions, classes=[1])
+    assert filtered[:, 5].tolist() == [1.0], "只应保留允许的类别"
+    print("  ✅ NMS只处理允许的类别")
+
+
+def test_preprocess_pool():
+    """测试原地letterbox与逐步预处理结果一致，且输入张量被复用"""
+    print("🧱 测试预处理张量池...")
+
+    images = [
+        np.random.randint(0, 255, shape, dtype=np.uint8)
+        for shape in ((480, 960, 3), (641, 333, 3), (640, 640, 3))
+    ]
+    pool = TensorPool(max_free=1)
+    for _ in range(2):
+        with pool.lease(len(images), 640) as batch:
+            metas = preprocess_into(images, batch)
+            for image, tensor, (ratio, pad) in zip(images, batch, metas):
+                padded, expected_ratio, expected_pad = letterbox(image, 640)
+                expected = padded[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0
+                assert np.allclose(tensor, expected, atol=1e-6), "原地预处理结果不一致"
+                assert ratio == expected_ratio and pad == expected_pad
+    assert pool.metrics()["allocated_total"] == 1 and pool.metrics()["reused_total"] == 1
+    assert preprocess_images(images, 640)[0].shape == (3, 3, 640, 640)
+    print("  ✅ 原地预处理正确，同尺寸张量被复用")
+
+    # 不同批大小共用同一个最大批大小的张量，借出的切片仍是连续内存
+    pool = TensorPool(max_free=1, max_batch=8)
+    for batch_size in (1, 3, 8, 5):
+        with pool.lease(batch_size, 320) as batch:
+            assert batch.shape == (batch_size, 3, 320, 320) and batch.flags["C_CONTIGUOUS"]
+    metrics = pool.metrics()
+    assert metrics["allocated_total"] == 1 and metrics["reused_total"] == 3, metrics
+    assert metrics["free"] == 1 and metrics["free_bytes"] == 8 * 3 * 320 * 320 * 4
+    with pool.lease(12, 320) as batch:
+        assert batch.shape[0] == 12
+    assert pool.metrics()["free_bytes"] == 12 * 3 * 320 * 320 * 4, "超出最大批大小的张量替换较小的空闲张量"
+    print("  ✅ 不同批大小共用每种输入尺寸的最大批张量")
+
+    # 默认的ultralytics后端同样使用池中的张量，检测框映射回原图坐标
+    from ultralytics import YOLO
+    from ai import inference
+    from ai.inference import UltralyticsBackend
+
+    backend = UltralyticsBackend.__new__(UltralyticsBackend)
+    InferenceBackend.__init__(backend, "untrained.pt")
+    backend.input_size, backend.model = 640, YOLO("yolov8n.yaml")
+    original_pool, inference.tensor_pool = inference.tensor_pool, TensorPool(max_free=1)
+    original_conf, inference.NMS_MIN_CONFIDENCE = inference.NMS_MIN_CONFIDENCE, 0.0001
+    try:
+        for _ in range(2):
+            outputs = backend.predict(images)
+        metrics = inference.tensor_pool.metrics()
+    finally:
+        inference.tensor_pool, inference.NMS_MIN_CONFIDENCE = original_pool, original_conf
+    assert metrics["allocated_total"] == 1 and metrics["reused_total"] == 1, metrics
+    for boxes, image in zip(outputs, images):
+        height, width = image.shape[:2]
+        assert boxes.shape[1] == 6 and (boxes[:, :4] >= 0).all()
+        assert (boxes[:, [0, 2]] <= width).all() and (boxes[:, [1, 3]] <= height).all()
+    print("  ✅ ultralytics后端复用预处理张量")
+
+
+def test_vectorized_postprocessing():
+    """测试向量化后处理与逐框处理的结果一致"""
+    print("🧮 测试向量化后处理...")
+
+    names = {0: "person", 1: "bicycle", 39: "bottle", 41: "cup", 73: "book", 79: "toothbrush"}
+    lookup = build_class_lookup(names)
+    assert lookup[0] is None and lookup[39] == "plastic_bottle"
+    assert lookup[-1] == map_yolo_to_trash("unknown"), "越界类别应映射为未知类别"
+
+    rng = np.random.default_rng(0)
+    boxes = np.zeros((500, 6), dtype=np.float32)
+    boxes[:, 4] = rng.uniform(0.0, 1.0, 500)
+    boxes[:, 5] = rng.choice([0, 1, 39, 41, 73, 79, 120], 500)
+    boxes[:, :2] = rng.uniform(0, 300, (500, 2))
+    boxes[:, 2:4] = boxes[:, :2] + rng.uniform(10, 300, (500, 2))
+    image_shape = (480, 640, 3)
+
+    expected = []
+    for box in boxes:
+        class_id, confidence = int(box[5]), float(box[4])
+        category = map_yolo_to_trash(names.get(class_id, "unknown"))
+        if confidence > CONFIDENCE_THRESHOLD and category is not None:
+            xyxyn = (min(box[0] / 640, 1.0), min(box[1] / 480, 1.0), min(box[2] / 640, 1.0), min(box[3] / 480, 1.0))
+            expected.append((category, confidence, xyxyn))
+    expected.sort(key=lambda x: x[1], reverse=True)
+
+    results = _postprocess_boxes(boxes, lookup, image_shape)
+    assert [r[:2] for r in results] == [e[:2] for e in expected]
+    assert np.allclose([r[2] for r in results], [e[2] for e in expected], atol=1e-5), "检测框应换算为比例坐标"
+    assert _postprocess_boxes(np.zeros((0, 6), dtype=np.float32), lookup, image_shape) == []
+    print(f"  ✅ {len(expected)} 个检测结果与逐框处理一致，检测框随结果返回")
+
+
+def test_quantization_guardrail_metrics():
+    """测试INT8精度校验使用的一致性指标"""
+    print("🎯 测试量化精度校验指标...")
+
+    reference = [np.array([
+        [10, 10, 50, 50, 0.9, 0],
+        [100, 100, 150, 150, 0.8, 1],
+    ], dtype=np.float32)]
+
+    same = detection_agreement(reference, [reference[0].copy()])
+    assert same["map50"] == 1.0 and same["f1"] == 1.0, f"完全一致时指标应为1: {same}"
+
+    # 漏掉一个类别的框，并把另一个框平移到IoU低于0.5
+    degraded = [np.array([[40, 40, 80, 80, 0.9, 0]], dtype=np.float32)]
+    worse = detection_agreement(reference, degraded)
+    assert worse["map50"] == 0.0 and worse["recall"] == 0.0, f"检测不一致时指标应下降: {worse}"
+    print(f"  ✅ 一致: mAP {same['map50']}，不一致: mAP {worse['map50']}")
+
+
+def test_batch_scheduler():
+    """测试微批调度器的合批、结果分发和队列上限"""
+    print("📦 测试微批调度器...")
+
+    batches = []
+
+    def fake_infer(images):
+        batches.append(list(images))
+        return [f"result-{image}" for image in images]
+
+    async def run():
+        scheduler = BatchScheduler(fake_infer, window_ms=50, max_batch_size=4, max_queue_size=8)
+        scheduler.start()
+        try:
+            results = await asyncio.gather(*(scheduler.submit(i) for i in range(6)))
+        finally:
+            await scheduler.stop()
+        return results, scheduler.metrics()
+
+    results, metrics = asyncio.run(run())
+    assert results == [f"result-{i}" for i in range(6)], "结果未正确分发"
+    assert [len(batch) for batch in batches] == [4, 2], f"合批结果异常: {batches}"
+    assert metrics["images_total"] == 6 and metrics["batches_total"] == 2
+    print(f"  ✅ 6 张图片合并为 {metrics['batches_total']} 个批次")
+
+    def slow_infer(images):
+        time.sleep(0.2)
+        return list(images)
+
+    async def overload():
+        scheduler = BatchScheduler(slow_infer, window_ms=0, max_batch_size=1, max_queue_size=1)
+        scheduler.start()
+        # 第一张进入推理，第二张占满队列
+        pending = [asyncio.ensure_future(scheduler.submit(0))]
+        await asyncio.sleep(0.05)
+        pending.append(asyncio.ensure_future(scheduler.submit(1)))
+        await asyncio.sleep(0.01)
+        try:
+            await scheduler.submit(99)
+            return False
+        except SchedulerOverloadedError:
+            return True
+        finally:
+            await scheduler.stop()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    assert asyncio.run(overload()), "队列满时应拒绝请求"
+    print("  ✅ 队列满时正确拒绝请求")
+
+
+def test_executors_keep_event_loop_responsive():
+    """测试推理和数据库任务不会阻塞事件循环"""
+    print("⚙️ 测试后台执行器...")
+
+    async def run():
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        beat = asyncio.ensure_future(heartbeat())
+        slow_result, db_thread = await asyncio.gather(
+            run_inference(lambda: time.sleep(0.3) or "done"),
+            run_db(threading.current_thread)
+        )
+        beat.cancel()
+        return ticks, slow_result, db_thread
+
+    try:
+        ticks, slow_result, db_thread = asyncio.run(run())
+    finally:
+        shutdown_executors()
+
+    assert slow_result == "done"
+    assert db_thread is not threading.main_thread(), "数据库任务应在线程池中执行"
+    assert ticks >= 10, f"推理期间事件循环被阻塞（心跳 {ticks} 次）"
+    print(f"  ✅ 推理期间事件循环保持响应（心跳 {ticks} 次）")
+
+
+def test_result_cache():
+    """测试检测结果缓存的命中、淘汰、过期和失效"""
+    print("🗃️ 测试结果缓存...")
+
+    results = [("plastic_bottle", 0.9, (0.1, 0.2, 0.5, 0.6)), ("paper", 0.4, None)]
+    with tempfile.TemporaryDirectory() as tmp:
+        disk_path = os.path.join(tmp, "cache.db")
+        cache = ResultCache(max_entries=2, ttl_seconds=60, disk_path=disk_path)
+
+        key, cached = cache.lookup(b"image-a")
+        assert cached is None
+        cache.put(key, results)
+        assert cache.lookup(b"image-a")[1] == results
+        assert cache.make_key(b"image-a", "other-model") != key, "模型版本应参与缓存键"
+        print("  ✅ 相同图片命中缓存")
+
+        for data in (b"image-b", b"image-c"):
+            cache.put(cache.lookup(data)[0], results)
+        metrics = cache.metrics()
+        assert metrics["entries"] == 2 and metrics["evictions"] == 1
+        print("  ✅ 超出容量时淘汰最久未使用的条目")
+
+        # 内存层被淘汰的条目仍可从磁盘层读取，重启后同样有效
+        cache.close()
+        restarted = ResultCache(max_entries=2, ttl_seconds=60, disk_path=disk_path)
+        assert restarted.lookup(b"image-a")[1] == results
+        assert restarted.metrics()["disk_hits"] == 1
+        print("  ✅ 磁盘层在重启后仍然有效")
+
+        restarted.on_model_swap("old-model", "new-model")
+        assert restarted.get(key) is None, "模型切换后旧结果应失效"
+        assert restarted.metrics()["disk_entries"] == 0
+        restarted.close()
+        print("  ✅ 模型切换后缓存失效")
+
+        # 磁盘层条目数在内存中维护，写入时不再全表计数
+        bounded = ResultCache(max_entries=0, ttl_seconds=60, disk_path=disk_path, disk_max_entries=2)
+        keys = [bounded.lookup(data)[0] for data in (b"image-a", b"image-b", b"image-c")]
+        for key in keys[:2]:
+            bounded.put(key, results)
+        bounded.put(keys[0], results)
+        assert bounded.metrics()["disk_entries"] == 2, "覆盖写入不应增加条目数"
+        bounded.put(keys[2], results)
+        assert bounded.metrics()["disk_entries"] == 2 and bounded.get(keys[1]) is None
+        bounded.close()
+        reopened = ResultCache(max_entries=0, ttl_seconds=60, disk_path=disk_path, disk_max_entries=2)
+        assert reopened.metrics()["disk_entries"] == 2
+        reopened.close()
+        print("  ✅ 磁盘层容量按内存中的条目数裁剪")
+
+    expiring = ResultCache(max_entries=2, ttl_seconds=0.05, disk_path="")
+    key = expiring.lookup(b"image-a")[0]
+    expiring.put(key, results)
+    time.sleep(0.1)
+    assert expiring.get(key) is None
+    assert expiring.metrics()["expirations"] == 1
+    print("  ✅ 过期条目不再命中")
+
+
+def test_single_flight():
+    """测试相同键的并发调用只执行一次"""
+    print("🛫 测试单飞合并...")
+
+    flight = SingleFlight()
+    calls = 0
+
+    async def infer():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return [("can", 0.8)]
+
+    async def run():
+        same = await asyncio.gather(*[flight.do("image-a", infer) for _ in range(5)])
+        other = await flight.do("image-b", infer)
+        return same, other
+
+    same, other = asyncio.run(run())
+    assert calls == 2, f"相同图片应只推理一次，实际 {calls} 次"
+    assert all(result == [("can", 0.8)] for result in same) and other == [("can", 0.8)]
+    metrics = flight.metrics()
+    assert metrics == {"in_flight": 0, "executed_total": 2, "coalesced_total": 4}
+    print("  ✅ 并发的相同请求共享同一次推理")
+
+    async def failing():
+        raise ValueError("无效图片")
+
+    async def run_failing():
+        return await asyncio.gather(*[flight.do("bad", failing) for _ in range(3)], return_exceptions=True)
+
+    errors = asyncio.run(run_failing())
+    assert all(isinstance(e, ValueError) for e in errors), "异常应传递给所有等待者"
+    print("  ✅ 异常传递给所有等待者")
+
+
+def test_tiling():
+    """测试大图切片和接缝处重复检测的合并"""
+    print("🧩 测试切片推理...")
+
+    assert tile_origins(500, 640, 0.2) == [0], "小于切片尺寸的图片不切分"
+    origins = tile_origins(2000, 640, 0.2)
+    assert origins[0] == 0 and origins[-1] == 2000 - 640
+    assert all(b - a <= 512 for a, b in zip(origins, origins[1:])), "相邻切片应互相重叠"
+
+    image = np.zeros((1500, 2000, 3), dtype=np.uint8)
+    tiles, offsets = slice_image(image, 640, 0.2)
+    assert len(tiles) == len(offsets) == 3 * 4
+    assert all(tile.shape == (640, 640, 3) for tile in tiles)
+    assert all(np.shares_memory(tile, image) for tile in tiles), "切片应为原图视图"
+    print(f"  ✅ 2000x1500 图片切分为 {len(tiles)} 块")
+
+    # 同一物体在两个相邻切片中被检测到，映射回原图后应只保留一个
+    boxes = np.array([
+        [600, 100, 700, 200, 0.9, 39],
+        [602, 101, 699, 198, 0.8, 39],
+        [602, 101, 699, 198, 0.7, 41],
+        [1200, 900, 1260, 960, 0.6, 39],
+    ], dtype=np.float32)
+    merged = merge_detections(boxes)
+    assert len(merged) == 3
+    assert np.allclose(sorted(merged[:, 4]), [0.6, 0.7, 0.9])
+    print("  ✅ 接缝处的重复检测被合并")
+
+    # 切片批次在共享线程池中执行，单个请求的并行度受 limit 限制
+    running = peak = 0
+    lock = threading.Lock()
+    names = set()
+
+    def run_batch(n):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+            names.add(threading.current_thread().name)
+        time.sleep(0.01)
+        with lock:
+            running -= 1
+        return n * 2
+
+    try:
+        assert _map_shared(run_batch, [(n,) for n in range(12)], 2) == [n * 2 for n in range(12)]
+        pool = get_executor("tile")
+        _map_shared(run_batch, [(n,) for n in range(4)], 2)
+        assert get_executor("tile") is pool, "切片线程池应在请求间共享"
+    finally:
+        shutdown_executors()
+    assert peak <= 2, f"同时执行的批次数超过限制: {peak}"
+    assert all(name.startswith("tile") for name in names)
+    print(f"  ✅ 切片批次在共享线程池中执行（最多 {peak} 个同时进行）")
+
+    # 切片请求在分发线程中等待批次，推理执行器仍可处理其他请求
+    class SlowBackend:
+        class_lookup = build_class_lookup({39: "bottle"})
+
+        def predict(self, tiles):
+            time.sleep(0.1)
+            return [np.array([[10, 10, 50, 50, 0.9, 39]], dtype=np.float32) for _ in tiles]
+
+    class FakeRegistry:
+        def get(self, model_path):
+            return SlowBackend()
+
+    async def run_concurrently(workers):
+        tiled = asyncio.ensure_future(run_tiled(classify_tiled, image, workers=workers))
+        await asyncio.sleep(0.02)
+        await run_inference(lambda: None)
+        blocked = tiled.done()
+        return blocked, await tiled
+
+    originals = ai.tiling.MODEL_PATH, ai.tiling.model_registry
+    ai.tiling.MODEL_PATH, ai.tiling.model_registry = __file__, FakeRegistry()
+    try:
+        for workers in (1, 2):
+            blocked, results = asyncio.run(run_concurrently(workers))
+            assert not blocked, "切片请求不应占住推理执行器"
+            assert [label for label, _, _ in results] == ["plastic_bottle"] * len(tiles)
+    finally:
+        ai.tiling.MODEL_PATH, ai.tiling.model_registry = originals
+        shutdown_executors()
+    print("  ✅ 切片推理期间推理执行器仍可处理其他请求")
+
+
+def main():
+    """运行所有测试"""
+    print("🧪 开始AI推理模块测试...\n")
+
+    tests = [
+        ("模型注册表", test_model_registry),
+        ("模型文件替换", test_model_reload),
+        ("内存推理路径", test_in_memory_inference),
+        ("像素数限制", test_image_pixel_guard),
+        ("JPEG缩小解码", test_reduced_decode),
+        ("ONNX后处理", test_onnx_postprocessing),
+        ("预处理张量池", test_preprocess_pool),
+        ("向量化后处理", test_vectorized_postprocessing),
+        ("量化精度校验", test_quantization_guardrail_metrics),
+        ("微批调度器", test_batch_scheduler),
+        ("后台执行器", test_executors_keep_event_loop_responsive),
+        ("结果缓存", test_result_cache),
+        ("单飞合并", test_single_flight),
+        ("切片推理", test_tiling),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            print(f"✅ {test_name} 测试通过\n")
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test_name} 测试失败: {e}\n")
+
+    print(f"📊 {passed}/{len(tests)} 个测试通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
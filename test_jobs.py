@@ -0,0 +1,303 @@
+"""
+异步检测任务队列测试
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlmodel import SQLModel, Session, create_engine, func, select
+
+import jobs
+
+from db.crud import (
+    add_job_items, claim_job, complete_job_item, create_job, finish_job, get_job, get_job_results, renew_job_lease
+)
+from db.models import DetectionCreate, DetectionRecord, InferenceRequestCreate, Job, JobItem
+from jobs import JobQueue, JobSubscription, RetryableJobError, parse_job_results
+
+
+def _test_engine():
+    """每个测试使用独立的临时数据库"""
+    path = os.path.join(tempfile.mkdtemp(), "jobs.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+def test_claim_and_lease():
+    """测试任务领取、租约过期后重新领取和重试次数上限"""
+    print("🔒 测试任务领取和租约...")
+
+    engine = _test_engine()
+    with Session(engine) as session:
+        create_job(session, Job(id="job1", status="queued", total=1, max_attempts=2))
+
+        job = claim_job(session, lease_seconds=60)
+        assert job.id == "job1" and job.status == "running" and job.attempts == 1
+        assert claim_job(session, lease_seconds=60) is None, "租约有效期内不能被重复领取"
+        print("  ✅ 同一任务只会被一个工作者领取")
+
+        # 模拟工作者进程崩溃：租约过期后任务被重新领取
+        job.locked_until = datetime.now() - timedelta(seconds=1)
+        session.add(job)
+        session.commit()
+        job = claim_job(session, lease_seconds=60)
+        assert job.attempts == 2
+        print("  ✅ 租约过期后任务被重新领取")
+
+        job.locked_until = datetime.now() - timedelta(seconds=1)
+        session.add(job)
+        session.commit()
+        assert claim_job(session, lease_seconds=60) is None
+        session.expire_all()
+        assert get_job(session, "job1").status == "failed", "超过重试次数后任务应失败"
+        print("  ✅ 超过重试次数后任务标记为失败")
+
+
+def test_duplicate_completion():
+    """测试租约过期后重复处理同一张图片只记录一次，以及续约只对持有租约的工作者生效"""
+    print("🔁 测试重复完成和续约...")
+
+    engine = _test_engine()
+    with Session(engine) as session:
+        create_job(session, Job(id="job1", status="queued", total=1))
+        add_job_items(session, [JobItem(job_id="job1", position=0, filename="a.jpg", status="pending", data=b"ok")])
+        first = claim_job(session, lease_seconds=60)
+        item_id = session.exec(select(JobItem.id)).one()
+        request = InferenceRequestCreate(
+            filename="a.jpg",
+            detections=[DetectionCreate(label="塑料瓶", confidence=0.9)]
+        )
+
+        assert complete_job_item(session, item_id, "job1", "[]", None, request, 60)
+        assert not complete_job_item(session, item_id, "job1", "[]", None, request, 60), "已完成的图片不应再次记录"
+        session.expire_all()
+        job = get_job(session, "job1")
+        assert (job.processed, job.succeeded) == (1, 1)
+        assert session.exec(select(func.count()).select_from(DetectionRecord)).one() == 1
+        print("  ✅ 同一张图片只计入一次进度、只保存一次检测记录")
+
+        assert renew_job_lease(session, "job1", first.attempts, 60)
+        assert not renew_job_lease(session, "job1", first.attempts + 1, 60), "其他工作者不能续约"
+        print("  ✅ 只有持有租约的工作者可以续约")
+
+        assert not finish_job(session, "job1", "failed", "过期", attempts=first.attempts + 1)
+        session.expire_all()
+        assert get_job(session, "job1").status == "running", "租约已被接管的工作者不能结束任务"
+        assert finish_job(session, "job1", "completed", attempts=first.attempts)
+        session.expire_all()
+        assert get_job(session, "job1").status == "completed"
+        print("  ✅ 只有持有租约的工作者可以结束任务")
+
+
+def test_failed_submit():
+    """测试提交中途失败的任务被标记为失败并清空已写入的图片"""
+    print("🧹 测试提交失败的清理...")
+
+    engine = _test_engine()
+    original_engine, jobs.engine = jobs.engine, engine
+
+    async def entries():
+        for position in range(3):
+            yield f"{position}.jpg", b"ok", None
+        raise ValueError("压缩包已损坏")
+
+    async def run():
+        queue = JobQueue(lambda data: None)
+        jobs.JOB_INSERT_CHUNK, original_chunk = 2, jobs.JOB_INSERT_CHUNK
+        try:
+            await queue.submit(entries())
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("提交失败时应抛出原始异常")
+        finally:
+            jobs.JOB_INSERT_CHUNK = original_chunk
+
+    async def no_entries():
+        for entry in []:
+            yield entry
+
+    async def run_empty():
+        try:
+            await JobQueue(lambda data: None).submit(no_entries())
+        except ValueError as e:
+            return str(e)
+        raise AssertionError("没有图片时应抛出ValueError")
+
+    try:
+        asyncio.run(run())
+        empty_error = asyncio.run(run_empty())
+    finally:
+        jobs.engine = original_engine
+    assert empty_error == "没有找到可检测的图片"
+    with Session(engine) as session:
+        job = session.exec(select(Job)).one()
+        items = session.exec(select(JobItem)).all()
+    assert job.status == "failed" and job.error == "压缩包已损坏", f"任务状态异常: {job.status}"
+    assert job.finished_at is not None
+    assert len(items) == 2 and all(item.data is None for item in items), "已写入的图片数据应被清空"
+    print("  ✅ 提交失败的任务不会停留在 receiving 状态")
+    print("  ✅ 没有图片的提交不留下任务")
+
+
+def test_lease_renewal():
+    """测试检测耗时超过租约时，处理中的任务会定期续约而不被重新领取"""
+    print("⏳ 测试处理中续约...")
+
+    engine = _test_engine()
+    original_engine, jobs.engine = jobs.engine, engine
+
+    async def classify(data: bytes):
+        await asyncio.sleep(0.5)
+        return []
+
+    async def entries():
+        yield "a.jpg", b"ok", None
+
+    async def run():
+        queue = JobQueue(classify, workers=2, lease_seconds=0.2, poll_interval=0.02)
+        queue.start()
+        try:
+            job = await queue.submit(entries())
+            for _ in range(100):
+                with Session(engine) as session:
+                    job = get_job(session, job.id)
+                if job.status in ("completed", "failed"):
+                    break
+                await asyncio.sleep(0.02)
+            return job
+        finally:
+            await queue.stop()
+
+    try:
+        job = asyncio.run(run())
+    finally:
+        jobs.engine = original_engine
+    assert job.status == "completed" and job.attempts == 1, f"任务被重新领取: {job.status}, {job.attempts}"
+    print("  ✅ 租约在处理期间持续有效")
+
+
+def test_job_queue():
+    """测试任务提交、逐张检测、单张失败和暂时失败后的重试"""
+    print("📋 测试异步任务队列...")
+
+    engine = _test_engine()
+    original_engine, jobs.engine = jobs.engine, engine
+    flaky_calls = 0
+    published = []
+
+    async def classify(data: bytes):
+        nonlocal flaky_calls
+        if data == b"bad":
+            raise ValueError("无效的图片文件")
+        if data == b"flaky":
+            flaky_calls += 1
+            if flaky_calls == 1:
+                raise RetryableJobError("推理队列已满")
+        return [{"class_name": "塑料瓶", "confidence": 0.9, "box": (0.1, 0.2, 0.3, 0.4)}]
+
+    async def entries():
+        for name, data, error in [
+            ("a.jpg", b"ok", None),
+            ("b.jpg", b"bad", None),
+            ("c.txt", None, "文件类型错误"),
+            ("d.jpg", b"flaky", None),
+        ]:
+            yield name, data, error
+
+    async def run():
+        queue = JobQueue(classify, workers=2, item_concurrency=2, poll_interval=0.02, retry_delay=0.05)
+        queue._publish = lambda job_id, event: published.append(event)
+        queue.start()
+        try:
+            job = await queue.submit(entries())
+            assert job.status == "queued" and job.total == 4
+            for _ in range(200):
+                with Session(engine) as session:
+                    job = get_job(session, job.id)
+                # 状态先提交，结束事件在提交返回后才推送
+                if job.status in ("completed", "failed") and any(e["type"] == "end" for e in published):
+                    break
+                await asyncio.sleep(0.02)
+            return job, queue.metrics()
+        finally:
+            await queue.stop()
+
+    try:
+        job, metrics = asyncio.run(run())
+    finally:
+        jobs.engine = original_engine
+    assert job.status == "completed", f"任务状态异常: {job.status}"
+    assert (job.processed, job.succeeded, job.failed) == (4, 2, 2)
+    assert job.attempts == 2 and metrics["retried_total"] == 1
+    print("  ✅ 暂时失败的任务重试后完成")
+
+    with Session(engine) as session:
+        items = parse_job_results(get_job_results(session, job.id))
+    assert [item["status"] for item in items] == ["done", "failed", "failed", "done"]
+    assert items[0]["detections"] == [{"class_name": "塑料瓶", "confidence": 0.9}]
+    assert items[1]["error"] == "无效的图片文件"
+    print("  ✅ 单张图片失败不影响整个任务")
+
+    live = {event["item"]["position"]: event["item"] for event in published if event["type"] == "item"}
+    assert live and all(live[position] == items[position] for position in live), "实时事件应与保存的结果格式一致"
+    assert [event["status"] for event in published if event["type"] == "end"] == ["completed"]
+    print("  ✅ 实时事件与重新同步的图片结果一致")
+
+    with Session(engine) as session:
+        boxes = session.exec(select(DetectionRecord.x1, DetectionRecord.y1, DetectionRecord.x2, DetectionRecord.y2)).all()
+    assert len(boxes) == 2 and all(tuple(box) == (0.1, 0.2, 0.3, 0.4) for box in boxes), boxes
+    print("  ✅ 检测框写入检测记录表")
+
+
+def test_job_subscription():
+    """测试进度事件订阅的缓冲和落后标记"""
+    print("📡 测试任务事件订阅...")
+
+    async def run():
+        subscription = JobSubscription("job1", maxsize=2)
+        for position in range(3):
+            subscription.publish({"type": "item", "item": {"position": position}})
+        first = await subscription.get(timeout=0.1)
+        await subscription.get(timeout=0.1)
+        empty = await subscription.get(timeout=0.01)
+        return subscription, first, empty
+
+    subscription, first, empty = asyncio.run(run())
+    assert first["item"]["position"] == 0
+    assert empty is None, "没有事件时应超时返回None"
+    assert subscription.lagged, "缓冲区写满后应标记为落后，由订阅者从数据库重新同步"
+    print("  ✅ 读取慢的订阅者不会阻塞工作者")
+
+
+def main():
+    """运行所有测试"""
+    print("🧪 开始异步任务队列测试...\n")
+
+    tests = [
+        ("任务领取和租约", test_claim_and_lease),
+        ("重复完成和续约", test_duplicate_completion),
+        ("提交失败的清理", test_failed_submit),
+        ("处理中续约", test_lease_renewal),
+        ("异步任务队列", test_job_queue),
+        ("任务事件订阅", test_job_subscription),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            print(f"✅ {test_name} 测试通过\n")
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test_name} 测试失败: {e}\n")
+
+    print(f"📊 {passed}/{len(tests)} 个测试通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -163,7 +163,7 @@ def test_fastapi_app():
         
         # 检查路由
         routes = [route.path for route in app.routes]
-        expected_routes = ["/", "/api/predict", "/api/history", "/api/stats", "/api/recent", "/health"]
+        expected_routes = ["/", "/api/predict", "/api/predict/batch", "/api/history", "/api/stats", "/api/recent", "/health"]
         
         print("  - 检查API路由...")
         for route in expected_routes:
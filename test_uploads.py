@@ -0,0 +1,296 @@
+"""
+上传文件处理测试
+"""
+import asyncio
+import io
+import sys
+import tarfile
+import threading
+import zipfile
+
+from uploads import (
+    BufferPool, UploadLimitMiddleware, UploadTooLargeError, _read_into,
+    archive_format, iter_archive
+)
+
+
+def _zip_archive(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def _tar_archive(entries):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in entries.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+def test_archive_format():
+    """测试压缩包格式识别"""
+    print("🗜️ 测试压缩包格式识别...")
+
+    assert archive_format("survey.zip", None) == "zip"
+    assert archive_format("survey.tar.gz", "application/octet-stream") == "tar"
+    assert archive_format("upload", "application/zip") == "zip"
+    assert archive_format("photo.jpg", "image/jpeg") is None
+    print("  ✅ 按扩展名和内容类型识别压缩包")
+
+
+def test_iter_archive():
+    """测试压缩包条目的流式读取"""
+    print("📦 测试压缩包流式读取...")
+
+    entries = {
+        "survey/001.jpg": b"a" * 10,
+        "survey/002.png": b"b" * 10,
+        "survey/notes.txt": b"ignored",
+        "__MACOSX/survey/._001.jpg": b"ignored",
+        "survey/big.jpg": b"c" * 100,
+    }
+
+    for fmt, archive in (("zip", _zip_archive(entries)), ("tar", _tar_archive(entries))):
+        results = list(iter_archive(archive, fmt, max_entry_size=50))
+        names = [name for name, _, _ in results]
+        assert names == ["survey/001.jpg", "survey/002.png", "survey/big.jpg"], f"{fmt}: {names}"
+        assert results[0][1] == b"a" * 10 and results[0][2] is None
+        assert results[2][1] is None and results[2][2], "超限条目应返回错误信息"
+        print(f"  ✅ {fmt.upper()} 只读取图片条目，超限条目单独报错")
+
+    try:
+        list(iter_archive(io.BytesIO(b"not an archive"), "zip"))
+        raise AssertionError("无效压缩包应报错")
+    except ValueError:
+        print("  ✅ 无效压缩包被拒绝")
+
+
+def test_truncated_archive():
+    """测试截断的TAR压缩包：已读出的条目保留，损坏位置单独报错"""
+    print("✂️ 测试截断的压缩包...")
+
+    entries = {f"survey/{i:03d}.jpg": bytes([i]) * 4000 for i in range(3)}
+    data = _tar_archive(entries).getvalue()
+    plain = io.BytesIO()
+    with tarfile.open(fileobj=plain, mode="w") as archive:
+        for name, content in entries.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+
+    # 截断在第二个条目的数据中间
+    results = list(iter_archive(io.BytesIO(plain.getvalue()[:512 * 12]), "tar"))
+    assert [name for name, _, _ in results] == ["survey/000.jpg", "survey/001.jpg"], results
+    assert results[0][1] == entries["survey/000.jpg"] and results[0][2] is None
+    assert results[1][1] is None and "损坏" in results[1][2]
+    print("  ✅ TAR条目读到一半被截断时报告该条目，前面的条目照常读出")
+
+    # gzip流被截断，依截断位置在某个条目或整个压缩包上报错
+    for cut in range(32, len(data), 16):
+        try:
+            results = list(iter_archive(io.BytesIO(data[:cut]), "tar"))
+        except ValueError:
+            continue
+        if [name for name, content, _ in results if content is not None] == list(entries):
+            continue  # 只缺少结尾的空块，条目都已完整读出
+        assert results and results[-1][1] is None and results[-1][2], (cut, results)
+    print("  ✅ 截断的TGZ压缩包报告错误，不抛出读取异常")
+
+    from fastapi.testclient import TestClient
+    from PIL import Image
+    import main
+
+    image = io.BytesIO()
+    Image.new("RGB", (32, 32), "blue").save(image, "PNG")
+    files = [
+        ("files", ("ok.png", image.getvalue(), "image/png")),
+        ("files", ("survey.tar", plain.getvalue()[:512 * 12], "application/x-tar")),
+    ]
+    with TestClient(main.app) as client:
+        response = client.post("/api/predict/batch", files=files)
+        assert response.status_code == 200, response.text
+        items = {item["filename"]: item for item in response.json()["items"]}
+        assert items["ok.png"]["success"], items
+        assert not items["survey.tar/survey/001.jpg"]["success"], items
+        print("  ✅ 批量检测中截断的压缩包按条目报错，其他图片的结果保留")
+
+        response = client.post("/api/jobs", files=files)
+        assert response.status_code == 202, response.text
+        print("  ✅ 异步任务可以提交包含截断压缩包的上传")
+
+
+def test_buffer_pool():
+    """测试上传缓冲池的读取限制和复用"""
+    print("♻️ 测试上传缓冲池...")
+
+    pool = BufferPool(buffer_size=101, max_buffers=1)
+    lease = pool.acquire()
+    lease.size = _read_into(io.BytesIO(b"x" * 100), lease.buffer, 100)
+    assert bytes(lease.view) == b"x" * 100
+    try:
+        _read_into(io.BytesIO(b"x" * 101), lease.buffer, 100)
+        raise AssertionError("超限数据应报错")
+    except UploadTooLargeError:
+        print("  ✅ 超过限制时立即停止读取")
+
+    # 推理任务持有引用期间缓冲区不会被归还
+    buffer = lease.buffer
+    lease.retain()
+    lease.release()
+    assert pool.metrics()["free"] == 0
+    lease.release()
+    assert pool.metrics()["free"] == 1
+    assert pool.acquire().buffer is buffer
+    assert pool.metrics()["reused_total"] == 1
+    print("  ✅ 引用全部释放后缓冲区被复用")
+
+    # 已知上传大小时按块取整分配，不为小文件分配最大尺寸
+    from uploads import UPLOAD_CHUNK_SIZE, read_upload
+    from fastapi import UploadFile
+
+    pool = BufferPool(buffer_size=10 * UPLOAD_CHUNK_SIZE + 1, max_buffers=2)
+    small = pool.acquire(UPLOAD_CHUNK_SIZE + 10)
+    assert len(small.buffer) == 2 * UPLOAD_CHUNK_SIZE
+    assert len(pool.acquire().buffer) == 10 * UPLOAD_CHUNK_SIZE + 1
+    small.release()
+    assert pool.acquire(5 * UPLOAD_CHUNK_SIZE).buffer is not small.buffer, "过小的空闲缓冲区不应借出"
+    print("  ✅ 按上传大小分配缓冲区")
+
+    data = b"y" * (3 * UPLOAD_CHUNK_SIZE)
+    pool = BufferPool(buffer_size=10 * UPLOAD_CHUNK_SIZE + 1, max_buffers=0)
+    for size in (len(data), 10):
+        # 大小与实际数据不符时改用最大尺寸的缓冲区重新读取
+        upload = asyncio.run(read_upload(UploadFile(io.BytesIO(data), size=size), pool=pool, limit=10 * UPLOAD_CHUNK_SIZE))
+        assert bytes(upload.view) == data, size
+        upload.release()
+    print("  ✅ 声明的大小不准确时仍完整读取")
+
+    # 读取失败时缓冲区归还；请求被取消时读取线程可能仍在写入，缓冲区不归还
+    pool = BufferPool(buffer_size=10 * UPLOAD_CHUNK_SIZE + 1, max_buffers=2)
+    try:
+        asyncio.run(read_upload(UploadFile(io.BytesIO(data)), pool=pool, limit=UPLOAD_CHUNK_SIZE))
+        raise AssertionError("超限数据应报错")
+    except UploadTooLargeError:
+        pass
+    assert pool.metrics()["free"] == 1, "读取失败后缓冲区应归还"
+
+    unblock = threading.Event()
+
+    class SlowFile(io.BytesIO):
+        def readinto(self, buffer):
+            unblock.wait(5)
+            return super().readinto(buffer)
+
+    async def cancel_read():
+        task = asyncio.ensure_future(read_upload(UploadFile(SlowFile(data)), pool=pool))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        unblock.set()
+
+    pool = BufferPool(buffer_size=10 * UPLOAD_CHUNK_SIZE + 1, max_buffers=2)
+    asyncio.run(cancel_read())
+    assert pool.metrics()["free"] == 0, "被取消的读取不应归还缓冲区"
+    print("  ✅ 读取失败时归还缓冲区，请求取消时不归还")
+
+
+def test_upload_limit_middleware():
+    """测试请求体大小限制中间件"""
+    print("🚧 测试上传大小限制中间件...")
+
+    async def app(scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": body})
+
+    def request(chunks, content_length=None):
+        headers = [] if content_length is None else [(b"content-length", str(content_length).encode())]
+        scope = {"type": "http", "method": "POST", "path": "/upload", "headers": headers}
+        messages = [
+            {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+            for i, chunk in enumerate(chunks)
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        middleware = UploadLimitMiddleware(app, limits={"/upload": 10})
+        asyncio.run(middleware(scope, receive, send))
+        return sent[0]["status"], len(messages)
+
+    assert request([b"12345", b"678"]) == (200, 0)
+    assert request([b"12345"], content_length=100) == (413, 1), "Content-Length超限应直接拒绝"
+    status, unread = request([b"123456", b"789012", b"345"])
+    assert status == 413 and unread == 1, "分块上传超限后应停止接收"
+    print("  ✅ 超限请求返回413且不再读取剩余数据")
+
+    # 表单解析会把接收中断当作解析错误返回400，中间件应改为返回413
+    from fastapi.testclient import TestClient
+    import main
+
+    boundary = "upload-limit-test"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.jpg\"\r\n"
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + b"x" * (main.MAX_FILE_SIZE + 1024 * 1024) + f"\r\n--{boundary}--\r\n".encode()
+
+    def chunks():
+        for start in range(0, len(body), 1024 * 1024):
+            yield body[start:start + 1024 * 1024]
+
+    with TestClient(main.app) as client:
+        response = client.post(
+            "/api/predict", content=chunks(),
+            headers={"content-type": f"multipart/form-data; boundary={boundary}"}
+        )
+    assert response.status_code == 413, response.text
+    assert "超过大小限制" in response.json()["detail"]
+    print("  ✅ 通过应用分块上传超限文件返回413")
+
+
+def main():
+    """运行所有测试"""
+    print("🧪 开始上传文件处理测试...\n")
+
+    tests = [
+        ("压缩包格式识别", test_archive_format),
+        ("压缩包流式读取", test_iter_archive),
+        ("截断的压缩包", test_truncated_archive),
+        ("上传缓冲池", test_buffer_pool),
+        ("上传大小限制中间件", test_upload_limit_middleware),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        try:
+            test_func()
+            print(f"✅ {test_name} 测试通过\n")
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test_name} 测试失败: {e}\n")
+
+    print(f"📊 {passed}/{len(tests)} 个测试通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
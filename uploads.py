@@ -0,0 +1,416 @@
+"""
+上传文件处理
+
+请求体大小在接收过程中就受到限制，超限的上传不会被完整读入；
+单张图片读入可复用的预分配缓冲区，避免每个请求重新分配内存。
+批量检测接口既接受多个图片文件，也接受ZIP/TAR压缩包。
+压缩包逐个条目流式读取到内存，不会整体解压到磁盘。
+"""
+import asyncio
+import json
+import lzma
+import os
+import tarfile
+import threading
+import zipfile
+import zlib
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import UploadFile
+
+from executors import run_preprocess
+
+# 上传限制
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 单张图片最大10MB
+MAX_BATCH_UPLOAD_SIZE = int(os.getenv("MAX_BATCH_UPLOAD_SIZE", str(512 * 1024 * 1024)))  # 批量上传请求体上限
+MULTIPART_OVERHEAD = 64 * 1024  # multipart边界和表单字段的余量
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+# 上传缓冲区配置
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_BUFFER_POOL_SIZE = int(os.getenv("UPLOAD_BUFFER_POOL_SIZE", "8"))  # 空闲时保留的缓冲区数
+
+# 读取损坏或截断的压缩包时可能抛出的异常
+ARCHIVE_READ_ERRORS = (tarfile.TarError, zipfile.BadZipFile, EOFError, zlib.error, lzma.LZMAError, OSError)
+
+# 支持的图片和压缩包扩展名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+ARCHIVE_CONTENT_TYPES = {
+    "application/zip": "zip",
+    "application/x-zip-compressed": "zip",
+    "application/x-tar": "tar",
+    "application/gzip": "tar",
+    "application/x-gzip": "tar",
+    "application/x-bzip2": "tar",
+    "application/x-xz": "tar",
+}
+
+# 压缩包中的一个条目：(文件名, 图片字节, 错误信息)，读取失败时图片字节为None
+ArchiveEntry = Tuple[str, Optional[bytes], Optional[str]]
+
+
+class UploadTooLargeError(Exception):
+    """上传数据超过大小限制"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"上传数据超过大小限制（最大{limit // (1024 * 1024)}MB）")
+        self.limit = limit
+
+
+class PooledBuffer:
+    """
+    从缓冲池借出的缓冲区
+
+    引用计数归零时自动归还缓冲池；进行中的推理需要继续读取数据时先 retain，
+    用完后 release，避免缓冲区被下一个请求覆盖。
+    """
+
+    def __init__(self, pool: "BufferPool", buffer: bytearray):
+        self._pool = pool
+        self.buffer = buffer
+        self.size = 0
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    @property
+    def view(self) -> memoryview:
+        """已写入数据的只读视图"""
+        return memoryview(self.buffer)[:self.size].toreadonly()
+
+    def retain(self):
+        with self._lock:
+            self._refs += 1
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs != 0:
+                return
+        self._pool.put(self.buffer)
+
+
+class BufferPool:
+    """
+    上传缓冲区池，缓冲区用完后归还复用
+
+    已知上传大小时只分配按 UPLOAD_CHUNK_SIZE 取整的缓冲区，不为普通照片分配最大尺寸；
+    借出时优先复用能容纳数据的最小空闲缓冲区。
+    """
+
+    def __init__(self, buffer_size: int, max_buffers: int = UPLOAD_BUFFER_POOL_SIZE):
+        self.buffer_size = buffer_size
+        self.max_buffers = max(max_buffers, 0)
+        self._free: List[bytearray] = []
+        self._lock = threading.Lock()
+
+        # 指标
+        self._allocated_total = 0
+        self._reused_total = 0
+
+    def acquire(self, size: Optional[int] = None) -> PooledBuffer:
+        """
+        借出一个至少能容纳 size 字节（再多1字节用于判断超限）的缓冲区
+
+        Args:
+            size: 预计写入的字节数，为None时借出最大尺寸的缓冲区
+        """
+        needed = self.buffer_size if size is None else min(size + 1, self.buffer_size)
+        with self._lock:
+            fits = [i for i, buffer in enumerate(self._free) if len(buffer) >= needed]
+            if fits:
+                self._reused_total += 1
+                return PooledBuffer(self, self._free.pop(min(fits, key=lambda i: len(self._free[i]))))
+            self._allocated_total += 1
+        chunks = -(-needed // UPLOAD_CHUNK_SIZE)
+        return PooledBuffer(self, bytearray(min(chunks * UPLOAD_CHUNK_SIZE, self.buffer_size)))
+
+    def put(self, buffer: bytearray):
+        """归还缓冲区，池已满时替换掉更小的空闲缓冲区或交给垃圾回收"""
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buffer)
+                return
+            if not self._free:
+                return
+            smallest = min(range(len(self._free)), key=lambda i: len(self._free[i]))
+            if len(self._free[smallest]) < len(buffer):
+                self._free[smallest] = buffer
+
+    def metrics(self) -> Dict[str, int]:
+        """缓冲池指标"""
+        with self._lock:
+            return {
+                "buffer_size": self.buffer_size,
+                "free": len(self._free),
+                "allocated_total": self._allocated_total,
+                "reused_total": self._reused_total,
+            }
+
+
+# 单张图片上传共用的缓冲池，多留1字节用于判断是否超限
+upload_buffers = BufferPool(MAX_FILE_SIZE + 1)
+
+
+class BufferTooSmallError(Exception):
+    """数据比按预计大小分配的缓冲区更大"""
+
+
+def _read_into(fileobj: BinaryIO, buffer: bytearray, limit: int) -> int:
+    """分块读入缓冲区，超过 limit 字节时立即停止"""
+    view = memoryview(buffer)
+    size = 0
+    while size <= limit:
+        if size == len(buffer):
+            if fileobj.read(1):
+                raise BufferTooSmallError()
+            return size
+        count = fileobj.readinto(view[size:min(size + UPLOAD_CHUNK_SIZE, len(buffer))])
+        if not count:
+            return size
+        size += count
+    raise UploadTooLargeError(limit)
+
+
+def _upload_size(file: UploadFile) -> Optional[int]:
+    """上传文件的大小：表单解析时记录的大小，或该部分的 Content-Length"""
+    if file.size is not None:
+        return file.size
+    try:
+        return int(file.headers.get("content-length"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def read_upload(file: UploadFile, pool: BufferPool = upload_buffers, limit: int = MAX_FILE_SIZE) -> PooledBuffer:
+    """
+    把上传的文件读入缓冲池中的缓冲区
+
+    缓冲区按上传大小分配，大小未知或与实际数据不符时改用最大尺寸的缓冲区重新读取。
+
+    Args:
+        file: 上传的文件
+        pool: 缓冲池，最大缓冲区必须大于 limit
+        limit: 最大字节数
+
+    Returns:
+        PooledBuffer: 调用方用完后必须 release
+    """
+    size = _upload_size(file)
+    if size is not None and size > limit:
+        raise UploadTooLargeError(limit)
+    while True:
+        lease = pool.acquire(size)
+        try:
+            await file.seek(0)
+            lease.size = await run_preprocess(_read_into, file.file, lease.buffer, limit)
+        except BufferTooSmallError:
+            lease.release()
+            size = None
+            continue
+        except asyncio.CancelledError:
+            # 请求被取消时读取线程可能仍在写入，不归还缓冲区，交给垃圾回收
+            raise
+        except Exception:
+            # 读取失败（超限或读取出错）时读取已经结束，缓冲区归还缓冲池
+            lease.release()
+            raise
+        return lease
+
+
+async def read_upload_bytes(file: UploadFile, limit: int = MAX_FILE_SIZE) -> bytes:
+    """读取上传的文件，最多读入 limit + 1 字节，超限时抛出 UploadTooLargeError"""
+    data = await file.read(limit + 1)
+    if len(data) > limit:
+        raise UploadTooLargeError(limit)
+    return data
+
+
+class UploadLimitMiddleware:
+    """
+    在接收请求体的过程中限制上传大小的ASGI中间件
+
+    Content-Length 超限时直接返回413，不读取请求体；
+    没有 Content-Length（分块传输）时按已接收的字节数计算，超限后立即停止接收并返回413。
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+        limit = self.limits.get(scope["path"].rstrip("/") or "/")
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    if int(value) > limit:
+                        return await self._reject(send, limit)
+                except ValueError:
+                    pass
+                break
+
+        received = 0
+        exceeded = False
+        response_started = False
+        replaced = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                raise UploadTooLargeError(limit)
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLargeError(limit)
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started, replaced
+            if exceeded and not response_started:
+                # 应用可能把接收中断当作普通错误处理（例如表单解析失败返回400），
+                # 丢弃应用的响应，统一返回413
+                response_started = replaced = True
+                await self._reject(send, limit)
+                return
+            if replaced:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLargeError:
+            if replaced:
+                return
+            if response_started:
+                raise
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        body = json.dumps(
+            {"detail": str(UploadTooLargeError(limit))}, ensure_ascii=False
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def archive_format(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """
+    判断上传文件是否为压缩包
+
+    Returns:
+        Optional[str]: "zip"、"tar"，不是压缩包时返回None
+    """
+    name = (filename or "").lower()
+    if name.endswith(ZIP_EXTENSIONS):
+        return "zip"
+    if name.endswith(TAR_EXTENSIONS):
+        return "tar"
+    return ARCHIVE_CONTENT_TYPES.get((content_type or "").split(";")[0].strip().lower())
+
+
+def _is_image_entry(name: str) -> bool:
+    """跳过目录、隐藏文件（如 __MACOSX 元数据）和非图片条目"""
+    parts = name.replace("\\", "/").split("/")
+    if any(part.startswith(".") or part == "__MACOSX" for part in parts):
+        return False
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _read_limited(stream: BinaryIO, limit: int) -> Optional[bytes]:
+    """最多读取 limit 字节，超出限制时返回None"""
+    data = stream.read(limit + 1)
+    return None if len(data) > limit else data
+
+
+def iter_archive(fileobj: BinaryIO, fmt: str, max_entry_size: int = MAX_FILE_SIZE) -> Iterator[ArchiveEntry]:
+    """
+    逐个读取压缩包中的图片条目
+
+    每次只把一个条目读入内存；条目大小按实际解压的字节数限制，
+    即使条目头部声明的大小被篡改也不会读入超限的数据。
+    压缩包中途损坏或被截断时，已读出的条目照常产出：
+    ZIP的损坏条目单独报错，TAR无法越过损坏位置，报错后结束。
+
+    Args:
+        fileobj: 压缩包文件对象
+        fmt: "zip" 或 "tar"
+        max_entry_size: 单个条目的最大字节数
+
+    Yields:
+        ArchiveEntry: (条目名, 图片字节, 错误信息)
+
+    Raises:
+        ValueError: 不是有效的压缩包，或TAR压缩包在条目之间损坏
+    """
+    if fmt == "zip":
+        try:
+            archive = zipfile.ZipFile(fileobj)
+        except ARCHIVE_READ_ERRORS as e:
+            raise ValueError(f"无效的ZIP压缩包: {str(e)}")
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir() or not _is_image_entry(info.filename):
+                    continue
+                if info.file_size > max_entry_size:
+                    yield info.filename, None, "文件大小超过限制（最大10MB）"
+                    continue
+                try:
+                    with archive.open(info) as entry:
+                        data = _read_limited(entry, max_entry_size)
+                except (*ARCHIVE_READ_ERRORS, NotImplementedError, RuntimeError) as e:
+                    yield info.filename, None, f"读取压缩包条目失败: {str(e)}"
+                    continue
+                if data is None:
+                    yield info.filename, None, "文件大小超过限制（最大10MB）"
+                else:
+                    yield info.filename, data, None
+        return
+
+    if fmt == "tar":
+        try:
+            # 流式模式只向前读取，不需要随机访问整个压缩包
+            archive = tarfile.open(fileobj=fileobj, mode="r|*")
+        except ARCHIVE_READ_ERRORS as e:
+            raise ValueError(f"无效的TAR压缩包: {str(e)}")
+        with archive:
+            members = iter(archive)
+            while True:
+                try:
+                    member = next(members, None)
+                except ARCHIVE_READ_ERRORS as e:
+                    raise ValueError(f"TAR压缩包已损坏，后续条目无法读取: {str(e)}")
+                if member is None:
+                    return
+                if not member.isfile() or not _is_image_entry(member.name):
+                    continue
+                if member.size > max_entry_size:
+                    yield member.name, None, "文件大小超过限制（最大10MB）"
+                    continue
+                try:
+                    data = _read_limited(archive.extractfile(member), max_entry_size)
+                except ARCHIVE_READ_ERRORS as e:
+                    # 流式读取无法越过损坏的位置，后面的条目都读不到
+                    yield member.name, None, f"读取压缩包条目失败，压缩包已损坏: {str(e)}"
+                    return
+                yield member.name, data, None
+
+    raise ValueError(f"不支持的压缩包格式: {fmt}")